@@ -2,8 +2,13 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
+from sqlalchemy import event
 import uuid
 
+from search_index import normalize_arabic
+from db_utils import DocumentSequenceMixin
+from sales_rollup import DailySalesRollupMixin
+
 db = SQLAlchemy()
 
 # دالة لتوليد UUID
@@ -36,7 +41,7 @@ class Customer(db.Model):
     
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     name = db.Column(db.String(100), nullable=False)
-    phone = db.Column(db.String(20))
+    phone = db.Column(db.String(20), index=True)
     email = db.Column(db.String(100))
     address = db.Column(db.Text)
     city = db.Column(db.String(50))
@@ -44,10 +49,14 @@ class Customer(db.Model):
     notes = db.Column(db.Text)
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    search_text = db.Column(db.Text)  # الاسم والهاتف بعد التوحيد للبحث
     
     # العلاقات
     sales = db.relationship('Sale', backref='customer', lazy=True)
 
+    def build_search_text(self):
+        return normalize_arabic(self.name, self.phone)
+
 # نموذج الموردين
 class Supplier(db.Model):
     __tablename__ = 'suppliers'
@@ -122,12 +131,18 @@ class Product(db.Model):
     # التواريخ
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # البحث
+    search_text = db.Column(db.Text)  # الاسم والرمز والباركود والماركة بعد التوحيد
     
     # العلاقات
     sale_items = db.relationship('SaleItem', backref='product', lazy=True)
     purchase_items = db.relationship('PurchaseItem', backref='product', lazy=True)
     inventory_movements = db.relationship('InventoryMovement', backref='product', lazy=True)
 
+    def build_search_text(self):
+        return normalize_arabic(self.name, self.sku, self.barcode, self.brand)
+
 # نموذج فواتير البيع المحسن
 class Sale(db.Model):
     __tablename__ = 'sales'
@@ -193,12 +208,32 @@ class SaleItem(db.Model):
     unit_price = db.Column(db.Numeric(10, 2), nullable=False)  # سعر الوحدة
     discount_amount = db.Column(db.Numeric(10, 2), default=0)  # خصم العنصر
     total_price = db.Column(db.Numeric(12, 2), nullable=False)  # المجموع
+    cost_price = db.Column(db.Numeric(10, 2))  # تكلفة الوحدة وقت البيع (لأرباح الفترات السابقة)
     
     # معلومات إضافية
     notes = db.Column(db.Text)  # ملاحظات على العنصر
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+# نموذج عدادات أرقام المستندات (فواتير، شحنات)
+class DocumentSequence(DocumentSequenceMixin, db.Model):
+    pass
+
+# نموذج ملخص المبيعات اليومي (يُحدّث مع كل فاتورة)
+class DailySalesRollup(DailySalesRollupMixin, db.Model):
+    pass
+
+# نموذج ملخص حساب العميل (إجمالي المشتريات والمدفوع وعدد الفواتير)
+class CustomerBalance(db.Model):
+    __tablename__ = 'customer_balances'
+
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    customer_id = db.Column(db.String(36), db.ForeignKey('customers.id'), unique=True, nullable=False)
+
+    total_purchases = db.Column(db.Numeric(15, 2), default=0)
+    total_paid = db.Column(db.Numeric(15, 2), default=0)
+    invoices_count = db.Column(db.Integer, default=0)
+
 # نموذج فواتير الشراء
 class Purchase(db.Model):
     __tablename__ = 'purchases'
@@ -291,6 +326,7 @@ class Treasury(db.Model):
 
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     name = db.Column(db.String(100), nullable=False)
+    treasury_type = db.Column(db.String(20), index=True)  # main, shipping, bank
     description = db.Column(db.Text)
     current_balance = db.Column(db.Numeric(15, 2), default=0)
     is_active = db.Column(db.Boolean, default=True)
@@ -302,6 +338,9 @@ class Treasury(db.Model):
 # نموذج حركات الخزينة
 class TreasuryTransaction(db.Model):
     __tablename__ = 'treasury_transactions'
+    __table_args__ = (
+        db.Index('ix_treasury_transactions_treasury_created', 'treasury_id', 'created_at'),
+    )
 
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     treasury_id = db.Column(db.String(36), db.ForeignKey('treasury.id'), nullable=False)
@@ -326,6 +365,19 @@ class TreasuryTransaction(db.Model):
     # العلاقات
     user = db.relationship('User', backref='treasury_transactions')
 
+# نموذج لقطات أرصدة الخزائن (رصيد الخزينة في لحظة معينة)
+class TreasuryBalanceSnapshot(db.Model):
+    __tablename__ = 'treasury_balance_snapshots'
+    __table_args__ = (
+        db.UniqueConstraint('treasury_id', 'snapshot_at', name='uq_treasury_balance_snapshots_key'),
+    )
+
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    treasury_id = db.Column(db.String(36), db.ForeignKey('treasury.id'), nullable=False)
+    snapshot_at = db.Column(db.DateTime, nullable=False)
+    balance = db.Column(db.Numeric(15, 2), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 # نموذج عناوين العملاء المتعددة
 class CustomerAddress(db.Model):
     __tablename__ = 'customer_addresses'
@@ -428,7 +480,7 @@ class Shipment(db.Model):
     # قيد التحضير، جاهز للاستلام، تم الاستلام، في الطريق، تم التسليم، مرتجع، ملغي
 
     # رقم التتبع من شركة الشحن
-    tracking_number = db.Column(db.String(100))
+    tracking_number = db.Column(db.String(100), index=True)
 
     # ملاحظات
     notes = db.Column(db.Text)
@@ -650,3 +702,11 @@ class CollectionReport(db.Model):
 
     # العلاقات
     user = db.relationship('User', backref='collection_reports')
+
+# تحديث نص البحث تلقائياً عند الحفظ
+@event.listens_for(Product, 'before_insert')
+@event.listens_for(Product, 'before_update')
+@event.listens_for(Customer, 'before_insert')
+@event.listens_for(Customer, 'before_update')
+def update_search_text(mapper, connection, target):
+    target.search_text = target.build_search_text()
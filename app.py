@@ -7,22 +7,28 @@ VAYON - نظام إدارة الأزياء الرجالية الفاخرة
 import os
 import uuid
 import json
+import base64
 import threading
 import time
 import shutil
+import shlex
 from datetime import datetime, timedelta
 from decimal import Decimal
 from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file, make_response
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user, UserMixin
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
-from sqlalchemy import func, and_, or_, desc
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-from reportlab.lib.units import inch
-from reportlab.pdfbase import pdfutils
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.pdfbase import pdfmetrics
+from sqlalchemy import func, and_, or_, desc, select, text, tuple_
+from db_utils import (
+    DocumentSequenceMixin, next_sequence_value, upgrade_table, atomic_increment, whole_days_between, schema_upgrade_lock
+)
+import sales_rollup
+from sales_rollup import DailySalesRollupMixin, register_rollup_command
+from cache_utils import TTLCache, UserCache, VersionedCache
+from query_metrics import QueryMetrics
+from report_export import EXPORT_FORMATS, export_response, stream_rows
+from backup_engine import SQLiteBackupEngine, SchedulerLock, default_compression, retention_keep, stream_dump, unique_backup_path
+from pdf_documents import PDFCache, document_fingerprint, register_fonts
 
 # إنشاء التطبيق
 app = Flask(__name__)
@@ -40,6 +46,18 @@ else:
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['BACKUP_FOLDER'] = 'backups'
+app.config['BACKUP_INTERVAL_MINUTES'] = 3  # إذا لم تُحدد في إعدادات النشاط
+app.config['BACKUP_KEEP_HOURLY'] = int(os.environ.get('BACKUP_KEEP_HOURLY', 24))
+app.config['BACKUP_KEEP_DAILY'] = int(os.environ.get('BACKUP_KEEP_DAILY', 7))
+app.config['BACKUP_KEEP_WEEKLY'] = int(os.environ.get('BACKUP_KEEP_WEEKLY', 4))
+app.config['MAX_BACKUP_FILES'] = int(os.environ.get('MAX_BACKUP_FILES', 100))
+# أمر نسخ قواعد البيانات غير SQLite، و{database_url} يُستبدل برابط القاعدة
+app.config['BACKUP_DUMP_COMMAND'] = os.environ.get('BACKUP_DUMP_COMMAND', 'pg_dump --no-owner --exclude-table-data=backups --dbname={database_url}')
+app.config['BACKUP_DUMP_TIMEOUT'] = int(os.environ.get('BACKUP_DUMP_TIMEOUT', 1800))  # ثوانٍ
+app.config['BACKUP_COMPRESSION'] = os.environ.get('BACKUP_COMPRESSION') or default_compression()  # zstd أو gzip
+app.config['LIST_PAGE_SIZE'] = int(os.environ.get('LIST_PAGE_SIZE', 50))
+app.config['LIST_MAX_PAGE_SIZE'] = int(os.environ.get('LIST_MAX_PAGE_SIZE', 200))
+app.config['PDF_CACHE_FOLDER'] = os.environ.get('PDF_CACHE_FOLDER', 'pdf_cache')
 
 # إنشاء المجلدات المطلوبة
 os.makedirs('uploads', exist_ok=True)
@@ -62,7 +80,7 @@ login_manager.login_message_category = 'info'
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(user_id)
+    return user_cache.get(db.session, user_id)
 
 # ==================== نماذج قاعدة البيانات ====================
 
@@ -95,6 +113,13 @@ class User(UserMixin, db.Model):
             return resource in ['dashboard', 'reports_view', 'inventory_view']
         return False
 
+# ذاكرة مؤقتة للمستخدمين حتى لا يستعلم كل طلب عن المستخدم الحالي
+user_cache = UserCache.from_env(User, os.path.join(app.instance_path, 'user_cache.db'))
+user_cache.install(db.session)
+
+# عدد الاستعلامات وزمنها لكل طلب (/metrics)
+query_metrics = QueryMetrics(app)
+
 class BusinessSettings(db.Model):
     __tablename__ = 'business_settings'
     
@@ -112,6 +137,9 @@ class BusinessSettings(db.Model):
 
 class Customer(db.Model):
     __tablename__ = 'customers'
+    __table_args__ = (
+        db.Index('ix_customers_created_at_id', 'created_at', 'id'),
+    )
     
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     name = db.Column(db.String(100), nullable=False)
@@ -131,6 +159,9 @@ class Customer(db.Model):
 
 class Product(db.Model):
     __tablename__ = 'products'
+    __table_args__ = (
+        db.Index('ix_products_created_at_id', 'created_at', 'id'),
+    )
     
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     name = db.Column(db.String(100), nullable=False)
@@ -142,7 +173,8 @@ class Product(db.Model):
     # المخزون
     current_stock = db.Column(db.Numeric(12, 3), default=0)
     min_stock = db.Column(db.Numeric(12, 3), default=0)
-    
+    reserved_stock = db.Column(db.Numeric(12, 3), default=0)  # محجوز لأوامر تصنيع لم تُصرف بعد
+
     # الأسعار
     cost_price = db.Column(db.Numeric(12, 2), default=0)  # سعر التكلفة
     selling_price = db.Column(db.Numeric(12, 2), default=0)  # سعر البيع
@@ -201,11 +233,14 @@ class CashTransaction(db.Model):
 
 class Sale(db.Model):
     __tablename__ = 'sales'
+    __table_args__ = (
+        db.Index('ix_sales_created_at_id', 'created_at', 'id'),
+    )
 
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     invoice_number = db.Column(db.String(50), unique=True, nullable=False)
     customer_id = db.Column(db.String(36), db.ForeignKey('customers.id'), nullable=False)
-    sale_date = db.Column(db.DateTime, default=datetime.utcnow)
+    sale_date = db.Column(db.DateTime, default=datetime.utcnow, index=True)
 
     # المبالغ
     subtotal = db.Column(db.Numeric(15, 2), default=0)
@@ -332,6 +367,9 @@ class PurchaseReturnItem(db.Model):
 
 class Factory(db.Model):
     __tablename__ = 'factories'
+    __table_args__ = (
+        db.Index('ix_factories_created_at_id', 'created_at', 'id'),
+    )
 
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     name = db.Column(db.String(100), nullable=False)
@@ -352,6 +390,11 @@ class Factory(db.Model):
 
 class ManufacturingOrder(db.Model):
     __tablename__ = 'manufacturing_orders'
+    __table_args__ = (
+        db.Index('ix_manufacturing_orders_created_at_id', 'created_at', 'id'),
+        db.Index('ix_manufacturing_orders_factory_status', 'factory_id', 'status'),
+        db.Index('ix_manufacturing_orders_status_expected', 'status', 'expected_delivery_date'),
+    )
 
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     order_number = db.Column(db.String(50), unique=True, nullable=False)
@@ -409,6 +452,9 @@ class ManufacturingOrderFinishedProduct(db.Model):
 
 class Supplier(db.Model):
     __tablename__ = 'suppliers'
+    __table_args__ = (
+        db.Index('ix_suppliers_created_at_id', 'created_at', 'id'),
+    )
 
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     name = db.Column(db.String(100), nullable=False)
@@ -432,6 +478,9 @@ class Supplier(db.Model):
 
 class PurchaseInvoice(db.Model):
     __tablename__ = 'purchase_invoices'
+    __table_args__ = (
+        db.Index('ix_purchase_invoices_created_at_id', 'created_at', 'id'),
+    )
 
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     invoice_number = db.Column(db.String(50), unique=True, nullable=False)
@@ -486,41 +535,135 @@ class Backup(db.Model):
     filename = db.Column(db.String(255), nullable=False)
     file_path = db.Column(db.String(500), nullable=False)
     file_size = db.Column(db.Integer)
+    database_size = db.Column(db.Integer)  # حجم قاعدة البيانات قبل الضغط
+    content_hash = db.Column(db.String(64), index=True)  # SHA-256 لمنع تكرار نفس المحتوى
+    duration_seconds = db.Column(db.Float)
+    bytes_per_second = db.Column(db.Float)
+    table_counts = db.Column(db.Text)  # JSON: عدد الصفوف في كل جدول وقت النسخ
     backup_type = db.Column(db.String(20), default='auto')  # auto, manual
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     created_by = db.Column(db.String(36), db.ForeignKey('users.id'))
 
+class DocumentSequence(DocumentSequenceMixin, db.Model):
+    pass
+
+class DailySalesRollup(DailySalesRollupMixin, db.Model):
+    pass
+
 # ==================== الوظائف المساعدة ====================
 
-def generate_invoice_number(prefix='INV'):
-    """توليد رقم فاتورة فريد"""
-    today = datetime.now()
-    date_str = today.strftime('%Y%m%d')
-
-    if prefix == 'INV':
-        # فواتير البيع
-        last_invoice = SalesInvoice.query.filter(
-            SalesInvoice.invoice_number.like(f'INV-{date_str}-%')
-        ).order_by(desc(SalesInvoice.invoice_number)).first()
-    elif prefix == 'PUR':
-        # فواتير الشراء
-        last_invoice = PurchaseInvoice.query.filter(
-            PurchaseInvoice.invoice_number.like(f'PUR-{date_str}-%')
-        ).order_by(desc(PurchaseInvoice.invoice_number)).first()
-    else:
-        last_invoice = None
+def _last_document_number(column, number_prefix):
+    """آخر رقم تسلسلي مستخدم لبادئة معينة (يُستخدم فقط عند إنشاء عداد جديد)"""
+    last_number = db.session.query(column).filter(
+        column.like(f'{number_prefix}%')
+    ).order_by(desc(column)).limit(1).scalar()
 
-    if last_invoice:
-        # استخراج الرقم التسلسلي من آخر فاتورة
-        last_number = int(last_invoice.invoice_number.split('-')[-1])
-        new_number = last_number + 1
-    else:
-        new_number = 1
+    if not last_number:
+        return 0
+    try:
+        return int(last_number.split('-')[-1])
+    except ValueError:
+        return 0
+
+def generate_invoice_number(prefix='INV'):
+    """توليد رقم فاتورة فريد من عداد المستندات"""
+    date_str = datetime.now().strftime('%Y%m%d')
+
+    # العمود الذي يحمل أرقام كل نوع مستند
+    number_columns = {
+        'INV': Sale.invoice_number,
+        'SAL': Sale.invoice_number,
+        'PUR': PurchaseInvoice.invoice_number,
+        'MFG': ManufacturingOrder.order_number
+    }
+    column = number_columns.get(prefix)
+
+    new_number = next_sequence_value(
+        db.session, DocumentSequence.__table__, prefix, date_str,
+        seed=lambda: _last_document_number(column, f'{prefix}-{date_str}-') if column is not None else 0
+    )
 
     return f'{prefix}-{date_str}-{new_number:04d}'
 
-def update_stock(product_id, quantity, movement_type, reference_type=None, reference_id=None, unit_cost=None):
-    """تحديث المخزون"""
+def get_dashboard_stats(today=None):
+    """حساب إحصائيات لوحة التحكم باستعلام تجميعي واحد"""
+    # rollup_date هو يوم sale_date المحفوظ بتوقيت UTC، فاليوم الحالي من نفس المصدر
+    today = today or datetime.utcnow().date()
+
+    # مبيعات اليوم من الملخص اليومي بدلاً من مسح جدول الفواتير
+    today_rollup = and_(
+        DailySalesRollup.rollup_date == today,
+        DailySalesRollup.dimension == 'all'
+    )
+
+    def scalar(query):
+        return query.scalar_subquery()
+
+    row = db.session.execute(select(
+        scalar(select(DailySalesRollup.sales_count).where(today_rollup)).label('today_sales_count'),
+        scalar(select(DailySalesRollup.total_amount).where(today_rollup)).label('today_sales_amount'),
+        scalar(select(DailySalesRollup.cost_amount).where(today_rollup)).label('today_cost'),
+        scalar(select(func.count(Customer.id)).where(Customer.is_active == True)).label('total_customers'),
+        scalar(select(func.count(Product.id)).where(Product.is_active == True)).label('total_products'),
+        scalar(select(func.count(Supplier.id)).where(Supplier.is_active == True)).label('total_suppliers'),
+        scalar(select(func.count(Product.id)).where(
+            Product.current_stock <= Product.min_stock,
+            Product.min_stock > 0,
+            Product.is_active == True
+        )).label('low_stock_products'),
+        scalar(select(Cashbox.current_balance).where(
+            Cashbox.type == 'main', Cashbox.is_active == True
+        ).limit(1)).label('main_balance'),
+        scalar(select(Cashbox.current_balance).where(
+            Cashbox.type == 'shipping', Cashbox.is_active == True
+        ).limit(1)).label('shipping_balance'),
+        scalar(select(func.count(Sale.id)).where(
+            Sale.shipping_status.in_(['pending', 'shipped']),
+            Sale.status == 'active'
+        )).label('pending_shipments'),
+        scalar(select(func.count(Sale.id)).where(
+            Sale.remaining_amount > 0,
+            Sale.status == 'active'
+        )).label('unpaid_sales')
+    )).one()
+
+    today_sales_amount = float(row.today_sales_amount or 0)
+
+    return {
+        'today_sales_count': row.today_sales_count or 0,
+        'today_sales_amount': today_sales_amount,
+        'today_profit': today_sales_amount - float(row.today_cost or 0),
+        'total_customers': row.total_customers,
+        'total_products': row.total_products,
+        'total_suppliers': row.total_suppliers,
+        'low_stock_products': row.low_stock_products,
+        'main_balance': float(row.main_balance or 0),
+        'shipping_balance': float(row.shipping_balance or 0),
+        'pending_shipments': row.pending_shipments,
+        'unpaid_sales': row.unpaid_sales
+    }
+
+def record_sale_rollup(sale, items, sign=1):
+    """تحديث ملخص المبيعات اليومي بفاتورة داخل نفس المعاملة
+
+    items: صفوف عناصر الفاتورة (product_id, quantity, total_price, cost_price).
+    sign=-1 يعكس أثر الفاتورة عند المرتجع أو الإلغاء.
+    """
+    sales_rollup.record_sale_rollup(db.session, DailySalesRollup, sale, [
+        (item['product_id'], item['quantity'], item['total_price'], item['cost_price']) for item in items
+    ], sign)
+
+def rebuild_sales_rollup():
+    """إعادة بناء ملخص المبيعات اليومي من سجل الفواتير بالكامل"""
+    return sales_rollup.rebuild_sales_rollup(db.session, DailySalesRollup, Sale, SaleItem, Sale.status == 'active')
+
+register_rollup_command(app, rebuild_sales_rollup)
+
+def update_stock(product_id, quantity, movement_type, reference_type=None, reference_id=None, unit_cost=None, commit=True):
+    """تحديث المخزون
+
+    commit=False يترك الحفظ للمعاملة المستدعية.
+    """
     try:
         product = Product.query.get(product_id)
         if not product:
@@ -529,7 +672,8 @@ def update_stock(product_id, quantity, movement_type, reference_type=None, refer
         if movement_type == 'in':
             product.current_stock += Decimal(str(quantity))
         elif movement_type == 'out':
-            if product.current_stock < Decimal(str(quantity)):
+            # الكمية المحجوزة لأوامر التصنيع لا تُصرف لغيرها
+            if available_stock(product) < Decimal(str(quantity)):
                 return False
             product.current_stock -= Decimal(str(quantity))
 
@@ -545,33 +689,41 @@ def update_stock(product_id, quantity, movement_type, reference_type=None, refer
         )
 
         db.session.add(movement)
-        db.session.commit()
+        if commit:
+            db.session.commit()
         return True
 
     except Exception as e:
-        db.session.rollback()
+        if commit:
+            db.session.rollback()
         print(f"خطأ في تحديث المخزون: {e}")
         return False
 
-def update_cashbox(cashbox_id, amount, transaction_type, reference_type=None, reference_id=None, description=None):
-    """تحديث الخزنة"""
-    try:
-        cashbox = Cashbox.query.get(cashbox_id)
-        if not cashbox:
-            return False
+def update_cashbox(cashbox_id, amount, transaction_type, reference_type=None, reference_id=None, description=None, commit=True):
+    """تحديث الخزنة
 
+    commit=False يترك الحفظ للمعاملة المستدعية.
+    """
+    try:
+        amount = Decimal(str(amount))
         if transaction_type == 'in':
-            cashbox.current_balance += Decimal(str(amount))
+            delta = amount
         elif transaction_type == 'out':
-            if cashbox.current_balance < Decimal(str(amount)):
-                return False
-            cashbox.current_balance -= Decimal(str(amount))
+            delta = -amount
+        else:
+            delta = Decimal('0')
+
+        # تحديث ذري للرصيد، والسحب لا يتم إذا كان الرصيد غير كافٍ
+        new_balance = atomic_increment(db.session, Cashbox, cashbox_id, 'current_balance', delta,
+                                       minimum=0 if transaction_type == 'out' else None)
+        if new_balance is None:
+            return False
 
         # تسجيل المعاملة
         transaction = CashTransaction(
             cashbox_id=cashbox_id,
             transaction_type=transaction_type,
-            amount=Decimal(str(amount)),
+            amount=amount,
             reference_type=reference_type,
             reference_id=reference_id,
             description=description,
@@ -579,14 +731,361 @@ def update_cashbox(cashbox_id, amount, transaction_type, reference_type=None, re
         )
 
         db.session.add(transaction)
-        db.session.commit()
+        if commit:
+            db.session.commit()
         return True
 
     except Exception as e:
-        db.session.rollback()
+        if commit:
+            db.session.rollback()
         print(f"خطأ في تحديث الخزنة: {e}")
         return False
 
+def post_sale(customer_id, lines, discount_amount=Decimal('0'), tax_amount=Decimal('0'),
+              paid_amount=Decimal('0'), shipping_company='', notes='', created_by=None):
+    """ترحيل فاتورة بيع كاملة في معاملة واحدة
+
+    lines: قائمة (product_id, quantity, unit_price).
+    المنتجات تُحمّل وتُقفل باستعلام واحد، ثم تُضاف العناصر وحركات المخزون
+    دفعة واحدة ويتم الحفظ مرة واحدة. عند نقص المخزون لا يُحفظ أي شيء
+    ويُرفع ValueError برسالة للمستخدم.
+    """
+    try:
+        requested = {}
+        for product_id, quantity, unit_price in lines:
+            requested[product_id] = requested.get(product_id, Decimal('0')) + quantity
+
+        if not customer_id or not requested:
+            raise ValueError('يجب اختيار العميل وإضافة منتج واحد على الأقل')
+
+        # تحميل وقفل كل المنتجات (بترتيب ثابت لتجنب التعارض بين المعاملات)
+        products = {
+            product.id: product
+            for product in Product.query.filter(Product.id.in_(sorted(requested)))
+                                        .order_by(Product.id).with_for_update().all()
+        }
+
+        for product_id, quantity in requested.items():
+            product = products.get(product_id)
+            if not product:
+                raise ValueError('أحد المنتجات المختارة غير موجود')
+            if available_stock(product) < quantity:
+                raise ValueError(f'المخزون المتاح من "{product.name}" هو {available_stock(product)} {product.unit} فقط')
+
+        invoice_number = generate_invoice_number('SAL')
+        sale = Sale(
+            invoice_number=invoice_number,
+            customer_id=customer_id,
+            discount_amount=discount_amount,
+            tax_amount=tax_amount,
+            paid_amount=paid_amount,
+            shipping_company=shipping_company,
+            notes=notes,
+            created_by=created_by
+        )
+        db.session.add(sale)
+        db.session.flush()  # للحصول على ID الفاتورة
+
+        subtotal = Decimal('0')
+        item_rows = []
+        movement_rows = []
+        for product_id, quantity, unit_price in lines:
+            product = products[product_id]
+            total_price = quantity * unit_price
+            subtotal += total_price
+            item_rows.append({
+                'id': str(uuid.uuid4()),
+                'sale_id': sale.id,
+                'product_id': product_id,
+                'quantity': quantity,
+                'unit_price': unit_price,
+                'total_price': total_price,
+                'cost_price': product.cost_price
+            })
+            movement_rows.append({
+                'id': str(uuid.uuid4()),
+                'product_id': product_id,
+                'movement_type': 'out',
+                'quantity': quantity,
+                'unit_cost': product.cost_price,
+                'reference_type': 'sale',
+                'reference_id': sale.id,
+                'created_by': created_by
+            })
+
+        for product_id, quantity in requested.items():
+            products[product_id].current_stock -= quantity
+
+        db.session.execute(SaleItem.__table__.insert(), item_rows)
+        db.session.execute(StockMovement.__table__.insert(), movement_rows)
+
+        # حساب الإجمالي
+        sale.subtotal = subtotal
+        sale.total_amount = subtotal - discount_amount + tax_amount
+        sale.remaining_amount = sale.total_amount - paid_amount
+
+        # تحديث ملخص المبيعات اليومي
+        record_sale_rollup(sale, item_rows)
+
+        # تحديث الخزنة الرئيسية
+        if paid_amount > 0:
+            main_cashbox = Cashbox.query.filter_by(type='main', is_active=True).first()
+            if main_cashbox:
+                update_cashbox(main_cashbox.id, paid_amount, 'in', 'sale', sale.id,
+                               f'دفعة من فاتورة {invoice_number}', commit=False)
+
+        db.session.commit()
+        return sale
+
+    except Exception:
+        db.session.rollback()
+        raise
+
+# ==================== ترحيل أوامر التصنيع ====================
+
+def available_stock(product):
+    """الكمية المتاحة للبيع أو الصرف (المخزون ناقص المحجوز لأوامر التصنيع)"""
+    return (product.current_stock or Decimal('0')) - (product.reserved_stock or Decimal('0'))
+
+def lock_products(product_ids):
+    """تحميل وقفل المنتجات باستعلام واحد (بترتيب ثابت لتجنب التعارض بين المعاملات)"""
+    return {
+        product.id: product
+        for product in Product.query.filter(Product.id.in_(sorted(product_ids)))
+                                    .order_by(Product.id).with_for_update().all()
+    }
+
+def material_movement_rows(order_id, materials, created_by):
+    """صفوف حركات صرف المواد الخام لأمر تصنيع. materials: قائمة (product_id, quantity, unit_cost)"""
+    return [{
+        'id': str(uuid.uuid4()),
+        'product_id': product_id,
+        'movement_type': 'out',
+        'quantity': quantity,
+        'unit_cost': unit_cost,
+        'reference_type': 'manufacturing',
+        'reference_id': order_id,
+        'created_by': created_by
+    } for product_id, quantity, unit_cost in materials]
+
+def post_manufacturing_order(factory_id, raw_lines, finished_lines, expected_delivery_date=None,
+                             manufacturing_cost=Decimal('0'), notes='', created_by=None, issue=True):
+    """ترحيل أمر تصنيع كامل في معاملة واحدة
+
+    raw_lines و finished_lines: قوائم (product_id, quantity).
+    المواد الخام تُحمّل وتُقفل باستعلام واحد ويُتحقق من توفرها كلها قبل
+    أي تعديل، ثم تُضاف البنود وحركات المخزون دفعة واحدة ويتم الحفظ مرة
+    واحدة. issue=False يحجز المواد فقط (الأمر pending) حتى تُصرف لاحقاً
+    بـ issue_manufacturing_materials. عند أي خطأ لا يُحفظ شيء ويُرفع
+    ValueError برسالة للمستخدم.
+    """
+    try:
+        requested = {}
+        for product_id, quantity in raw_lines:
+            requested[product_id] = requested.get(product_id, Decimal('0')) + quantity
+
+        if not factory_id or not requested or not finished_lines:
+            raise ValueError('يجب اختيار المصنع وإضافة مواد خام ومنتجات جاهزة')
+
+        products = lock_products(requested)
+        for product_id, quantity in requested.items():
+            product = products.get(product_id)
+            if not product:
+                raise ValueError('إحدى المواد الخام المختارة غير موجودة')
+            if available_stock(product) < quantity:
+                raise ValueError(f'المخزون المتاح من "{product.name}" هو {available_stock(product)} {product.unit} فقط')
+
+        finished_costs = dict(
+            db.session.query(Product.id, Product.cost_price)
+                      .filter(Product.id.in_({product_id for product_id, _ in finished_lines}))
+        )
+        if len(finished_costs) < len({product_id for product_id, _ in finished_lines}):
+            raise ValueError('أحد المنتجات الجاهزة المختارة غير موجود')
+
+        order = ManufacturingOrder(
+            order_number=generate_invoice_number('MFG'),
+            factory_id=factory_id,
+            expected_delivery_date=expected_delivery_date,
+            manufacturing_cost=manufacturing_cost,
+            notes=notes,
+            status='in_progress' if issue else 'pending',
+            created_by=created_by
+        )
+        db.session.add(order)
+        db.session.flush()  # للحصول على ID الأمر
+
+        raw_materials_cost = Decimal('0')
+        material_rows = []
+        for product_id, quantity in raw_lines:
+            unit_cost = products[product_id].cost_price or Decimal('0')
+            total_cost = quantity * unit_cost
+            raw_materials_cost += total_cost
+            material_rows.append({
+                'id': str(uuid.uuid4()),
+                'manufacturing_order_id': order.id,
+                'product_id': product_id,
+                'quantity_required': quantity,
+                'quantity_sent': quantity if issue else Decimal('0'),
+                'unit_cost': unit_cost,
+                'total_cost': total_cost
+            })
+
+        finished_rows = [{
+            'id': str(uuid.uuid4()),
+            'manufacturing_order_id': order.id,
+            'product_id': product_id,
+            'quantity_expected': quantity,
+            'quantity_received': Decimal('0'),
+            'quality_grade': 'A',
+            'unit_cost': finished_costs[product_id]
+        } for product_id, quantity in finished_lines]
+
+        for product_id, quantity in requested.items():
+            if issue:
+                products[product_id].current_stock -= quantity
+            else:
+                products[product_id].reserved_stock = (products[product_id].reserved_stock or Decimal('0')) + quantity
+
+        db.session.execute(ManufacturingOrderRawMaterial.__table__.insert(), material_rows)
+        db.session.execute(ManufacturingOrderFinishedProduct.__table__.insert(), finished_rows)
+        if issue:
+            db.session.execute(StockMovement.__table__.insert(), material_movement_rows(
+                order.id, [(row['product_id'], row['quantity_required'], row['unit_cost']) for row in material_rows],
+                created_by
+            ))
+
+        order.raw_materials_cost = raw_materials_cost
+        order.total_cost = raw_materials_cost + manufacturing_cost
+
+        db.session.commit()
+        return order
+
+    except Exception:
+        db.session.rollback()
+        raise
+
+def issue_manufacturing_materials(order_id, created_by=None):
+    """صرف المواد المحجوزة لأمر تصنيع pending وتحويله إلى in_progress في معاملة واحدة"""
+    try:
+        order = ManufacturingOrder.query.filter_by(id=order_id).with_for_update().first()
+        if not order:
+            raise ValueError('أمر التصنيع غير موجود')
+        if order.status != 'pending':
+            raise ValueError('يمكن صرف المواد لأمر في حالة الانتظار فقط')
+
+        materials = [material for material in order.raw_materials if not material.quantity_sent]
+        requested = {}
+        for material in materials:
+            requested[material.product_id] = requested.get(material.product_id, Decimal('0')) + material.quantity_required
+
+        products = lock_products(requested)
+        for product_id, quantity in requested.items():
+            product = products.get(product_id)
+            if not product:
+                raise ValueError('إحدى المواد الخام غير موجودة')
+            # الكمية محجوزة لهذا الأمر، فيكفي وجودها في المخزون
+            if (product.current_stock or Decimal('0')) < quantity:
+                raise ValueError(f'المخزون الحالي من "{product.name}" هو {product.current_stock} {product.unit} فقط')
+
+        for product_id, quantity in requested.items():
+            product = products[product_id]
+            product.current_stock -= quantity
+            product.reserved_stock = max(Decimal('0'), (product.reserved_stock or Decimal('0')) - quantity)
+
+        for material in materials:
+            material.quantity_sent = material.quantity_required
+        if materials:
+            db.session.execute(StockMovement.__table__.insert(), material_movement_rows(
+                order.id, [(m.product_id, m.quantity_required, m.unit_cost) for m in materials], created_by
+            ))
+
+        order.status = 'in_progress'
+        db.session.commit()
+        return order
+
+    except Exception:
+        db.session.rollback()
+        raise
+
+# ==================== الترقيم بالمؤشر ====================
+
+# الجداول التي تعرض قوائمها بالترقيم على (created_at, id)
+KEYSET_MODELS = (Product, Customer, Sale, PurchaseInvoice, Factory, Supplier, ManufacturingOrder)
+
+def backfill_created_at():
+    """تعبئة created_at الفارغ بأقدم تاريخ في الجدول
+
+    المقارنة (created_at, id) < المؤشر لا تتحقق مع NULL، فتختفي هذه الصفوف
+    بعد الصفحة الأولى. بأقدم تاريخ تظهر في آخر القائمة كما كانت في SQLite.
+    """
+    for model in KEYSET_MODELS:
+        if not db.session.query(model.id).filter(model.created_at.is_(None)).first():
+            continue
+        oldest = db.session.query(func.min(model.created_at)).scalar() or datetime.utcnow()
+        model.query.filter(model.created_at.is_(None)).update(
+            {model.created_at: oldest}, synchronize_session=False
+        )
+    db.session.commit()
+
+def encode_cursor(created_at, row_id):
+    """مؤشر الصفحة التالية (آخر صف في الصفحة الحالية)"""
+    raw = json.dumps([created_at.isoformat() if created_at else None, row_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created_at), row_id
+    except (ValueError, TypeError):
+        return None
+
+def keyset_paginate(query, model):
+    """صفحة من النتائج مرتبة تنازلياً على (created_at, id)
+
+    الصفحة التالية تبدأ بعد آخر صف في الصفحة الحالية بدلاً من OFFSET،
+    فتكلفة أي صفحة مثل تكلفة الصفحة الأولى.
+    """
+    per_page = request.args.get('per_page', app.config['LIST_PAGE_SIZE'], type=int)
+    per_page = max(1, min(per_page, app.config['LIST_MAX_PAGE_SIZE']))
+
+    cursor = request.args.get('cursor')
+    position = decode_cursor(cursor) if cursor else None
+    if position:
+        query = query.filter(tuple_(model.created_at, model.id) < tuple_(*position))
+
+    rows = query.order_by(model.created_at.desc(), model.id.desc()).limit(per_page + 1).all()
+    items = rows[:per_page]
+    next_cursor = None
+    if len(rows) > per_page:
+        next_cursor = encode_cursor(items[-1].created_at, items[-1].id)
+
+    return {'items': items, 'next_cursor': next_cursor, 'per_page': per_page}
+
+def serialize_row(obj):
+    """تحويل صف إلى قاموس قابل للتحويل إلى JSON"""
+    data = {}
+    for column in obj.__table__.columns:
+        value = getattr(obj, column.key)
+        if isinstance(value, Decimal):
+            value = float(value)
+        elif isinstance(value, datetime):
+            value = value.isoformat()
+        data[column.key] = value
+    return data
+
+def render_list(template, name, page, **context):
+    """عرض صفحة قائمة بصيغة HTML أو JSON (?format=json)"""
+    if request.args.get('format') == 'json':
+        return jsonify({
+            name: [serialize_row(item) for item in page['items']],
+            'next_cursor': page['next_cursor'],
+            'per_page': page['per_page']
+        })
+
+    context[name] = page['items']
+    return render_template(template, next_cursor=page['next_cursor'], per_page=page['per_page'], **context)
+
 # ==================== Routes ====================
 
 @app.route('/health')
@@ -761,68 +1260,7 @@ def logout():
 def dashboard():
     """لوحة التحكم الرئيسية"""
     try:
-        # حساب الإحصائيات الأساسية
-        today = datetime.now().date()
-
-        # إحصائيات اليوم
-        today_sales = Sale.query.filter(
-            func.date(Sale.sale_date) == today,
-            Sale.status == 'active'
-        ).all()
-
-        today_sales_count = len(today_sales)
-        today_sales_amount = sum([float(sale.total_amount) for sale in today_sales])
-        today_profit = sum([
-            float(sale.total_amount) - sum([
-                float(item.cost_price or 0) * float(item.quantity)
-                for item in sale.items
-            ]) for sale in today_sales
-        ])
-
-        # إحصائيات عامة
-        total_customers = Customer.query.filter_by(is_active=True).count()
-        total_products = Product.query.filter_by(is_active=True).count()
-        total_suppliers = Supplier.query.filter_by(is_active=True).count()
-
-        # المنتجات منخفضة المخزون
-        low_stock_products = Product.query.filter(
-            Product.current_stock <= Product.min_stock,
-            Product.min_stock > 0,
-            Product.is_active == True
-        ).count()
-
-        # رصيد الخزائن
-        main_cashbox = Cashbox.query.filter_by(type='main', is_active=True).first()
-        shipping_cashbox = Cashbox.query.filter_by(type='shipping', is_active=True).first()
-
-        main_balance = float(main_cashbox.current_balance) if main_cashbox else 0
-        shipping_balance = float(shipping_cashbox.current_balance) if shipping_cashbox else 0
-
-        # الشحنات المعلقة
-        pending_shipments = Sale.query.filter(
-            Sale.shipping_status.in_(['pending', 'shipped']),
-            Sale.status == 'active'
-        ).count()
-
-        # المبيعات غير المحصلة
-        unpaid_sales = Sale.query.filter(
-            Sale.remaining_amount > 0,
-            Sale.status == 'active'
-        ).count()
-
-        stats = {
-            'today_sales_count': today_sales_count,
-            'today_sales_amount': today_sales_amount,
-            'today_profit': today_profit,
-            'total_customers': total_customers,
-            'total_products': total_products,
-            'total_suppliers': total_suppliers,
-            'low_stock_products': low_stock_products,
-            'main_balance': main_balance,
-            'shipping_balance': shipping_balance,
-            'pending_shipments': pending_shipments,
-            'unpaid_sales': unpaid_sales
-        }
+        stats = get_dashboard_stats()
 
         # آخر المعاملات
         recent_sales = Sale.query.order_by(desc(Sale.created_at)).limit(5).all()
@@ -877,9 +1315,9 @@ def inventory_list():
         if product_type:
             query = query.filter_by(type=product_type)
 
-        products = query.order_by(Product.created_at.desc()).all()
+        page = keyset_paginate(query, Product)
 
-        return render_template('inventory/list.html', products=products, search=search, product_type=product_type)
+        return render_list('inventory/list.html', 'products', page, search=search, product_type=product_type)
 
     except Exception as e:
         flash(f'حدث خطأ في تحميل المنتجات: {str(e)}', 'error')
@@ -998,12 +1436,15 @@ def stock_adjustment(product_id):
                 product.current_stock += quantity
                 movement_type = 'in'
             elif adjustment_type == 'decrease':
-                if product.current_stock < quantity:
+                if available_stock(product) < quantity:
                     flash('الكمية المطلوب خصمها أكبر من المخزون المتاح', 'error')
                     return render_template('inventory/stock_adjustment.html', product=product)
                 product.current_stock -= quantity
                 movement_type = 'out'
             elif adjustment_type == 'set':
+                if quantity < (product.reserved_stock or Decimal('0')):
+                    flash(f'لا يمكن أن يقل المخزون عن الكمية المحجوزة لأوامر التصنيع ({product.reserved_stock})', 'error')
+                    return render_template('inventory/stock_adjustment.html', product=product)
                 quantity = quantity - old_stock
                 product.current_stock = old_stock + quantity
                 movement_type = 'in' if quantity >= 0 else 'out'
@@ -1055,9 +1496,9 @@ def customers_list():
                 )
             )
 
-        customers = query.order_by(Customer.created_at.desc()).all()
+        page = keyset_paginate(query, Customer)
 
-        return render_template('customers/list.html', customers=customers, search=search)
+        return render_list('customers/list.html', 'customers', page, search=search)
 
     except Exception as e:
         flash(f'حدث خطأ في تحميل العملاء: {str(e)}', 'error')
@@ -1163,9 +1604,9 @@ def sales_list():
         if status:
             query = query.filter_by(status=status)
 
-        sales = query.order_by(desc(Sale.created_at)).all()
+        page = keyset_paginate(query, Sale)
 
-        return render_template('sales/list.html', sales=sales, search=search, status=status)
+        return render_list('sales/list.html', 'sales', page, search=search, status=status)
 
     except Exception as e:
         flash(f'حدث خطأ في تحميل فواتير البيع: {str(e)}', 'error')
@@ -1193,80 +1634,24 @@ def add_sale():
             quantities = request.form.getlist('quantity[]')
             unit_prices = request.form.getlist('unit_price[]')
 
-            if not customer_id or not product_ids:
-                flash('يجب اختيار العميل وإضافة منتج واحد على الأقل', 'error')
-                return render_template('sales/add.html',
-                                     customers=Customer.query.filter_by(is_active=True).all(),
-                                     products=Product.query.filter_by(is_active=True).all())
-
-            # إنشاء الفاتورة
-            invoice_number = generate_invoice_number('SAL')
-
-            sale = Sale(
-                invoice_number=invoice_number,
-                customer_id=customer_id,
-                discount_amount=discount_amount,
-                tax_amount=tax_amount,
-                paid_amount=paid_amount,
-                shipping_company=shipping_company,
-                notes=notes,
-                created_by=current_user.id
-            )
-
-            db.session.add(sale)
-            db.session.flush()  # للحصول على ID الفاتورة
-
-            subtotal = Decimal('0')
-
-            # إضافة عناصر الفاتورة
-            for i, product_id in enumerate(product_ids):
-                if not product_id:
-                    continue
-
-                quantity = Decimal(str(quantities[i]))
-                unit_price = Decimal(str(unit_prices[i]))
-                total_price = quantity * unit_price
-
-                # التحقق من توفر المخزون
-                product = Product.query.get(product_id)
-                if product.current_stock < quantity:
-                    flash(f'المخزون المتاح من "{product.name}" هو {product.current_stock} {product.unit} فقط', 'error')
-                    db.session.rollback()
-                    return render_template('sales/add.html',
-                                         customers=Customer.query.filter_by(is_active=True).all(),
-                                         products=Product.query.filter_by(is_active=True).all())
-
-                sale_item = SaleItem(
-                    sale_id=sale.id,
-                    product_id=product_id,
-                    quantity=quantity,
-                    unit_price=unit_price,
-                    total_price=total_price,
-                    cost_price=product.cost_price
-                )
-
-                db.session.add(sale_item)
-                subtotal += total_price
-
-                # تحديث المخزون
-                update_stock(product_id, quantity, 'out', 'sale', sale.id, product.cost_price)
-
-            # حساب الإجمالي
-            sale.subtotal = subtotal
-            sale.total_amount = subtotal - discount_amount + tax_amount
-            sale.remaining_amount = sale.total_amount - paid_amount
+            lines = [
+                (product_id, Decimal(str(quantities[i])), Decimal(str(unit_prices[i])))
+                for i, product_id in enumerate(product_ids) if product_id
+            ]
 
-            # تحديث الخزنة الرئيسية
-            if paid_amount > 0:
-                main_cashbox = Cashbox.query.filter_by(type='main', is_active=True).first()
-                if main_cashbox:
-                    update_cashbox(main_cashbox.id, paid_amount, 'in', 'sale', sale.id, f'دفعة من فاتورة {invoice_number}')
+            sale = post_sale(customer_id, lines,
+                             discount_amount=discount_amount,
+                             tax_amount=tax_amount,
+                             paid_amount=paid_amount,
+                             shipping_company=shipping_company,
+                             notes=notes,
+                             created_by=current_user.id)
 
-            db.session.commit()
-
-            flash(f'تم إنشاء فاتورة البيع رقم {invoice_number} بنجاح', 'success')
+            flash(f'تم إنشاء فاتورة البيع رقم {sale.invoice_number} بنجاح', 'success')
             return redirect(url_for('sales_list'))
 
+        except ValueError as e:
+            flash(str(e), 'error')
         except Exception as e:
             db.session.rollback()
             flash(f'حدث خطأ في إنشاء الفاتورة: {str(e)}', 'error')
@@ -1400,9 +1785,9 @@ def factories_list():
                 )
             )
 
-        factories = query.order_by(Factory.created_at.desc()).all()
+        page = keyset_paginate(query, Factory)
 
-        return render_template('factories/list.html', factories=factories, search=search)
+        return render_list('factories/list.html', 'factories', page, search=search)
 
     except Exception as e:
         flash(f'حدث خطأ في تحميل المصانع: {str(e)}', 'error')
@@ -1484,9 +1869,9 @@ def manufacturing_orders_list():
         if status:
             query = query.filter_by(status=status)
 
-        orders = query.order_by(desc(ManufacturingOrder.created_at)).all()
+        page = keyset_paginate(query, ManufacturingOrder)
 
-        return render_template('manufacturing/list.html', orders=orders, search=search, status=status)
+        return render_list('manufacturing/list.html', 'orders', page, search=search, status=status)
 
     except Exception as e:
         flash(f'حدث خطأ في تحميل أوامر التصنيع: {str(e)}', 'error')
@@ -1506,6 +1891,8 @@ def add_manufacturing_order():
             expected_delivery_date = request.form.get('expected_delivery_date')
             manufacturing_cost = Decimal(str(request.form.get('manufacturing_cost', 0)))
             notes = request.form.get('notes', '')
+            # حجز المواد فقط بدون صرفها للمصنع
+            reserve_only = request.form.get('reserve_only') == 'on'
 
             # بيانات المواد الخام
             raw_material_ids = request.form.getlist('raw_material_id[]')
@@ -1515,94 +1902,35 @@ def add_manufacturing_order():
             finished_product_ids = request.form.getlist('finished_product_id[]')
             finished_product_quantities = request.form.getlist('finished_product_quantity[]')
 
-            if not factory_id or not raw_material_ids or not finished_product_ids:
-                flash('يجب اختيار المصنع وإضافة مواد خام ومنتجات جاهزة', 'error')
-                return render_template('manufacturing/add.html',
-                                     factories=Factory.query.filter_by(is_active=True).all(),
-                                     raw_materials=Product.query.filter_by(type='raw_material', is_active=True).all(),
-                                     finished_products=Product.query.filter_by(type='finished_product', is_active=True).all())
-
-            # إنشاء أمر التصنيع
-            order_number = generate_invoice_number('MFG')
+            raw_lines = [
+                (raw_material_id, Decimal(str(raw_material_quantities[i])))
+                for i, raw_material_id in enumerate(raw_material_ids) if raw_material_id
+            ]
+            finished_lines = [
+                (finished_product_id, Decimal(str(finished_product_quantities[i])))
+                for i, finished_product_id in enumerate(finished_product_ids) if finished_product_id
+            ]
 
-            manufacturing_order = ManufacturingOrder(
-                order_number=order_number,
-                factory_id=factory_id,
+            order = post_manufacturing_order(
+                factory_id,
+                raw_lines,
+                finished_lines,
                 expected_delivery_date=datetime.strptime(expected_delivery_date, '%Y-%m-%d') if expected_delivery_date else None,
                 manufacturing_cost=manufacturing_cost,
                 notes=notes,
-                created_by=current_user.id
+                created_by=current_user.id,
+                issue=not reserve_only
             )
 
-            db.session.add(manufacturing_order)
-            db.session.flush()  # للحصول على ID الأمر
-
-            raw_materials_cost = Decimal('0')
-
-            # إضافة المواد الخام
-            for i, raw_material_id in enumerate(raw_material_ids):
-                if not raw_material_id:
-                    continue
-
-                quantity = Decimal(str(raw_material_quantities[i]))
-
-                # التحقق من توفر المخزون
-                product = Product.query.get(raw_material_id)
-                if product.current_stock < quantity:
-                    flash(f'المخزون المتاح من "{product.name}" هو {product.current_stock} {product.unit} فقط', 'error')
-                    db.session.rollback()
-                    return render_template('manufacturing/add.html',
-                                         factories=Factory.query.filter_by(is_active=True).all(),
-                                         raw_materials=Product.query.filter_by(type='raw_material', is_active=True).all(),
-                                         finished_products=Product.query.filter_by(type='finished_product', is_active=True).all())
-
-                unit_cost = product.cost_price
-                total_cost = quantity * unit_cost
-
-                raw_material_item = ManufacturingOrderRawMaterial(
-                    manufacturing_order_id=manufacturing_order.id,
-                    product_id=raw_material_id,
-                    quantity_required=quantity,
-                    quantity_sent=quantity,  # نفترض أنها ترسل كاملة
-                    unit_cost=unit_cost,
-                    total_cost=total_cost
-                )
-
-                db.session.add(raw_material_item)
-                raw_materials_cost += total_cost
-
-                # تحديث المخزون (خصم المواد الخام)
-                update_stock(raw_material_id, quantity, 'out', 'manufacturing', manufacturing_order.id, unit_cost)
-
-            # إضافة المنتجات الجاهزة المتوقعة
-            for i, finished_product_id in enumerate(finished_product_ids):
-                if not finished_product_id:
-                    continue
-
-                quantity = Decimal(str(finished_product_quantities[i]))
-                product = Product.query.get(finished_product_id)
-
-                finished_product_item = ManufacturingOrderFinishedProduct(
-                    manufacturing_order_id=manufacturing_order.id,
-                    product_id=finished_product_id,
-                    quantity_expected=quantity,
-                    unit_cost=product.cost_price
-                )
-
-                db.session.add(finished_product_item)
-
-            # حساب التكلفة الإجمالية
-            manufacturing_order.raw_materials_cost = raw_materials_cost
-            manufacturing_order.total_cost = raw_materials_cost + manufacturing_cost
-            manufacturing_order.status = 'in_progress'
-
-            db.session.commit()
-
-            flash(f'تم إنشاء أمر التصنيع رقم {order_number} بنجاح', 'success')
+            if reserve_only:
+                flash(f'تم إنشاء أمر التصنيع رقم {order.order_number} وحجز المواد الخام', 'success')
+            else:
+                flash(f'تم إنشاء أمر التصنيع رقم {order.order_number} بنجاح', 'success')
             return redirect(url_for('manufacturing_orders_list'))
 
+        except ValueError as e:
+            flash(str(e), 'error')
         except Exception as e:
-            db.session.rollback()
             flash(f'حدث خطأ في إنشاء أمر التصنيع: {str(e)}', 'error')
 
     factories = Factory.query.filter_by(is_active=True).all()
@@ -1701,6 +2029,24 @@ def view_manufacturing_order(order_id):
     order = ManufacturingOrder.query.get_or_404(order_id)
     return render_template('manufacturing/view.html', order=order)
 
+@app.route('/manufacturing-orders/issue/<order_id>', methods=['POST'])
+@login_required
+def issue_manufacturing_order(order_id):
+    """صرف المواد الخام المحجوزة لأمر تصنيع"""
+    if not current_user.role == 'admin':
+        flash('ليس لديك صلاحية لصرف المواد الخام', 'error')
+        return redirect(url_for('manufacturing_orders_list'))
+
+    try:
+        order = issue_manufacturing_materials(order_id, current_user.id)
+        flash(f'تم صرف المواد الخام لأمر التصنيع {order.order_number}', 'success')
+    except ValueError as e:
+        flash(str(e), 'error')
+    except Exception as e:
+        flash(f'حدث خطأ في صرف المواد: {str(e)}', 'error')
+
+    return redirect(url_for('manufacturing_orders_list'))
+
 @app.route('/manufacturing-orders/cancel/<order_id>', methods=['POST'])
 @login_required
 def cancel_manufacturing_order(order_id):
@@ -1716,17 +2062,25 @@ def cancel_manufacturing_order(order_id):
         return redirect(url_for('manufacturing_orders_list'))
 
     try:
-        # إرجاع المواد الخام للمخزون
+        # إرجاع المواد الخام المصروفة للمخزون وإلغاء حجز ما لم يُصرف
         for raw_material in order.raw_materials:
             if raw_material.quantity_sent > 0:
-                update_stock(raw_material.product_id, raw_material.quantity_sent, 'in',
-                           'manufacturing_cancel', order_id, raw_material.unit_cost)
+                if not update_stock(raw_material.product_id, raw_material.quantity_sent, 'in',
+                                    'manufacturing_cancel', order_id, raw_material.unit_cost, commit=False):
+                    raise ValueError('تعذر إرجاع المواد الخام للمخزون')
+            elif order.status == 'pending':
+                product = Product.query.filter_by(id=raw_material.product_id).with_for_update().first()
+                if product:
+                    product.reserved_stock = max(Decimal('0'), (product.reserved_stock or Decimal('0')) - raw_material.quantity_required)
 
         order.status = 'cancelled'
         db.session.commit()
 
         flash(f'تم إلغاء أمر التصنيع {order.order_number} وإرجاع المواد للمخزون', 'success')
 
+    except ValueError as e:
+        db.session.rollback()
+        flash(str(e), 'error')
     except Exception as e:
         db.session.rollback()
         flash(f'حدث خطأ في إلغاء الأمر: {str(e)}', 'error')
@@ -1735,6 +2089,61 @@ def cancel_manufacturing_order(order_id):
 
 # ==================== تقارير التصنيع ====================
 
+EMPTY_FACTORY_STATS = {
+    'total_orders': 0, 'completed_orders': 0, 'in_progress_orders': 0, 'cancelled_orders': 0,
+    'total_cost': 0.0, 'raw_materials_cost': 0.0, 'manufacturing_cost': 0.0, 'avg_delay_days': 0
+}
+
+def factory_order_stats():
+    """إحصائيات أوامر التصنيع لكل المصانع في استعلام مجمع واحد
+
+    ترجع {factory_id: {...}} بعدد الأوامر لكل حالة، وتكاليف الأوامر
+    المكتملة، ومتوسط أيام التأخير (التسليم الفعلي - المتوقع) للمكتملة.
+    """
+    completed = ManufacturingOrder.status == 'completed'
+    delay_days = whole_days_between(
+        db.session, ManufacturingOrder.expected_delivery_date, ManufacturingOrder.actual_delivery_date
+    )
+    completed_delay = db.case(
+        (and_(completed,
+              ManufacturingOrder.expected_delivery_date.isnot(None),
+              ManufacturingOrder.actual_delivery_date.isnot(None)), delay_days),
+        else_=None
+    )
+
+    def completed_sum(column):
+        return func.coalesce(func.sum(db.case((completed, column), else_=0)), 0)
+
+    def status_count(status):
+        return func.count(db.case((ManufacturingOrder.status == status, 1), else_=None))
+
+    rows = db.session.query(
+        ManufacturingOrder.factory_id,
+        func.count(ManufacturingOrder.id),
+        status_count('completed'),
+        status_count('in_progress'),
+        status_count('cancelled'),
+        completed_sum(ManufacturingOrder.total_cost),
+        completed_sum(ManufacturingOrder.raw_materials_cost),
+        completed_sum(ManufacturingOrder.manufacturing_cost),
+        func.avg(completed_delay)
+    ).group_by(ManufacturingOrder.factory_id)
+
+    stats = {}
+    for (factory_id, total, completed_count, in_progress, cancelled,
+         total_cost, raw_materials_cost, manufacturing_cost, avg_delay) in rows:
+        stats[factory_id] = {
+            'total_orders': total,
+            'completed_orders': completed_count,
+            'in_progress_orders': in_progress,
+            'cancelled_orders': cancelled,
+            'total_cost': float(total_cost or 0),
+            'raw_materials_cost': float(raw_materials_cost or 0),
+            'manufacturing_cost': float(manufacturing_cost or 0),
+            'avg_delay_days': float(avg_delay) if avg_delay is not None else 0
+        }
+    return stats
+
 @app.route('/manufacturing-reports')
 @login_required
 def manufacturing_reports():
@@ -1744,50 +2153,39 @@ def manufacturing_reports():
         return redirect(url_for('dashboard'))
 
     try:
-        # إحصائيات عامة
-        total_orders = ManufacturingOrder.query.count()
-        completed_orders = ManufacturingOrder.query.filter_by(status='completed').count()
-        in_progress_orders = ManufacturingOrder.query.filter_by(status='in_progress').count()
-        cancelled_orders = ManufacturingOrder.query.filter_by(status='cancelled').count()
-
-        # إحصائيات التكلفة
-        completed_orders_list = ManufacturingOrder.query.filter_by(status='completed').all()
-        total_manufacturing_cost = sum([float(order.total_cost) for order in completed_orders_list])
-        total_raw_materials_cost = sum([float(order.raw_materials_cost) for order in completed_orders_list])
-        total_labor_cost = sum([float(order.manufacturing_cost) for order in completed_orders_list])
-
-        # أداء المصانع
-        factories_performance = []
-        for factory in Factory.query.filter_by(is_active=True).all():
-            factory_orders = ManufacturingOrder.query.filter_by(factory_id=factory.id).all()
-            completed_count = len([o for o in factory_orders if o.status == 'completed'])
-            total_cost = sum([float(o.total_cost) for o in factory_orders if o.status == 'completed'])
-
-            # حساب متوسط وقت التسليم
-            delivery_times = []
-            for order in factory_orders:
-                if order.status == 'completed' and order.expected_delivery_date and order.actual_delivery_date:
-                    expected = order.expected_delivery_date
-                    actual = order.actual_delivery_date
-                    delay_days = (actual - expected).days
-                    delivery_times.append(delay_days)
-
-            avg_delay = sum(delivery_times) / len(delivery_times) if delivery_times else 0
+        factory_stats = factory_order_stats()
 
+        # الإحصائيات العامة من نفس الاستعلام المجمع (كل المصانع)
+        total_orders = sum(row['total_orders'] for row in factory_stats.values())
+        completed_orders = sum(row['completed_orders'] for row in factory_stats.values())
+        in_progress_orders = sum(row['in_progress_orders'] for row in factory_stats.values())
+        cancelled_orders = sum(row['cancelled_orders'] for row in factory_stats.values())
+
+        # إحصائيات التكلفة (الأوامر المكتملة)
+        total_manufacturing_cost = sum(row['total_cost'] for row in factory_stats.values())
+        total_raw_materials_cost = sum(row['raw_materials_cost'] for row in factory_stats.values())
+        total_labor_cost = sum(row['manufacturing_cost'] for row in factory_stats.values())
+
+        # أداء المصانع النشطة
+        factories_performance = []
+        for factory in Factory.query.filter_by(is_active=True).order_by(Factory.name).all():
+            row = factory_stats.get(factory.id, EMPTY_FACTORY_STATS)
             factories_performance.append({
                 'factory': factory,
-                'total_orders': len(factory_orders),
-                'completed_orders': completed_count,
-                'total_cost': total_cost,
-                'avg_delay_days': avg_delay,
+                'total_orders': row['total_orders'],
+                'completed_orders': row['completed_orders'],
+                'total_cost': row['total_cost'],
+                'avg_delay_days': row['avg_delay_days'],
                 'quality_rating': factory.quality_rating
             })
 
         # أوامر متأخرة
-        overdue_orders = ManufacturingOrder.query.filter(
+        overdue_orders = ManufacturingOrder.query.options(
+            db.joinedload(ManufacturingOrder.factory)
+        ).filter(
             ManufacturingOrder.status == 'in_progress',
             ManufacturingOrder.expected_delivery_date < datetime.now()
-        ).all()
+        ).order_by(ManufacturingOrder.expected_delivery_date).all()
 
         stats = {
             'total_orders': total_orders,
@@ -1823,41 +2221,42 @@ def delivery_tracking():
         return redirect(url_for('dashboard'))
 
     try:
-        today = datetime.now().date()
-
-        # الأوامر المتأخرة
-        overdue_orders = ManufacturingOrder.query.filter(
+        # حدود الأيام كـ datetime لأن expected_delivery_date عمود DateTime
+        today_start = datetime.combine(datetime.now().date(), datetime.min.time())
+        tomorrow_start = today_start + timedelta(days=1)
+        week_end = tomorrow_start + timedelta(days=7)
+
+        # كل الأوامر الجارية المستحقة حتى نهاية الأسبوع القادم في استعلام واحد
+        # (فهرس status, expected_delivery_date) ثم تقسيمها حسب الموعد
+        overdue_orders = []
+        due_today = []
+        due_this_week = []
+        upcoming_orders = ManufacturingOrder.query.options(
+            db.joinedload(ManufacturingOrder.factory)
+        ).filter(
             ManufacturingOrder.status == 'in_progress',
-            ManufacturingOrder.expected_delivery_date < today
+            ManufacturingOrder.expected_delivery_date < week_end
         ).order_by(ManufacturingOrder.expected_delivery_date).all()
 
-        # الأوامر المستحقة اليوم
-        due_today = ManufacturingOrder.query.filter(
-            ManufacturingOrder.status == 'in_progress',
-            func.date(ManufacturingOrder.expected_delivery_date) == today
-        ).all()
-
-        # الأوامر المستحقة خلال الأسبوع القادم
-        next_week = today + timedelta(days=7)
-        due_this_week = ManufacturingOrder.query.filter(
-            ManufacturingOrder.status == 'in_progress',
-            ManufacturingOrder.expected_delivery_date > today,
-            ManufacturingOrder.expected_delivery_date <= next_week
-        ).order_by(ManufacturingOrder.expected_delivery_date).all()
-
-        # إحصائيات التسليم
-        all_completed = ManufacturingOrder.query.filter_by(status='completed').all()
-        on_time_deliveries = 0
-        late_deliveries = 0
-
-        for order in all_completed:
-            if order.expected_delivery_date and order.actual_delivery_date:
-                if order.actual_delivery_date.date() <= order.expected_delivery_date:
-                    on_time_deliveries += 1
-                else:
-                    late_deliveries += 1
+        for order in upcoming_orders:
+            if order.expected_delivery_date < today_start:
+                overdue_orders.append(order)
+            elif order.expected_delivery_date < tomorrow_start:
+                due_today.append(order)
+            else:
+                due_this_week.append(order)
+
+        # إحصائيات التسليم: في الموعد إذا كان يوم التسليم الفعلي لا يتجاوز يوم الموعد
+        on_time = func.date(ManufacturingOrder.actual_delivery_date) <= func.date(ManufacturingOrder.expected_delivery_date)
+        total_deliveries, on_time_deliveries = db.session.query(
+            func.count(ManufacturingOrder.id),
+            func.count(db.case((on_time, 1), else_=None))
+        ).filter(
+            ManufacturingOrder.status == 'completed',
+            ManufacturingOrder.expected_delivery_date.isnot(None),
+            ManufacturingOrder.actual_delivery_date.isnot(None)
+        ).one()
 
-        total_deliveries = on_time_deliveries + late_deliveries
         on_time_percentage = (on_time_deliveries / total_deliveries * 100) if total_deliveries > 0 else 0
 
         stats = {
@@ -1882,6 +2281,63 @@ def delivery_tracking():
                              due_this_week=[],
                              stats={})
 
+# ==================== مراقبة الجودة ====================
+
+QUALITY_GRADES = {'A': 'grade_a', 'B': 'grade_b', 'C': 'grade_c'}
+
+# إجماليات الدرجات محفوظة مؤقتاً لكل (إصدار، فترة). رقم الإصدار في ملف مشترك
+# بين العمال (QUALITY_CACHE_PATH، فارغ = داخل العملية فقط)، ويزيد عند تعديل
+# أمر تصنيع أو منتجاته الجاهزة عبر الجلسة وبعد الحفظ
+QUALITY_VERSION_KEY = 'quality_grades'
+quality_versions = VersionedCache(0, shared_path=os.environ.get(
+    'QUALITY_CACHE_PATH', os.path.join(app.instance_path, 'quality_cache.db')
+) or None)
+for quality_model in (ManufacturingOrder, ManufacturingOrderFinishedProduct):
+    quality_versions.install(db.session, quality_model, lambda row: QUALITY_VERSION_KEY)
+quality_cache = TTLCache(int(os.environ.get('QUALITY_CACHE_TTL', 600)), maxsize=256)
+
+def quality_data_version():
+    """الإصدار الحالي لبيانات الجودة"""
+    return quality_versions.version(QUALITY_VERSION_KEY)
+
+def quality_grade_totals(date_from=None, date_to=None):
+    """الكميات المستلمة لكل مصنع ودرجة جودة {factory_id: {grade: quantity}}
+
+    استعلام مجمع واحد على المنتجات الجاهزة للأوامر المكتملة، مع فترة
+    اختيارية على تاريخ الاستلام (date، والتحقق منها على المستدعي).
+    """
+    key = (quality_data_version(), date_from, date_to)
+    totals = quality_cache.get(key)
+    if totals is not None:
+        return totals
+
+    criteria = [
+        ManufacturingOrder.status == 'completed',
+        ManufacturingOrderFinishedProduct.quantity_received > 0
+    ]
+    if date_from:
+        criteria.append(ManufacturingOrder.actual_delivery_date >= datetime.combine(date_from, datetime.min.time()))
+    if date_to:
+        criteria.append(ManufacturingOrder.actual_delivery_date < datetime.combine(date_to, datetime.min.time()) + timedelta(days=1))
+
+    rows = db.session.query(
+        ManufacturingOrder.factory_id,
+        ManufacturingOrderFinishedProduct.quality_grade,
+        func.sum(ManufacturingOrderFinishedProduct.quantity_received)
+    ).join(
+        ManufacturingOrder,
+        ManufacturingOrderFinishedProduct.manufacturing_order_id == ManufacturingOrder.id
+    ).filter(*criteria).group_by(
+        ManufacturingOrder.factory_id, ManufacturingOrderFinishedProduct.quality_grade
+    )
+
+    totals = {}
+    for factory_id, grade, quantity in rows:
+        totals.setdefault(factory_id, {})[grade] = float(quantity or 0)
+
+    quality_cache.set(key, totals)
+    return totals
+
 @app.route('/manufacturing-orders/quality-control')
 @login_required
 def quality_control():
@@ -1890,46 +2346,38 @@ def quality_control():
         flash('ليس لديك صلاحية لمراقبة الجودة', 'error')
         return redirect(url_for('dashboard'))
 
+    date_from = request.args.get('date_from', '')
+    date_to = request.args.get('date_to', '')
     try:
-        # إحصائيات الجودة
-        completed_orders = ManufacturingOrder.query.filter_by(status='completed').all()
-
-        quality_stats = {
-            'grade_a': 0,
-            'grade_b': 0,
-            'grade_c': 0,
-            'total_products': 0
-        }
+        period_from = datetime.strptime(date_from, '%Y-%m-%d').date() if date_from else None
+        period_to = datetime.strptime(date_to, '%Y-%m-%d').date() if date_to else None
+    except ValueError:
+        flash('تاريخ غير صحيح، استخدم الصيغة YYYY-MM-DD', 'error')
+        return redirect(url_for('quality_control'))
 
-        factory_quality = {}
+    try:
+        grade_totals = quality_grade_totals(period_from, period_to)
 
-        for order in completed_orders:
-            for finished_product in order.finished_products:
-                if finished_product.quantity_received > 0:
-                    quality_stats['total_products'] += float(finished_product.quantity_received)
-
-                    if finished_product.quality_grade == 'A':
-                        quality_stats['grade_a'] += float(finished_product.quantity_received)
-                    elif finished_product.quality_grade == 'B':
-                        quality_stats['grade_b'] += float(finished_product.quantity_received)
-                    elif finished_product.quality_grade == 'C':
-                        quality_stats['grade_c'] += float(finished_product.quantity_received)
-
-                    # إحصائيات المصانع
-                    factory_name = order.factory.name
-                    if factory_name not in factory_quality:
-                        factory_quality[factory_name] = {
-                            'grade_a': 0, 'grade_b': 0, 'grade_c': 0, 'total': 0,
-                            'factory': order.factory
-                        }
-
-                    factory_quality[factory_name]['total'] += float(finished_product.quantity_received)
-                    if finished_product.quality_grade == 'A':
-                        factory_quality[factory_name]['grade_a'] += float(finished_product.quantity_received)
-                    elif finished_product.quality_grade == 'B':
-                        factory_quality[factory_name]['grade_b'] += float(finished_product.quantity_received)
-                    elif finished_product.quality_grade == 'C':
-                        factory_quality[factory_name]['grade_c'] += float(finished_product.quantity_received)
+        quality_stats = {'grade_a': 0, 'grade_b': 0, 'grade_c': 0, 'total_products': 0}
+        factories = {
+            factory.id: factory
+            for factory in Factory.query.filter(Factory.id.in_(list(grade_totals))).all()
+        } if grade_totals else {}
+
+        factory_quality = {}
+        for factory_id, grades in grade_totals.items():
+            factory = factories.get(factory_id)
+            if factory is None:
+                continue
+            factory_data = factory_quality.setdefault(factory.name, {
+                'grade_a': 0, 'grade_b': 0, 'grade_c': 0, 'total': 0, 'factory': factory
+            })
+            for grade, quantity in grades.items():
+                factory_data['total'] += quantity
+                quality_stats['total_products'] += quantity
+                if grade in QUALITY_GRADES:
+                    factory_data[QUALITY_GRADES[grade]] += quantity
+                    quality_stats[QUALITY_GRADES[grade]] += quantity
 
         # حساب النسب المئوية
         if quality_stats['total_products'] > 0:
@@ -1956,7 +2404,9 @@ def quality_control():
 
         return render_template('manufacturing/quality_control.html',
                              quality_stats=quality_stats,
-                             factory_quality=sorted_factories)
+                             factory_quality=sorted_factories,
+                             date_from=date_from,
+                             date_to=date_to)
 
     except Exception as e:
         flash(f'حدث خطأ في تحميل مراقبة الجودة: {str(e)}', 'error')
@@ -1992,9 +2442,9 @@ def suppliers_list():
         if supplier_type:
             query = query.filter_by(supplier_type=supplier_type)
 
-        suppliers = query.order_by(Supplier.created_at.desc()).all()
+        page = keyset_paginate(query, Supplier)
 
-        return render_template('suppliers/list.html', suppliers=suppliers, search=search, supplier_type=supplier_type)
+        return render_list('suppliers/list.html', 'suppliers', page, search=search, supplier_type=supplier_type)
 
     except Exception as e:
         flash(f'حدث خطأ في تحميل الموردين: {str(e)}', 'error')
@@ -2055,6 +2505,43 @@ def add_supplier():
 
 # ==================== صفحات فواتير الشراء ====================
 
+def purchase_filters():
+    """شروط فلترة فواتير الشراء من الطلب (مشتركة بين القائمة والتصدير)
+
+    يرجع (الشروط، التواريخ غير الصحيحة) ولا يضيف شرطاً لتاريخ غير صحيح،
+    فيقرر المسار رفض الطلب أو تجاهل الفلتر مع رسالة.
+    """
+    search = request.args.get('search', '')
+    status = request.args.get('status', '')
+    payment_status = request.args.get('payment_status', '')
+    date_from = request.args.get('date_from', '')
+    date_to = request.args.get('date_to', '')
+
+    criteria = []
+    if search:
+        criteria.append(or_(
+            PurchaseInvoice.invoice_number.contains(search),
+            Supplier.name.contains(search)
+        ))
+    if status:
+        criteria.append(PurchaseInvoice.status == status)
+    if payment_status:
+        criteria.append(PurchaseInvoice.payment_status == payment_status)
+
+    invalid_dates = []
+    if date_from:
+        try:
+            criteria.append(PurchaseInvoice.invoice_date >= datetime.strptime(date_from, '%Y-%m-%d'))
+        except ValueError:
+            invalid_dates.append(date_from)
+    if date_to:
+        try:
+            criteria.append(PurchaseInvoice.invoice_date < datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1))
+        except ValueError:
+            invalid_dates.append(date_to)
+
+    return criteria, invalid_dates
+
 @app.route('/purchases')
 @login_required
 def purchases_list():
@@ -2068,30 +2555,55 @@ def purchases_list():
         status = request.args.get('status', '')
         payment_status = request.args.get('payment_status', '')
 
-        query = PurchaseInvoice.query
-
-        if search:
-            query = query.join(Supplier).filter(
-                or_(
-                    PurchaseInvoice.invoice_number.contains(search),
-                    Supplier.name.contains(search)
-                )
-            )
+        criteria, invalid_dates = purchase_filters()
+        if invalid_dates:
+            flash(f'تم تجاهل تاريخ غير صحيح في الفلتر: {"، ".join(invalid_dates)}', 'error')
 
-        if status:
-            query = query.filter_by(status=status)
+        query = PurchaseInvoice.query.join(Supplier).filter(*criteria)
 
-        if payment_status:
-            query = query.filter_by(payment_status=payment_status)
+        page = keyset_paginate(query, PurchaseInvoice)
 
-        purchases = query.order_by(desc(PurchaseInvoice.created_at)).all()
-
-        return render_template('purchases/list.html', purchases=purchases, search=search, status=status, payment_status=payment_status)
+        return render_list('purchases/list.html', 'purchases', page, search=search, status=status, payment_status=payment_status)
 
     except Exception as e:
         flash(f'حدث خطأ في تحميل فواتير الشراء: {str(e)}', 'error')
         return render_template('purchases/list.html', purchases=[], search='', status='', payment_status='')
 
+@app.route('/purchases/export')
+@login_required
+def export_purchases():
+    """تصدير فواتير الشراء بالتدفق (?format=csv أو xlsx)"""
+    if not current_user.can_access('purchases'):
+        flash('ليس لديك صلاحية لعرض فواتير الشراء', 'error')
+        return redirect(url_for('dashboard'))
+
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        flash(f'صيغة التصدير غير مدعومة: {export_format}', 'error')
+        return redirect(url_for('purchases_list'))
+
+    # تاريخ غير صحيح يعني تصدير كل الفواتير، فيُرفض الطلب بدلاً من تجاهله
+    criteria, invalid_dates = purchase_filters()
+    if invalid_dates:
+        return jsonify({
+            'success': False,
+            'message': f'تاريخ غير صحيح (المطلوب YYYY-MM-DD): {"، ".join(invalid_dates)}'
+        }), 400
+
+    statement = select(
+        PurchaseInvoice.invoice_number, PurchaseInvoice.invoice_date, Supplier.name,
+        PurchaseInvoice.subtotal, PurchaseInvoice.discount_amount, PurchaseInvoice.tax_amount,
+        PurchaseInvoice.shipping_cost, PurchaseInvoice.total_amount, PurchaseInvoice.paid_amount,
+        PurchaseInvoice.remaining_amount, PurchaseInvoice.payment_status, PurchaseInvoice.status
+    ).join(Supplier, PurchaseInvoice.supplier_id == Supplier.id).where(
+        *criteria
+    ).order_by(PurchaseInvoice.invoice_date, PurchaseInvoice.id)
+
+    headers = ['رقم الفاتورة', 'التاريخ', 'المورد', 'المجموع الفرعي', 'الخصم', 'الضريبة',
+               'الشحن', 'الإجمالي', 'المدفوع', 'المتبقي', 'حالة الدفع', 'الحالة']
+    return export_response(headers, stream_rows(db.session, statement),
+                           f'purchases_{datetime.now().strftime("%Y%m%d")}', export_format)
+
 @app.route('/purchases/add', methods=['GET', 'POST'])
 @login_required
 def add_purchase():
@@ -2284,46 +2796,185 @@ def view_purchase(purchase_id):
         flash(f'حدث خطأ في عرض الفاتورة: {str(e)}', 'error')
         return redirect(url_for('purchases_list'))
 
+# ملفات PDF المولدة (تُعاد فقط إذا تغير المستند)
+pdf_cache = PDFCache(app.config['PDF_CACHE_FOLDER'])
+
+# تسجيل الخطوط مرة واحدة عند بدء التشغيل بدلاً من كل طلب
+register_fonts()
+
+def purchase_invoice_document(purchase):
+    """وصف فاتورة الشراء لمحرك PDF"""
+    settings = BusinessSettings.query.first()
+    fields = [
+        ('التاريخ', purchase.invoice_date),
+        ('المورد', purchase.supplier.name),
+        ('الحالة', purchase.status),
+        ('حالة الدفع', purchase.payment_status)
+    ]
+    if purchase.due_date:
+        fields.append(('تاريخ الاستحقاق', purchase.due_date))
+
+    return {
+        'header': settings.business_name if settings else 'VAYON',
+        'title': 'فاتورة شراء',
+        'number': purchase.invoice_number,
+        'fields': fields,
+        'columns': ['الصنف', 'الكمية', 'المستلم', 'سعر الوحدة', 'الإجمالي'],
+        'widths': [0.4, 0.14, 0.14, 0.16, 0.16],
+        'rows': [
+            [item.product.name, item.quantity.normalize(), (item.received_quantity or 0),
+             item.unit_cost, item.total_cost]
+            for item in purchase.items
+        ],
+        'totals': [
+            ('المجموع الفرعي', purchase.subtotal),
+            ('الخصم', purchase.discount_amount),
+            ('الضريبة', purchase.tax_amount),
+            ('الشحن', purchase.shipping_cost),
+            ('الإجمالي', purchase.total_amount),
+            ('المدفوع', purchase.paid_amount),
+            ('المتبقي', purchase.remaining_amount)
+        ],
+        'notes': purchase.notes
+    }
+
+@app.route('/purchases/<purchase_id>/pdf')
+@login_required
+def purchase_pdf(purchase_id):
+    """فاتورة الشراء PDF"""
+    if not current_user.can_access('purchases'):
+        flash('ليس لديك صلاحية لعرض فواتير الشراء', 'error')
+        return redirect(url_for('purchases_list'))
+
+    purchase = PurchaseInvoice.query.get_or_404(purchase_id)
+    document = purchase_invoice_document(purchase)
+    # الجدول بدون updated_at، فالإصدار بصمة محتوى المستند
+    path = pdf_cache.get_or_render('purchase', purchase.id, document_fingerprint(document),
+                                   lambda: document)
+    return send_file(os.path.abspath(path), mimetype='application/pdf',
+                     download_name=f'{purchase.invoice_number}.pdf')
+
 # ==================== نظام النسخ الاحتياطي التلقائي ====================
 
+_sqlite_backup_engine = None
+
+def get_sqlite_backup_engine():
+    """محرك النسخ الاحتياطي لملف SQLite المستخدم فعلياً (يُنشأ مرة واحدة)"""
+    global _sqlite_backup_engine
+    if _sqlite_backup_engine is None:
+        _sqlite_backup_engine = SQLiteBackupEngine(
+            db.engine.url.database,
+            app.config['BACKUP_FOLDER'],
+            pages_per_step=app.config.get('BACKUP_PAGES_PER_STEP', 256),
+            step_sleep=app.config.get('BACKUP_STEP_SLEEP', 0.005)
+        )
+    return _sqlite_backup_engine
+
+def backup_exists(content_hash):
+    """هل توجد نسخة محفوظة بنفس المحتوى؟"""
+    existing = Backup.query.filter_by(content_hash=content_hash).order_by(desc(Backup.created_at)).first()
+    return existing is not None and os.path.exists(existing.file_path)
+
+def backup_table_counts():
+    """عدد الصفوف في كل جدول (استعلام واحد)"""
+    tables = [table for table in db.metadata.sorted_tables if table.name != Backup.__tablename__]
+    counts = select(*[
+        select(func.count()).select_from(table).scalar_subquery().label(table.name)
+        for table in tables
+    ])
+    row = db.session.execute(counts).one()
+    return dict(row._mapping)
+
+def prune_backups():
+    """حذف النسخ التلقائية الزائدة حسب سياسة الاحتفاظ (ساعية/يومية/أسبوعية)"""
+    backups = Backup.query.filter_by(backup_type='auto').order_by(desc(Backup.created_at)).all()
+    keep = retention_keep(
+        [backup.created_at for backup in backups],
+        datetime.utcnow(),
+        hourly=app.config['BACKUP_KEEP_HOURLY'],
+        daily=app.config['BACKUP_KEEP_DAILY'],
+        weekly=app.config['BACKUP_KEEP_WEEKLY'],
+        max_files=app.config['MAX_BACKUP_FILES']
+    )
+
+    removed = 0
+    for index, backup in enumerate(backups):
+        if index in keep:
+            continue
+        if os.path.exists(backup.file_path):
+            os.remove(backup.file_path)
+        db.session.delete(backup)
+        removed += 1
+
+    if removed:
+        db.session.commit()
+    return removed
+
 def create_backup():
     """إنشاء نسخة احتياطية من قاعدة البيانات"""
     try:
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"vayon_backup_{timestamp}.db"
-        backup_path = os.path.join(app.config['BACKUP_FOLDER'], filename)
-
-        # نسخ قاعدة البيانات
-        if 'sqlite' in app.config['SQLALCHEMY_DATABASE_URI']:
-            db_path = app.config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:///', '')
-            if os.path.exists(db_path):
-                shutil.copy2(db_path, backup_path)
+        with app.app_context():
+            started = time.monotonic()
+            if db.engine.dialect.name == 'sqlite':
+                # نسخة متسقة أثناء التشغيل، وتُتخطى إذا لم تتغير البيانات أو تكرر محتواها
+                # (سجل النسخ خارج البصمة، فتسجيل النسخة لا يُنشئ نسخة جديدة في الدورة التالية)
+                result = get_sqlite_backup_engine().backup(
+                    hash_exclude_tables=(Backup.__tablename__,),
+                    is_duplicate=backup_exists
+                )
+                if result is None:
+                    return True
+                filename = result['filename']
+                result['bytes_per_second'] = result['database_size'] / result['duration'] if result['duration'] else None
             else:
-                print(f"⚠️ ملف قاعدة البيانات غير موجود: {db_path}")
-                return False
-        else:
-            # للقواعد الأخرى مثل PostgreSQL
-            import subprocess
-            database_url = app.config['SQLALCHEMY_DATABASE_URI']
+                # للقواعد الأخرى مثل PostgreSQL: الناتج يُضغط أثناء البث بدون نسخة غير مضغوطة
+                compression = app.config['BACKUP_COMPRESSION']
+                extension = 'sql.zst' if compression == 'zstd' else 'sql.gz'
+                backup_path = unique_backup_path(app.config['BACKUP_FOLDER'], 'vayon_backup', extension)
+                filename = os.path.basename(backup_path)
+                # رابط بدون اسم مكتبة الاتصال (postgresql+psycopg2 لا يفهمه pg_dump)
+                # وبدون كلمة المرور حتى لا تظهر في قائمة العمليات، فتُمرر في PGPASSWORD
+                database_url = db.engine.url._replace(drivername=db.engine.url.get_backend_name(), password=None)
+                command = [
+                    part.format(database_url=database_url.render_as_string(hide_password=False))
+                    for part in shlex.split(app.config['BACKUP_DUMP_COMMAND'])
+                ]
+                dump_env = dict(os.environ)
+                if db.engine.url.password:
+                    dump_env['PGPASSWORD'] = db.engine.url.password
+                result = stream_dump(
+                    command,
+                    backup_path,
+                    compression=compression,
+                    timeout=app.config['BACKUP_DUMP_TIMEOUT'],
+                    env=dump_env
+                )
+                if backup_exists(result['content_hash']):
+                    os.remove(result['file_path'])
+                    return True
+                result['database_size'] = db.session.execute(
+                    text('SELECT pg_database_size(current_database())')
+                ).scalar() if db.engine.dialect.name == 'postgresql' else result['raw_size']
+
+            # تسجيل النسخة الاحتياطية في قاعدة البيانات
             try:
-                subprocess.run(['pg_dump', database_url, '-f', backup_path], check=True)
-            except subprocess.CalledProcessError as e:
-                print(f"خطأ في نسخ PostgreSQL: {e}")
-                return False
-
-        # تسجيل النسخة الاحتياطية في قاعدة البيانات
-        try:
-            with app.app_context():
                 backup_record = Backup(
                     filename=filename,
-                    file_path=backup_path,
-                    file_size=os.path.getsize(backup_path) if os.path.exists(backup_path) else 0,
+                    file_path=result['file_path'],
+                    file_size=result['file_size'],
+                    database_size=result['database_size'],
+                    content_hash=result['content_hash'],
+                    duration_seconds=time.monotonic() - started,
+                    bytes_per_second=result['bytes_per_second'],
+                    table_counts=json.dumps(backup_table_counts()),
                     backup_type='auto'
                 )
                 db.session.add(backup_record)
                 db.session.commit()
-        except Exception as e:
-            print(f"خطأ في تسجيل النسخة الاحتياطية: {e}")
+                prune_backups()
+            except Exception as e:
+                db.session.rollback()
+                print(f"خطأ في تسجيل النسخة الاحتياطية: {e}")
 
         print(f"✅ تم إنشاء نسخة احتياطية: {filename}")
         return True
@@ -2332,12 +2983,29 @@ def create_backup():
         print(f"❌ خطأ في إنشاء النسخة الاحتياطية: {e}")
         return False
 
+def get_backup_interval():
+    """مدة النسخ الاحتياطي بالدقائق من إعدادات النشاط"""
+    try:
+        with app.app_context():
+            interval = db.session.query(BusinessSettings.backup_interval).limit(1).scalar()
+    except Exception:
+        interval = None
+    return max(1, interval or app.config['BACKUP_INTERVAL_MINUTES'])
+
 def auto_backup_worker():
-    """عامل النسخ الاحتياطي التلقائي كل 3 دقائق"""
+    """عامل النسخ الاحتياطي التلقائي
+
+    كل عامل gunicorn يشغل هذا الخيط، لكن النسخ يتم فقط في العملية التي
+    تملك قفل الجدولة، والباقي ينتظر ويتولى المهمة إذا توقفت.
+    """
+    with app.app_context():
+        lock = SchedulerLock(db.engine, os.path.join(app.config['BACKUP_FOLDER'], '.backup_scheduler.lock'))
+
     while True:
         try:
-            time.sleep(180)  # 3 دقائق
-            create_backup()
+            time.sleep(get_backup_interval() * 60)
+            if lock.acquire():
+                create_backup()
         except Exception as e:
             print(f"خطأ في النسخ الاحتياطي التلقائي: {e}")
             time.sleep(60)  # انتظار دقيقة في حالة الخطأ
@@ -2527,9 +3195,47 @@ def add_sample_data():
         db.session.rollback()
         print(f"❌ خطأ في إضافة البيانات التجريبية: {str(e)}")
 
+# ==================== ترقية قاعدة البيانات ====================
+
+# الجداول الموجودة التي أضيفت إليها أعمدة أو فهارس بعد إنشائها
+UPGRADED_MODELS = KEYSET_MODELS + (Backup,)
+
+def upgrade_schema():
+    """إنشاء الجداول الناقصة وإضافة الأعمدة والفهارس الجديدة للجداول الموجودة
+
+    تُستدعى عند تحميل التطبيق (gunicorn و __main__)، والقفل يجعل العمال
+    ينفذونها واحداً تلو الآخر فيجد العامل الثاني كل شيء موجوداً.
+    """
+    lock_path = os.path.join(app.config['BACKUP_FOLDER'], '.schema_upgrade.lock')
+    with schema_upgrade_lock(db.engine, lock_path):
+        db.create_all()
+        added = {model: upgrade_table(db.engine, model.__table__) for model in UPGRADED_MODELS}
+
+        # المنتجات الموجودة قبل الحجز ليس عليها كميات محجوزة
+        if 'reserved_stock' in added[Product]:
+            Product.query.update({Product.reserved_stock: 0}, synchronize_session=False)
+            db.session.commit()
+
+        backfill_created_at()
+
+        # ملخص المبيعات اليومي يُبنى من الفواتير الموجودة عند إنشائه لأول مرة
+        if DailySalesRollup.query.first() is None and Sale.query.first() is not None:
+            count = rebuild_sales_rollup()
+            print(f"✅ تم بناء ملخص المبيعات اليومي من الفواتير الموجودة ({count} صف)")
+
+with app.app_context():
+    try:
+        upgrade_schema()
+    except Exception as e:
+        print(f"❌ خطأ في ترقية قاعدة البيانات: {e}")
+
+# تحت gunicorn لا يُنفذ __main__، فتُبدأ الخدمة في كل عامل عند تفعيلها
+# (قفل الجدولة يضمن أن عاملاً واحداً فقط ينسخ)
+if __name__ != '__main__' and os.environ.get('ENABLE_BACKUP_SCHEDULER') == '1':
+    start_backup_service()
+
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
         print("🎉 تم إنشاء قاعدة البيانات!")
 
         # إضافة البيانات التجريبية إذا لم تكن موجودة
@@ -0,0 +1,403 @@
+"""
+محرك النسخ الاحتياطي لقاعدة بيانات SQLite أثناء التشغيل
+
+يستخدم sqlite3 backup API بدلاً من نسخ الملف، فالنسخة متسقة دائماً حتى
+لو كانت هناك كتابة جارية، وتُنسخ الصفحات على دفعات مع توقف قصير بينها
+حتى لا تُحجب طلبات التطبيق. الدورة تُتخطى إذا لم تتغير البيانات منذ آخر
+نسخة، والناتج مضغوط بـ gzip.
+
+يحتوي أيضاً على قفل الجدولة (نسخ احتياطي من عملية واحدة فقط في النشر)
+وسياسة الاحتفاظ بالنسخ (ساعية/يومية/أسبوعية).
+"""
+
+import gzip
+import hashlib
+import os
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# حجم الدفعة عند قراءة ناتج أمر النسخ
+DUMP_CHUNK_SIZE = 1024 * 1024
+
+# مفتاح pg_advisory_lock الخاص بجدولة النسخ الاحتياطي
+BACKUP_ADVISORY_LOCK_KEY = int.from_bytes(hashlib.sha256(b'vayon-backup-scheduler').digest()[:8], 'big', signed=True)
+
+
+def file_sha256(path):
+    """بصمة SHA-256 لملف"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def sqlite_page_hash(path, exclude_tables=()):
+    """بصمة صفحات قاعدة SQLite: المخطط وصفحات كل الجداول والفهارس عدا المستثناة
+
+    الصفحات تُقرأ من الملف كما هي بدون تحويل الصفوف، فالتكلفة قراءة الملف
+    مرة واحدة. تعديل جدول مستثنى لا يغير صفحات الجداول الأخرى، والصفحات
+    الفارغة ورأس الملف (عدادات التغيير) خارج البصمة.
+    ترجع None إذا كانت SQLite مبنية بدون جدول dbstat.
+    """
+    digest = hashlib.sha256()
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+        schema = conn.execute(
+            "SELECT name, tbl_name, sql FROM sqlite_master ORDER BY name"
+        ).fetchall()
+        excluded = {name for name, table, _ in schema if table in exclude_tables}
+        excluded.add('sqlite_schema')
+        try:
+            pages = {
+                pageno for name, pageno in conn.execute('SELECT name, pageno FROM dbstat')
+                if name not in excluded
+            }
+        except sqlite3.OperationalError:
+            return None
+    finally:
+        conn.close()
+
+    for name, _, sql in schema:
+        digest.update(f'\x00{name}\x00{sql}'.encode())
+    with open(path, 'rb') as f:
+        for pageno in sorted(pages):
+            f.seek((pageno - 1) * page_size)
+            digest.update(f.read(page_size))
+    return digest.hexdigest()
+
+
+def sqlite_content_hash(path, exclude_tables=()):
+    """بصمة محتوى قاعدة SQLite: المخطط وكل صفوف الجداول عدا المستثناة
+
+    البصمة منطقية وليست بصمة الملف، فلا تتأثر بترتيب الصفحات أو المساحة الفارغة.
+    أبطأ بكثير من sqlite_page_hash، وتُستخدم فقط إذا لم يتوفر dbstat.
+    """
+    digest = hashlib.sha256()
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        tables = conn.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'table' "
+            "AND name NOT LIKE 'sqlite_%' ORDER BY name"
+        ).fetchall()
+        for name, sql in tables:
+            digest.update(f'\x00{sql}\x00'.encode())
+            if name in exclude_tables:
+                continue
+            for row in conn.execute(f'SELECT * FROM "{name}" ORDER BY rowid'):
+                digest.update(repr(row).encode())
+    finally:
+        conn.close()
+    return digest.hexdigest()
+
+
+def unique_backup_path(directory, prefix, extension):
+    """مسار ملف نسخة جديد لا يتعارض مع نسخة أُنشئت في نفس الثانية"""
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    path = os.path.join(directory, f'{prefix}_{timestamp}.{extension}')
+    suffix = 1
+    while os.path.exists(path):
+        path = os.path.join(directory, f'{prefix}_{timestamp}_{suffix}.{extension}')
+        suffix += 1
+    return path
+
+
+def default_compression():
+    """zstd إذا كانت مكتبة zstandard مثبتة، وإلا gzip"""
+    return 'zstd' if zstandard is not None else 'gzip'
+
+
+def _open_compressed(path, compression, level):
+    if compression == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('مكتبة zstandard غير مثبتة')
+        raw = open(path, 'wb')
+        return zstandard.ZstdCompressor(level=level or 3).stream_writer(raw, closefd=True)
+    return gzip.open(path, 'wb', compresslevel=level or 6)
+
+
+def stream_dump(command, output_path, compression='gzip', level=None, timeout=1800, env=None):
+    """تشغيل أمر نسخ (مثل pg_dump) وضغط ناتجه أثناء القراءة إلى ملف
+
+    الناتج يُقرأ على دفعات ولا يُحفظ غير مضغوط على القرص، والعملية تُقتل
+    إذا تجاوزت timeout ثانية. الملف يظهر باسمه النهائي فقط عند النجاح.
+    البصمة محسوبة على الناتج قبل الضغط فتصلح لمقارنة المحتوى.
+    """
+    partial_path = f'{output_path}.part'
+    digest = hashlib.sha256()
+    raw_bytes = 0
+    started = time.monotonic()
+
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr, env=env)
+        timed_out = threading.Event()
+
+        def kill_on_timeout():
+            timed_out.set()
+            process.kill()
+
+        timer = threading.Timer(timeout, kill_on_timeout)
+        timer.start()
+        try:
+            with _open_compressed(partial_path, compression, level) as compressed:
+                for chunk in iter(lambda: process.stdout.read(DUMP_CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    compressed.write(chunk)
+                    raw_bytes += len(chunk)
+            returncode = process.wait()
+        except BaseException:
+            process.kill()
+            process.wait()
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            raise
+        finally:
+            timer.cancel()
+            process.stdout.close()
+
+        if returncode != 0:
+            os.remove(partial_path)
+            if timed_out.is_set():
+                raise TimeoutError(f'تجاوز أمر النسخ المهلة ({timeout} ثانية)')
+            stderr.seek(0)
+            message = stderr.read().decode(errors='replace').strip()
+            raise RuntimeError(f'فشل أمر النسخ ({returncode}): {message}')
+
+    os.replace(partial_path, output_path)
+    duration = time.monotonic() - started
+    return {
+        'file_path': output_path,
+        'file_size': os.path.getsize(output_path),
+        'raw_size': raw_bytes,
+        'content_hash': digest.hexdigest(),
+        'duration': duration,
+        'bytes_per_second': raw_bytes / duration if duration else None
+    }
+
+
+def retention_keep(timestamps, now, hourly=24, daily=7, weekly=4, max_files=None):
+    """مؤشرات النسخ التي يُحتفظ بها (timestamps مرتبة من الأحدث للأقدم)
+
+    تُحفظ أحدث نسخة في كل ساعة من آخر hourly ساعة، وفي كل يوم من آخر
+    daily يوم، وفي كل أسبوع من آخر weekly أسبوع، وأحدث نسخة دائماً.
+    """
+    keep = {0} if timestamps else set()
+    policies = (
+        (timedelta(hours=hourly), lambda t: (t.date(), t.hour)),
+        (timedelta(days=daily), lambda t: t.date()),
+        (timedelta(weeks=weekly), lambda t: t.isocalendar()[:2]),
+    )
+    for window, bucket in policies:
+        seen = set()
+        for index, timestamp in enumerate(timestamps):
+            if now - timestamp > window:
+                break
+            key = bucket(timestamp)
+            if key not in seen:
+                seen.add(key)
+                keep.add(index)
+
+    if max_files:
+        keep = set(sorted(keep)[:max_files])
+    return keep
+
+
+class SchedulerLock:
+    """قفل غير حاجب يضمن أن عملية واحدة فقط تشغل جدولة النسخ
+
+    PostgreSQL: pg_try_advisory_lock على اتصال مخصص يبقى مفتوحاً.
+    غير ذلك: flock على ملف في مجلد النسخ (كل العمال على نفس الجهاز).
+    القفل يُحرر تلقائياً عند انتهاء العملية فتتولى عملية أخرى الجدولة.
+    """
+
+    def __init__(self, engine, lock_path, advisory_key=BACKUP_ADVISORY_LOCK_KEY):
+        self.engine = engine
+        self.lock_path = lock_path
+        self.advisory_key = advisory_key
+        self._connection = None
+        self._file = None
+
+    def acquire(self):
+        """محاولة أخذ القفل (أو التأكد أنه ما زال محجوزاً)"""
+        if self.engine.dialect.name == 'postgresql':
+            return self._acquire_advisory()
+        return self._acquire_file()
+
+    def _acquire_advisory(self):
+        try:
+            if self._connection is not None:
+                self._connection.execute(text('SELECT 1'))
+                self._connection.commit()
+                return True
+        except Exception:
+            # انقطع الاتصال فضاع القفل معه
+            self._connection = None
+
+        connection = self.engine.connect()
+        try:
+            acquired = connection.execute(
+                text('SELECT pg_try_advisory_lock(:key)'), {'key': self.advisory_key}
+            ).scalar()
+            connection.commit()
+        except Exception:
+            connection.close()
+            raise
+        if acquired:
+            self._connection = connection
+            return True
+        connection.close()
+        return False
+
+    def _acquire_file(self):
+        if self._file is not None:
+            return True
+        if fcntl is None:
+            return True
+
+        os.makedirs(os.path.dirname(self.lock_path) or '.', exist_ok=True)
+        lock_file = open(self.lock_path, 'a+')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(str(os.getpid()))
+        lock_file.flush()
+        self._file = lock_file
+        return True
+
+    def release(self):
+        if self._connection is not None:
+            try:
+                self._connection.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': self.advisory_key})
+                self._connection.commit()
+            finally:
+                self._connection.close()
+                self._connection = None
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
+class SQLiteBackupEngine:
+    """نسخ احتياطي متسق ومضغوط لملف SQLite"""
+
+    def __init__(self, db_path, backup_dir, pages_per_step=256, step_sleep=0.005,
+                 compress_level=6, prefix='vayon_backup'):
+        self.db_path = db_path
+        self.backup_dir = backup_dir
+        self.pages_per_step = pages_per_step
+        self.step_sleep = step_sleep
+        self.compress_level = compress_level
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._monitor = None
+        self._last_marker = None
+
+    def _change_marker(self):
+        """علامة تتغير مع كل تعديل في قاعدة البيانات
+
+        data_version يتغير عند أي حفظ من اتصال آخر (بما فيه وضع WAL)،
+        وعداد التغييرات في رأس الملف يغطي التعديل من عمليات أخرى قبل
+        فتح اتصال المراقبة.
+        """
+        if self._monitor is None:
+            self._monitor = sqlite3.connect(
+                f'file:{self.db_path}?mode=ro', uri=True, check_same_thread=False
+            )
+        data_version = self._monitor.execute('PRAGMA data_version').fetchone()[0]
+
+        with open(self.db_path, 'rb') as f:
+            header = f.read(28)
+        change_counter = int.from_bytes(header[24:28], 'big') if len(header) == 28 else None
+
+        wal_path = f'{self.db_path}-wal'
+        wal_state = None
+        if os.path.exists(wal_path):
+            stat = os.stat(wal_path)
+            wal_state = (stat.st_size, stat.st_mtime_ns)
+
+        return data_version, change_counter, wal_state
+
+    def _throttle(self, status, remaining, total):
+        # توقف قصير بين الدفعات ليتمكن التطبيق من الكتابة
+        if remaining and self.step_sleep:
+            time.sleep(self.step_sleep)
+
+    def backup(self, force=False, hash_exclude_tables=(), is_duplicate=None):
+        """إنشاء نسخة جديدة وإرجاع بياناتها، أو None إذا لم يتغير شيء
+
+        hash_exclude_tables: جداول لا تدخل في بصمة المحتوى (مثل سجل النسخ نفسه).
+        is_duplicate: دالة تستقبل البصمة وترجع True إذا كانت هناك نسخة بنفس المحتوى.
+        """
+        if not os.path.exists(self.db_path):
+            raise FileNotFoundError(f'ملف قاعدة البيانات غير موجود: {self.db_path}')
+
+        with self._lock:
+            marker = self._change_marker()
+            if not force and marker == self._last_marker:
+                return None
+
+            os.makedirs(self.backup_dir, exist_ok=True)
+            started = time.monotonic()
+            backup_path = unique_backup_path(self.backup_dir, self.prefix, 'db.gz')
+            filename = os.path.basename(backup_path)
+            snapshot_path = f'{backup_path}.snapshot'
+            partial_path = f'{backup_path}.part'
+
+            try:
+                source = sqlite3.connect(f'file:{self.db_path}?mode=ro', uri=True)
+                target = sqlite3.connect(snapshot_path)
+                try:
+                    source.backup(target, pages=self.pages_per_step, progress=self._throttle)
+                finally:
+                    target.close()
+                    source.close()
+
+                content_hash = (sqlite_page_hash(snapshot_path, hash_exclude_tables)
+                                or sqlite_content_hash(snapshot_path, hash_exclude_tables))
+                if not force and is_duplicate and is_duplicate(content_hash):
+                    self._last_marker = marker
+                    return None
+
+                with open(snapshot_path, 'rb') as raw, \
+                        gzip.open(partial_path, 'wb', compresslevel=self.compress_level) as compressed:
+                    shutil.copyfileobj(raw, compressed, 1024 * 1024)
+                os.replace(partial_path, backup_path)
+
+            finally:
+                for path in (snapshot_path, partial_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+
+            # العلامة قبل النسخ: أي تعديل أثناء النسخ يظهر في الدورة التالية
+            self._last_marker = marker
+            return {
+                'filename': filename,
+                'file_path': backup_path,
+                'file_size': os.path.getsize(backup_path),
+                'database_size': os.path.getsize(self.db_path),
+                'content_hash': content_hash,
+                'duration': time.monotonic() - started
+            }
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+أدوات مشتركة لسكريبتات اختبار الأداء (bench_data.py و bench_data_erp.py و bench_run.py)
+
+لا تستورد أي تطبيق: كل تطبيق ينشئ جداوله عند استيراده، و app.py و
+vayon_advanced.py يستخدمان نفس أسماء الجداول بأعمدة مختلفة، فلكل منهما
+قاعدة بيانات اختبار مستقلة.
+"""
+
+import os
+import time
+import uuid
+from decimal import Decimal
+
+INSERT_BATCH_SIZE = 5000
+
+BENCH_USERNAME = 'bench'
+BENCH_PASSWORD = 'bench123'
+
+FIRST_NAMES = ('محمد', 'أحمد', 'محمود', 'مصطفى', 'علي', 'عمر', 'يوسف', 'إبراهيم', 'خالد', 'حسن',
+               'فاطمة', 'مريم', 'نورهان', 'سارة', 'آية', 'منى', 'هبة', 'ياسمين', 'دينا', 'رحاب')
+LAST_NAMES = ('عبد الله', 'السيد', 'حسين', 'عبد الرحمن', 'الشريف', 'فؤاد', 'سليمان', 'رمضان',
+              'عثمان', 'الجمال', 'النجار', 'منصور', 'شاهين', 'عبد العزيز', 'زكي')
+GOVERNORATES = {
+    'القاهرة': ('مدينة نصر', 'المعادي', 'مصر الجديدة', 'شبرا', 'حلوان'),
+    'الجيزة': ('الدقي', 'الهرم', '6 أكتوبر', 'الشيخ زايد'),
+    'الإسكندرية': ('سموحة', 'سيدي جابر', 'المنتزه', 'العجمي'),
+    'الدقهلية': ('المنصورة', 'طلخا', 'ميت غمر'),
+    'الشرقية': ('الزقازيق', 'العاشر من رمضان', 'بلبيس'),
+    'أسيوط': ('أسيوط', 'ديروط', 'منفلوط'),
+}
+COLORS = ('أسود', 'أبيض', 'كحلي', 'بيج', 'أحمر', 'زيتي', 'رمادي', 'وردي', 'بني', 'موف')
+SIZES = ('XS', 'S', 'M', 'L', 'XL', 'XXL', '3XL')
+
+
+def new_id(rng):
+    # معرفات من نفس المولد حتى تتطابق قواعد البيانات المولدة بنفس البذرة
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def money(value):
+    return Decimal(value).quantize(Decimal('0.01'))
+
+
+def random_phone(rng):
+    return '01' + rng.choice('0125') + ''.join(rng.choice('0123456789') for _ in range(8))
+
+
+def progress(label, started, count):
+    print(f"   ✅ {label}: {count:,} صف في {time.perf_counter() - started:.1f} ثانية")
+
+
+class Inserter:
+    """إضافة الصفوف لجدول على دفعات بجملة INSERT واحدة لكل دفعة"""
+
+    def __init__(self, session, model, batch_size=INSERT_BATCH_SIZE):
+        self.session = session
+        self.table = model.__table__
+        self.batch_size = batch_size
+        self.rows = []
+        self.count = 0
+
+    def add(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.session.execute(self.table.insert(), self.rows)
+            self.count += len(self.rows)
+            self.rows = []
+
+
+def reset_refusal(engine):
+    """سبب رفض --reset (حذف كل الجداول) على هذه القاعدة، أو None إذا كانت قاعدة اختبار
+
+    الحذف مسموح فقط على ملف SQLite محدد صراحة في DATABASE_URL خارج بيئة
+    الإنتاج، فلا يصل إلى PostgreSQL على Render ولا إلى قاعدة التطوير
+    الافتراضية (vayon_advanced.db / vayon_erp.db) التي تحمل بيانات حقيقية.
+    """
+    if engine.dialect.name != 'sqlite':
+        return f'قاعدة البيانات {engine.dialect.name} وليست SQLite'
+    if os.environ.get('FLASK_ENV') == 'production' or os.environ.get('RENDER'):
+        return 'البيئة الحالية بيئة إنتاج (FLASK_ENV=production أو RENDER)'
+    if not os.environ.get('DATABASE_URL'):
+        return 'DATABASE_URL غير محدد - القاعدة الافتراضية هي قاعدة التطوير'
+    return None
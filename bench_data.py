@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+توليد بيانات تجريبية بأحجام واقعية لاختبار أداء نظام VAYON المتقدم
+
+الأحجام الافتراضية (--scale 1): 100 ألف منتج (موديلات بمقاسات وألوان)،
+50 ألف عميل، 250 ألف فاتورة بحوالي مليون بند، شحنات لنصف الفواتير
+ومهام تحصيل للآجل. نفس --seed ينتج نفس البيانات، فتبقى نتائج
+bench_run.py قابلة للمقارنة بين الإصدارات.
+
+قاعدة البيانات من DATABASE_URL (PostgreSQL) وإلا vayon_advanced.db. الخيار
+--reset يحذف كل الجداول، فيُرفض إلا على ملف SQLite محدد في DATABASE_URL:
+    DATABASE_URL=sqlite:////tmp/bench.db python bench_data.py --scale 0.1 --reset
+
+بيانات التطبيق المنشور (app.py) في bench_data_erp.py.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+# إضافة المجلد الحالي للمسار
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from vayon_advanced import (
+    app, db, User, Customer, Category, Product, Sale, SaleItem, Treasury, TreasuryTransaction,
+    ShippingCompany, Shipment, ShipmentStatusHistory, CollectionTask, SEARCHABLE_MODELS,
+    upgrade_schema, rebuild_sales_rollup, rebuild_customer_balances, take_balance_snapshots,
+    treasury_registry
+)
+from search_index import normalize_arabic, rebuild_search_index
+from bench_common import (
+    INSERT_BATCH_SIZE, BENCH_USERNAME, BENCH_PASSWORD, FIRST_NAMES, LAST_NAMES, GOVERNORATES, COLORS, SIZES,
+    Inserter, new_id, money, random_phone, progress, reset_refusal
+)
+
+# الأحجام عند --scale 1
+BASE_VOLUMES = {
+    'models': 10_000,       # كل موديل = مقاسات × ألوان = 10 منتجات في المتوسط
+    'customers': 50_000,
+    'sales': 250_000,       # 4 بنود في المتوسط = مليون بند
+    'collection_tasks': 20_000,
+}
+
+CATEGORIES = ('فساتين', 'بلوزات', 'قمصان', 'بناطيل', 'جيبات', 'عبايات', 'أطقم', 'جواكت',
+              'تيشيرتات', 'ملابس أطفال', 'إكسسوارات', 'أحذية')
+STYLES = ('كلاسيك', 'كاجوال', 'سواريه', 'صيفي', 'شتوي', 'قطن', 'شيفون', 'جينز', 'كتان', 'ستان')
+BRANDS = ('VAYON', 'Vayon Kids', 'Basic Line', 'Modest', 'Urban', 'Elegance')
+PAYMENT_METHODS = ('نقدي', 'نقدي', 'نقدي', 'آجل', 'تحويل بنكي', 'فودافون كاش')
+SHIPMENT_STATUSES = ('تم التسليم', 'تم التسليم', 'تم التسليم', 'في الطريق', 'تم الاستلام',
+                     'قيد التحضير', 'مرتجع', 'ملغي')
+TASK_STATUSES = ('جديدة', 'قيد المعالجة', 'مكتملة', 'مكتملة', 'مؤجلة', 'ملغية')
+TASK_PRIORITIES = ('عالية', 'متوسطة', 'متوسطة', 'منخفضة')
+SHIPPING_COMPANIES = (('بوسطة', 'BOSTA', 35, 1.0), ('أرامكس', 'ARAMEX', 45, 1.5),
+                      ('مايلرز', 'MYLERZ', 30, 1.0), ('جي آند تي', 'JNT', 32, 0.75))
+
+
+def create_users(rng, now):
+    """مستخدم الاختبار (مدير) ومجموعة محصلين"""
+    admin = User(id=new_id(rng), username=BENCH_USERNAME, email='bench@vayon.com',
+                 full_name='مستخدم اختبار الأداء', role='admin', is_active=True)
+    admin.set_password(BENCH_PASSWORD)
+    db.session.add(admin)
+
+    collectors = []
+    for i in range(10):
+        collector = User(id=new_id(rng), username=f'bench_collector_{i}',
+                         email=f'collector{i}@vayon.com', full_name=f'محصل {i + 1}',
+                         role='user', is_active=True)
+        collector.set_password(BENCH_PASSWORD)
+        db.session.add(collector)
+        collectors.append(collector.id)
+    db.session.flush()
+    return admin.id, collectors
+
+
+def create_products(rng, volumes, now):
+    """موديلات بمقاسات وألوان، كل تركيبة منتج مستقل برمز وباركود"""
+    started = time.perf_counter()
+    category_ids = []
+    for name in CATEGORIES:
+        category = Category(id=new_id(rng), name=name, is_active=True)
+        db.session.add(category)
+        category_ids.append(category.id)
+    db.session.flush()
+
+    inserter = Inserter(db.session, Product)
+    products = []
+    for model_number in range(volumes['models']):
+        category_index = rng.randrange(len(CATEGORIES))
+        name = f'{CATEGORIES[category_index]} {rng.choice(STYLES)} {model_number + 1}'
+        brand = rng.choice(BRANDS)
+        cost_price = money(rng.randint(80, 900))
+        selling_price = money(cost_price * Decimal(rng.choice(('1.6', '1.8', '2.0', '2.2'))))
+        created_at = now - timedelta(days=rng.randint(30, 720))
+        sizes = rng.sample(SIZES, rng.randint(3, 5))
+        colors = rng.sample(COLORS, rng.randint(2, 3))
+        for color in colors:
+            for size in sizes:
+                product_id = new_id(rng)
+                sku = f'BN{model_number + 1:06d}-{COLORS.index(color):02d}-{size}'
+                barcode = f'622{len(products) + 1:010d}'
+                inserter.add({
+                    'id': product_id, 'name': f'{name} {color} {size}', 'sku': sku, 'barcode': barcode,
+                    'category_id': category_ids[category_index], 'cost_price': cost_price,
+                    'selling_price': selling_price, 'wholesale_price': money(selling_price * Decimal('0.85')),
+                    'current_stock': Decimal(rng.randint(0, 60)), 'min_stock': Decimal(5),
+                    'max_stock': Decimal(100), 'unit': 'قطعة', 'brand': brand,
+                    'model': f'M{model_number + 1:06d}', 'color': color, 'size': size,
+                    'weight': Decimal('0.350'), 'is_active': rng.random() > 0.03, 'is_service': False,
+                    'created_at': created_at, 'updated_at': created_at,
+                    'search_text': normalize_arabic(f'{name} {color} {size}', sku, barcode, brand),
+                })
+                products.append((product_id, selling_price, cost_price))
+    inserter.flush()
+    progress('المنتجات', started, inserter.count)
+    return products
+
+
+def create_customers(rng, volumes, now):
+    started = time.perf_counter()
+    inserter = Inserter(db.session, Customer)
+    customers = []
+    governorates = list(GOVERNORATES)
+    for i in range(volumes['customers']):
+        name = f'{rng.choice(FIRST_NAMES)} {rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+        phone = random_phone(rng)
+        governorate = rng.choice(governorates)
+        city = rng.choice(GOVERNORATES[governorate])
+        address = f'{rng.randint(1, 200)} شارع {rng.choice(LAST_NAMES)}، {city}'
+        customer_id = new_id(rng)
+        inserter.add({
+            'id': customer_id, 'name': name, 'phone': phone, 'address': address,
+            'city': city, 'governorate': governorate, 'is_active': True,
+            'created_at': now - timedelta(days=rng.randint(0, 720)),
+            'search_text': normalize_arabic(name, phone),
+        })
+        customers.append((customer_id, name, phone, address, city, governorate))
+    inserter.flush()
+    progress('العملاء', started, inserter.count)
+    return customers
+
+
+def create_treasuries(rng, now):
+    treasuries = {}
+    for treasury_type, name in (('main', 'الخزينة الرئيسية'), ('shipping', 'خزينة الشحن')):
+        treasury = Treasury(id=new_id(rng), name=name, treasury_type=treasury_type,
+                            current_balance=0, is_active=True, created_at=now - timedelta(days=800))
+        db.session.add(treasury)
+        treasuries[treasury_type] = treasury
+    db.session.flush()
+    return treasuries
+
+
+def create_shipping_companies(rng):
+    company_ids = []
+    for name, code, base_price, commission in SHIPPING_COMPANIES:
+        company = ShippingCompany(id=new_id(rng), name=name, code=f'BN-{code}',
+                                  base_price=Decimal(base_price), price_per_kg=Decimal(5),
+                                  collection_commission=Decimal(str(commission)), is_active=True)
+        db.session.add(company)
+        company_ids.append(company.id)
+    db.session.flush()
+    return company_ids
+
+
+def create_sales(rng, volumes, now, days, admin_id, collectors, products, customers, treasuries, company_ids):
+    """الفواتير وبنودها وحركات الخزينة والشحنات ومهام التحصيل بترتيب زمني"""
+    started = time.perf_counter()
+    sales = Inserter(db.session, Sale)
+    items = Inserter(db.session, SaleItem, INSERT_BATCH_SIZE * 4)
+    transactions = Inserter(db.session, TreasuryTransaction)
+    shipments = Inserter(db.session, Shipment)
+    history = Inserter(db.session, ShipmentStatusHistory)
+    tasks = Inserter(db.session, CollectionTask)
+
+    main_treasury = treasuries['main']
+    balance = Decimal('0')
+    sales_count = volumes['sales']
+    # نسبة المهام للفواتير الآجلة حتى يقترب العدد من الحجم المطلوب
+    task_ratio = min(1.0, volumes['collection_tasks'] / max(1, sales_count * 0.2))
+    start = now - timedelta(days=days)
+    step = timedelta(days=days) / max(1, sales_count)
+    year = now.year
+
+    # توزيع غير متساو: بعض المنتجات والعملاء أكثر مبيعاً من غيرهم
+    hot_products = products[:max(1, len(products) // 10)]
+
+    for i in range(sales_count):
+        sale_id = new_id(rng)
+        sale_date = start + step * i
+        customer_id, name, phone, address, city, governorate = rng.choice(customers)
+
+        subtotal = Decimal('0')
+        for _ in range(rng.choice((1, 2, 3, 4, 4, 5, 5, 6, 7))):
+            product_id, price, cost_price = rng.choice(hot_products if rng.random() < 0.5 else products)
+            quantity = rng.choice((1, 1, 1, 2, 3))
+            total_price = price * quantity
+            subtotal += total_price
+            items.add({
+                'id': new_id(rng), 'sale_id': sale_id, 'product_id': product_id,
+                'quantity': Decimal(quantity), 'unit_price': price, 'discount_amount': Decimal('0'),
+                'total_price': total_price, 'cost_price': cost_price, 'created_at': sale_date,
+            })
+
+        discount = money(subtotal * Decimal(rng.choice((0, 0, 0, 5, 10))) / 100)
+        is_shipped = rng.random() < 0.5
+        shipping_cost = Decimal(rng.choice((35, 45, 50, 60))) if is_shipped else Decimal('0')
+        total = subtotal - discount + shipping_cost
+        payment_method = rng.choice(PAYMENT_METHODS)
+        if payment_method == 'آجل':
+            paid = money(total * Decimal(rng.choice((0, 0, 25, 50))) / 100)
+        else:
+            paid = total
+        remaining = total - paid
+        payment_status = 'مدفوع' if remaining == 0 else ('غير مدفوع' if paid == 0 else 'مدفوع جزئياً')
+        is_returned = rng.random() < 0.02
+
+        shipping_status = 'قيد التحضير'
+        if is_shipped:
+            shipment_id = new_id(rng)
+            company_index = rng.randrange(len(company_ids))
+            status = rng.choice(SHIPMENT_STATUSES) if sale_date < now - timedelta(days=5) else 'في الطريق'
+            delivered = status == 'تم التسليم'
+            cod_amount = remaining if payment_method == 'آجل' else Decimal('0')
+            shipping_status = status
+            shipments.add({
+                'id': shipment_id, 'shipment_number': f'BNS-{i + 1:07d}', 'sale_id': sale_id,
+                'shipping_company_id': company_ids[company_index],
+                'recipient_name': name, 'recipient_phone': phone, 'recipient_address': address,
+                'recipient_city': city, 'recipient_governorate': governorate,
+                'weight': Decimal('0.5'), 'pieces_count': 1, 'cod_amount': cod_amount,
+                'shipping_cost': shipping_cost,
+                'collection_commission': money(cod_amount * Decimal(str(SHIPPING_COMPANIES[company_index][3])) / 100),
+                'created_date': sale_date, 'pickup_date': sale_date + timedelta(days=1),
+                'delivery_date': sale_date + timedelta(days=rng.randint(2, 6)) if delivered else None,
+                'expected_delivery': sale_date + timedelta(days=3), 'status': status,
+                'tracking_number': f'BNT{i + 1:09d}',
+                'collection_status': 'تم كاملاً' if delivered and cod_amount else 'لم يتم',
+                'collected_amount': cod_amount if delivered else Decimal('0'),
+                'created_at': sale_date, 'updated_at': sale_date + timedelta(days=2),
+            })
+            history.add({'id': new_id(rng), 'shipment_id': shipment_id, 'user_id': admin_id,
+                         'old_status': None, 'new_status': 'قيد التحضير', 'created_at': sale_date})
+            if status != 'قيد التحضير':
+                history.add({'id': new_id(rng), 'shipment_id': shipment_id, 'user_id': admin_id,
+                             'old_status': 'قيد التحضير', 'new_status': status,
+                             'created_at': sale_date + timedelta(days=2)})
+
+        sales.add({
+            'id': sale_id, 'invoice_number': f'BN-{year}-{i + 1:07d}', 'customer_id': customer_id,
+            'user_id': admin_id, 'sale_date': sale_date,
+            'due_date': sale_date + timedelta(days=30) if remaining else None,
+            'subtotal': subtotal, 'discount_amount': discount, 'discount_percentage': Decimal('0'),
+            'tax_amount': Decimal('0'), 'tax_percentage': Decimal('0'), 'shipping_cost': shipping_cost,
+            'total_amount': total, 'paid_amount': paid, 'remaining_amount': remaining,
+            'payment_method': payment_method, 'payment_status': payment_status,
+            'shipping_address': address if is_shipped else None,
+            'shipping_city': city if is_shipped else None,
+            'shipping_governorate': governorate if is_shipped else None,
+            'shipping_phone': phone if is_shipped else None, 'shipping_status': shipping_status,
+            'status': 'مكتملة', 'is_returned': is_returned,
+            'created_at': sale_date, 'updated_at': sale_date,
+        })
+
+        if paid > 0:
+            transactions.add({
+                'id': new_id(rng), 'treasury_id': main_treasury.id, 'user_id': admin_id,
+                'transaction_type': 'إيداع', 'reference_type': 'فاتورة بيع', 'reference_id': sale_id,
+                'amount': paid, 'balance_before': balance, 'balance_after': balance + paid,
+                'description': f'دفعة من فاتورة بيع رقم BN-{year}-{i + 1:07d}', 'created_at': sale_date,
+            })
+            balance += paid
+
+        if remaining > 0 and rng.random() < task_ratio:
+            status = rng.choice(TASK_STATUSES)
+            tasks.add({
+                'id': new_id(rng), 'customer_id': customer_id, 'sale_id': sale_id,
+                'assigned_user_id': rng.choice(collectors), 'created_by_id': admin_id,
+                'title': f'تحصيل فاتورة BN-{year}-{i + 1:07d}', 'amount_to_collect': remaining,
+                'priority': rng.choice(TASK_PRIORITIES), 'status': status,
+                'due_date': sale_date + timedelta(days=rng.randint(7, 45)),
+                'completed_date': sale_date + timedelta(days=rng.randint(3, 30)) if status == 'مكتملة' else None,
+                'contact_attempts': rng.randint(0, 5), 'created_at': sale_date, 'updated_at': sale_date,
+            })
+
+        if (i + 1) % 50_000 == 0:
+            print(f"   ... {i + 1:,} فاتورة")
+
+    for inserter in (sales, items, transactions, shipments, history, tasks):
+        inserter.flush()
+    main_treasury.current_balance = balance
+
+    progress('الفواتير', started, sales.count)
+    print(f"   ✅ بنود الفواتير: {items.count:,} | حركات الخزينة: {transactions.count:,} | "
+          f"الشحنات: {shipments.count:,} | مهام التحصيل: {tasks.count:,}")
+
+
+def generate(scale, seed, days, reset):
+    rng = random.Random(seed)
+    volumes = {name: max(1, int(count * scale)) for name, count in BASE_VOLUMES.items()}
+    now = datetime.utcnow().replace(hour=12, minute=0, second=0, microsecond=0)
+
+    with app.app_context():
+        if reset:
+            refusal = reset_refusal(db.engine)
+            if refusal:
+                print(f"❌ رفض --reset: {refusal}")
+                return False
+            print("🗑️ حذف الجداول القديمة...")
+            db.drop_all()
+            db.create_all()
+            upgrade_schema()
+        elif db.session.query(Sale.id).first() is not None or User.query.filter_by(username=BENCH_USERNAME).first():
+            print("❌ قاعدة البيانات تحتوي على بيانات - استخدم --reset على قاعدة بيانات اختبار فقط")
+            return False
+
+        print(f"🏗️ توليد البيانات (scale={scale}, seed={seed}, {days} يوم)...")
+        total_started = time.perf_counter()
+        try:
+            admin_id, collectors = create_users(rng, now)
+            treasuries = create_treasuries(rng, now)
+            company_ids = create_shipping_companies(rng)
+            products = create_products(rng, volumes, now)
+            customers = create_customers(rng, volumes, now)
+            create_sales(rng, volumes, now, days, admin_id, collectors, products, customers,
+                         treasuries, company_ids)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ خطأ في توليد البيانات: {e}")
+            return False
+
+        print("📊 بناء الملخصات والفهارس...")
+        rebuild_sales_rollup()
+        rebuild_customer_balances()
+        take_balance_snapshots(now - timedelta(days=days // 2))
+        take_balance_snapshots()
+        for model in SEARCHABLE_MODELS:
+            rebuild_search_index(db.engine, model.__table__)
+        treasury_registry.invalidate()
+
+        # إحصائيات المخطط حتى يختار المحسن الفهارس كما في الإنتاج
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql('ANALYZE')
+
+        print(f"🎉 تم توليد البيانات في {time.perf_counter() - total_started:.1f} ثانية")
+        print(f"👤 المستخدم: {BENCH_USERNAME} / {BENCH_PASSWORD}")
+        return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='توليد بيانات تجريبية لاختبار الأداء')
+    parser.add_argument('--scale', type=float, default=1.0, help='مضاعف الأحجام الافتراضية (0.01 للتجربة السريعة)')
+    parser.add_argument('--seed', type=int, default=42, help='بذرة المولد العشوائي')
+    parser.add_argument('--days', type=int, default=365, help='الفترة الزمنية للفواتير بالأيام')
+    parser.add_argument('--reset', action='store_true', help='حذف كل الجداول قبل التوليد (SQLite من DATABASE_URL فقط)')
+    args = parser.parse_args()
+
+    sys.exit(0 if generate(args.scale, args.seed, args.days, args.reset) else 1)
@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+توليد بيانات تجريبية بأحجام واقعية لاختبار أداء التطبيق المنشور (app.py)
+
+الأحجام الافتراضية (--scale 1): 20 ألف منتج جاهز و 2000 مادة خام،
+20 ألف عميل، 100 ألف فاتورة بيع، 500 مورد بـ 20 ألف فاتورة شراء،
+50 مصنعاً بـ 20 ألف أمر تصنيع (بمواعيد تسليم متأخرة وقريبة ودرجات
+جودة للمستلم). نفس --seed ينتج نفس البيانات.
+
+app.py و vayon_advanced.py يستخدمان نفس أسماء الجداول بأعمدة مختلفة،
+فلكل منهما قاعدة اختبار مستقلة:
+    DATABASE_URL=sqlite:////tmp/bench_erp.db python bench_data_erp.py --scale 0.1 --reset
+    DATABASE_URL=sqlite:////tmp/bench_erp.db python bench_run.py --app erp
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+# إضافة المجلد الحالي للمسار
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import (
+    app, db, User, Customer, Product, Sale, SaleItem, Cashbox, Supplier, PurchaseInvoice,
+    PurchaseInvoiceItem, Factory, ManufacturingOrder, ManufacturingOrderRawMaterial,
+    ManufacturingOrderFinishedProduct, upgrade_schema, rebuild_sales_rollup
+)
+from bench_common import (
+    INSERT_BATCH_SIZE, BENCH_USERNAME, BENCH_PASSWORD, FIRST_NAMES, LAST_NAMES, GOVERNORATES, COLORS, SIZES,
+    Inserter, new_id, money, random_phone, progress, reset_refusal
+)
+
+# الأحجام عند --scale 1
+BASE_VOLUMES = {
+    'finished_products': 20_000,
+    'raw_materials': 2_000,
+    'customers': 20_000,
+    'sales': 100_000,               # 3 بنود في المتوسط
+    'suppliers': 500,
+    'purchase_invoices': 20_000,
+    'factories': 50,
+    'manufacturing_orders': 20_000,
+}
+
+GARMENTS = ('قميص', 'بنطلون', 'فستان', 'بلوزة', 'جيبة', 'عباية', 'جاكت', 'تيشيرت', 'بيجامة', 'طقم أطفال')
+MATERIALS = (('قماش قطن', 'متر'), ('قماش كتان', 'متر'), ('قماش جينز', 'متر'), ('شيفون', 'متر'),
+             ('خيط', 'بكرة'), ('أزرار', 'قطعة'), ('سوستة', 'قطعة'), ('بطانة', 'متر'), ('فيزلين', 'متر'))
+SPECIALIZATIONS = ('قمصان', 'بناطيل', 'فساتين', 'ملابس أطفال', 'عبايات', 'تريكو')
+SHIPPING = (('pending', 'pending'), ('shipped', 'pending'), ('delivered', 'collected'),
+            ('delivered', 'collected'), ('delivered', 'collected'))
+# حالات أوامر التصنيع بنسبها التقريبية
+ORDER_STATUSES = ('completed',) * 12 + ('in_progress',) * 5 + ('pending',) * 2 + ('cancelled',)
+QUALITY_GRADES = ('A',) * 7 + ('B',) * 2 + ('C',)
+
+
+def create_users(rng):
+    admin = User(id=new_id(rng), username=BENCH_USERNAME, email='bench@vayon.com',
+                 full_name='مستخدم اختبار الأداء', role='admin', is_active=True)
+    admin.set_password(BENCH_PASSWORD)
+    db.session.add(admin)
+    db.session.flush()
+    return admin.id
+
+
+def create_cashboxes(rng, now):
+    for cashbox_type, name in (('main', 'الخزينة الرئيسية'), ('shipping', 'خزينة الشحن')):
+        db.session.add(Cashbox(id=new_id(rng), name=name, type=cashbox_type, is_active=True,
+                               current_balance=money(rng.randint(10_000, 500_000)),
+                               created_at=now - timedelta(days=800)))
+    db.session.flush()
+
+
+def create_products(rng, volumes, now, admin_id):
+    """منتجات جاهزة (موديل × لون × مقاس) ومواد خام"""
+    started = time.perf_counter()
+    inserter = Inserter(db.session, Product)
+    finished = []
+    for i in range(volumes['finished_products']):
+        product_id = new_id(rng)
+        name = f'{rng.choice(GARMENTS)} {i // 20 + 1} {rng.choice(COLORS)} {rng.choice(SIZES)}'
+        cost_price = money(rng.randint(80, 600))
+        selling_price = money(cost_price * Decimal(rng.choice(('1.6', '1.8', '2.0'))))
+        created_at = now - timedelta(days=rng.randint(30, 720), seconds=rng.randint(0, 86399))
+        inserter.add({
+            'id': product_id, 'name': name, 'code': f'FP-{i + 1:06d}', 'type': 'finished_product',
+            'category': name.split()[0], 'unit': 'قطعة',
+            'current_stock': Decimal(rng.randint(0, 80)), 'min_stock': Decimal(5), 'reserved_stock': Decimal(0),
+            'cost_price': cost_price, 'selling_price': selling_price,
+            'manufacturing_cost': money(cost_price * Decimal('0.4')),
+            'is_active': rng.random() > 0.03, 'created_at': created_at, 'created_by': admin_id,
+        })
+        finished.append((product_id, selling_price, cost_price))
+
+    raw = []
+    for i in range(volumes['raw_materials']):
+        product_id = new_id(rng)
+        material, unit = rng.choice(MATERIALS)
+        cost_price = money(rng.randint(5, 120))
+        created_at = now - timedelta(days=rng.randint(30, 720), seconds=rng.randint(0, 86399))
+        inserter.add({
+            'id': product_id, 'name': f'{material} {rng.choice(COLORS)} {i + 1}', 'code': f'RM-{i + 1:05d}',
+            'type': 'raw_material', 'category': material, 'unit': unit,
+            'current_stock': Decimal(rng.randint(0, 5000)), 'min_stock': Decimal(100),
+            'reserved_stock': Decimal(0), 'cost_price': cost_price, 'selling_price': Decimal(0),
+            'manufacturing_cost': Decimal(0), 'is_active': True, 'created_at': created_at,
+            'created_by': admin_id,
+        })
+        raw.append((product_id, cost_price))
+    inserter.flush()
+    progress('المنتجات والمواد الخام', started, inserter.count)
+    return finished, raw
+
+
+def create_customers(rng, volumes, now, admin_id):
+    started = time.perf_counter()
+    inserter = Inserter(db.session, Customer)
+    customers = []
+    for i in range(volumes['customers']):
+        customer_id = new_id(rng)
+        city = rng.choice(GOVERNORATES[rng.choice(list(GOVERNORATES))])
+        inserter.add({
+            'id': customer_id, 'name': f'{rng.choice(FIRST_NAMES)} {rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+            'phone': random_phone(rng), 'address': f'{rng.randint(1, 200)} شارع {rng.choice(LAST_NAMES)}، {city}',
+            'city': city, 'is_active': True,
+            'created_at': now - timedelta(days=rng.randint(0, 720), seconds=rng.randint(0, 86399)),
+            'created_by': admin_id,
+        })
+        customers.append(customer_id)
+    inserter.flush()
+    progress('العملاء', started, inserter.count)
+    return customers
+
+
+def create_sales(rng, volumes, now, days, admin_id, products, customers):
+    """فواتير البيع وبنودها بترتيب زمني وأرقام INV-يوم-تسلسل كما يولدها التطبيق"""
+    started = time.perf_counter()
+    sales = Inserter(db.session, Sale)
+    items = Inserter(db.session, SaleItem, INSERT_BATCH_SIZE * 4)
+    start = now - timedelta(days=days)
+    step = timedelta(days=days) / max(1, volumes['sales'])
+    hot_products = products[:max(1, len(products) // 10)]
+    day_numbers = {}
+
+    for i in range(volumes['sales']):
+        sale_id = new_id(rng)
+        sale_date = start + step * i
+        day = sale_date.strftime('%Y%m%d')
+        day_numbers[day] = day_numbers.get(day, 0) + 1
+
+        subtotal = Decimal('0')
+        for _ in range(rng.choice((1, 2, 3, 3, 4, 5))):
+            product_id, price, cost_price = rng.choice(hot_products if rng.random() < 0.5 else products)
+            quantity = rng.choice((1, 1, 2, 3))
+            total_price = price * quantity
+            subtotal += total_price
+            items.add({
+                'id': new_id(rng), 'sale_id': sale_id, 'product_id': product_id, 'quantity': Decimal(quantity),
+                'unit_price': price, 'total_price': total_price, 'cost_price': cost_price,
+            })
+
+        discount = money(subtotal * Decimal(rng.choice((0, 0, 0, 5, 10))) / 100)
+        total = subtotal - discount
+        paid = total if rng.random() < 0.8 else money(total * Decimal(rng.choice((0, 25, 50))) / 100)
+        shipping_status, collection_status = rng.choice(SHIPPING) if sale_date < now - timedelta(days=5) else SHIPPING[0]
+        sales.add({
+            'id': sale_id, 'invoice_number': f'INV-{day}-{day_numbers[day]:04d}',
+            'customer_id': rng.choice(customers), 'sale_date': sale_date,
+            'subtotal': subtotal, 'discount_amount': discount, 'tax_amount': Decimal('0'),
+            'total_amount': total, 'paid_amount': paid, 'remaining_amount': total - paid,
+            'shipping_status': shipping_status, 'collection_status': collection_status,
+            'status': 'returned' if rng.random() < 0.02 else 'active',
+            'created_at': sale_date, 'created_by': admin_id,
+        })
+
+    sales.flush()
+    items.flush()
+    progress('فواتير البيع', started, sales.count)
+    print(f"   ✅ بنود الفواتير: {items.count:,}")
+
+
+def create_suppliers_and_purchases(rng, volumes, now, days, admin_id, raw):
+    started = time.perf_counter()
+    suppliers = Inserter(db.session, Supplier)
+    supplier_ids = []
+    for i in range(volumes['suppliers']):
+        supplier_id = new_id(rng)
+        suppliers.add({
+            'id': supplier_id, 'name': f'مورد {rng.choice(LAST_NAMES)} {i + 1}',
+            'contact_person': f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+            'phone': random_phone(rng), 'supplier_type': 'raw_materials', 'credit_limit': Decimal(100_000),
+            'current_balance': Decimal(0), 'rating': rng.randint(2, 5), 'is_active': True,
+            'created_at': now - timedelta(days=rng.randint(30, 800), seconds=rng.randint(0, 86399)),
+            'created_by': admin_id,
+        })
+        supplier_ids.append(supplier_id)
+    suppliers.flush()
+
+    invoices = Inserter(db.session, PurchaseInvoice)
+    items = Inserter(db.session, PurchaseInvoiceItem)
+    start = now - timedelta(days=days)
+    step = timedelta(days=days) / max(1, volumes['purchase_invoices'])
+    day_numbers = {}
+    for i in range(volumes['purchase_invoices']):
+        invoice_id = new_id(rng)
+        invoice_date = start + step * i
+        day = invoice_date.strftime('%Y%m%d')
+        day_numbers[day] = day_numbers.get(day, 0) + 1
+
+        subtotal = Decimal('0')
+        received = rng.random() < 0.85
+        for _ in range(rng.randint(1, 5)):
+            product_id, unit_cost = rng.choice(raw)
+            quantity = Decimal(rng.choice((50, 100, 200, 500)))
+            subtotal += unit_cost * quantity
+            items.add({
+                'id': new_id(rng), 'purchase_invoice_id': invoice_id, 'product_id': product_id,
+                'quantity': quantity, 'unit_cost': unit_cost, 'total_cost': unit_cost * quantity,
+                'received_quantity': quantity if received else Decimal(0),
+            })
+
+        paid = subtotal if rng.random() < 0.6 else money(subtotal * Decimal(rng.choice((0, 50))) / 100)
+        invoices.add({
+            'id': invoice_id, 'invoice_number': f'PUR-{day}-{day_numbers[day]:04d}',
+            'supplier_id': rng.choice(supplier_ids), 'invoice_date': invoice_date,
+            'due_date': invoice_date + timedelta(days=30), 'subtotal': subtotal,
+            'discount_percentage': Decimal(0), 'discount_amount': Decimal(0), 'tax_percentage': Decimal(0),
+            'tax_amount': Decimal(0), 'shipping_cost': Decimal(0), 'total_amount': subtotal,
+            'payment_status': 'paid' if paid == subtotal else ('pending' if paid == 0 else 'partial'),
+            'paid_amount': paid, 'remaining_amount': subtotal - paid, 'payment_method': 'cash',
+            'status': 'received' if received else 'confirmed', 'created_at': invoice_date, 'created_by': admin_id,
+        })
+    invoices.flush()
+    items.flush()
+    progress('الموردون وفواتير الشراء', started, suppliers.count + invoices.count)
+
+
+def create_manufacturing(rng, volumes, now, days, admin_id, finished, raw):
+    """المصانع وأوامر التصنيع: المكتملة بتاريخ تسليم فعلي ودرجات جودة، والجارية
+    بمواعيد موزعة حول اليوم (متأخرة، اليوم، هذا الأسبوع، لاحقاً)"""
+    started = time.perf_counter()
+    factory_ids = []
+    for i in range(volumes['factories']):
+        factory = Factory(id=new_id(rng), name=f'مصنع {rng.choice(LAST_NAMES)} {i + 1}',
+                          contact_person=f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+                          phone=random_phone(rng), specialization=rng.choice(SPECIALIZATIONS),
+                          production_capacity=rng.choice((100, 200, 300)), quality_rating=rng.randint(2, 5),
+                          is_active=True, created_by=admin_id,
+                          created_at=now - timedelta(days=rng.randint(100, 900), seconds=rng.randint(0, 86399)))
+        db.session.add(factory)
+        factory_ids.append(factory.id)
+    db.session.flush()
+
+    orders = Inserter(db.session, ManufacturingOrder)
+    materials = Inserter(db.session, ManufacturingOrderRawMaterial)
+    products = Inserter(db.session, ManufacturingOrderFinishedProduct)
+    start = now - timedelta(days=days)
+    step = timedelta(days=days) / max(1, volumes['manufacturing_orders'])
+    day_numbers = {}
+    for i in range(volumes['manufacturing_orders']):
+        order_id = new_id(rng)
+        order_date = start + step * i
+        day = order_date.strftime('%Y%m%d')
+        day_numbers[day] = day_numbers.get(day, 0) + 1
+        status = rng.choice(ORDER_STATUSES)
+        if status == 'completed':
+            expected = order_date + timedelta(days=rng.randint(7, 30))
+            actual = expected + timedelta(days=rng.randint(-3, 7), hours=rng.randint(0, 23))
+        else:
+            expected = now + timedelta(days=rng.randint(-20, 30), hours=rng.randint(-12, 12))
+            actual = None
+
+        raw_cost = Decimal('0')
+        for _ in range(rng.randint(1, 3)):
+            product_id, unit_cost = rng.choice(raw)
+            quantity = Decimal(rng.choice((20, 50, 100)))
+            raw_cost += unit_cost * quantity
+            sent = status in ('completed', 'in_progress')
+            materials.add({
+                'id': new_id(rng), 'manufacturing_order_id': order_id, 'product_id': product_id,
+                'quantity_required': quantity, 'quantity_sent': quantity if sent else Decimal(0),
+                'unit_cost': unit_cost, 'total_cost': unit_cost * quantity,
+            })
+
+        for _ in range(rng.randint(1, 3)):
+            product_id, _, unit_cost = rng.choice(finished)
+            quantity = Decimal(rng.choice((50, 100, 200)))
+            products.add({
+                'id': new_id(rng), 'manufacturing_order_id': order_id, 'product_id': product_id,
+                'quantity_expected': quantity,
+                'quantity_received': quantity if status == 'completed' else Decimal(0),
+                'quality_grade': rng.choice(QUALITY_GRADES) if status == 'completed' else 'A',
+                'unit_cost': unit_cost, 'total_cost': unit_cost * quantity,
+            })
+
+        manufacturing_cost = money(rng.randint(1000, 20000))
+        orders.add({
+            'id': order_id, 'order_number': f'MFG-{day}-{day_numbers[day]:04d}',
+            'factory_id': rng.choice(factory_ids), 'order_date': order_date,
+            'expected_delivery_date': expected, 'actual_delivery_date': actual, 'status': status,
+            'raw_materials_cost': raw_cost, 'manufacturing_cost': manufacturing_cost,
+            'total_cost': raw_cost + manufacturing_cost, 'created_at': order_date, 'created_by': admin_id,
+        })
+
+    for inserter in (orders, materials, products):
+        inserter.flush()
+    progress('أوامر التصنيع', started, orders.count)
+    print(f"   ✅ مواد خام الأوامر: {materials.count:,} | منتجات الأوامر: {products.count:,}")
+
+
+def generate(scale, seed, days, reset):
+    rng = random.Random(seed)
+    volumes = {name: max(1, int(count * scale)) for name, count in BASE_VOLUMES.items()}
+    now = datetime.now().replace(microsecond=0)
+
+    with app.app_context():
+        if reset:
+            refusal = reset_refusal(db.engine)
+            if refusal:
+                print(f"❌ رفض --reset: {refusal}")
+                return False
+            print("🗑️ حذف الجداول القديمة...")
+            db.drop_all()
+            upgrade_schema()
+        elif db.session.query(Sale.id).first() is not None or User.query.filter_by(username=BENCH_USERNAME).first():
+            print("❌ قاعدة البيانات تحتوي على بيانات - استخدم --reset على قاعدة بيانات اختبار فقط")
+            return False
+
+        print(f"🏗️ توليد البيانات (scale={scale}, seed={seed}, {days} يوم)...")
+        total_started = time.perf_counter()
+        try:
+            admin_id = create_users(rng)
+            create_cashboxes(rng, now)
+            finished, raw = create_products(rng, volumes, now, admin_id)
+            customers = create_customers(rng, volumes, now, admin_id)
+            create_sales(rng, volumes, now, days, admin_id, finished, customers)
+            create_suppliers_and_purchases(rng, volumes, now, days, admin_id, raw)
+            create_manufacturing(rng, volumes, now, days, admin_id, finished, raw)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ خطأ في توليد البيانات: {e}")
+            return False
+
+        print("📊 بناء ملخص المبيعات اليومي...")
+        rebuild_sales_rollup()
+
+        # إحصائيات المخطط حتى يختار المحسن الفهارس كما في الإنتاج
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql('ANALYZE')
+
+        print(f"🎉 تم توليد البيانات في {time.perf_counter() - total_started:.1f} ثانية")
+        print(f"👤 المستخدم: {BENCH_USERNAME} / {BENCH_PASSWORD}")
+        return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='توليد بيانات تجريبية لاختبار أداء app.py')
+    parser.add_argument('--scale', type=float, default=1.0, help='مضاعف الأحجام الافتراضية (0.01 للتجربة السريعة)')
+    parser.add_argument('--seed', type=int, default=42, help='بذرة المولد العشوائي')
+    parser.add_argument('--days', type=int, default=365, help='الفترة الزمنية للفواتير والأوامر بالأيام')
+    parser.add_argument('--reset', action='store_true', help='حذف كل الجداول قبل التوليد (SQLite من DATABASE_URL فقط)')
+    args = parser.parse_args()
+
+    sys.exit(0 if generate(args.scale, args.seed, args.days, args.reset) else 1)
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+قياس أداء المسارات الرئيسية لنظام VAYON
+
+يرسل طلبات لكل مسار عبر Flask test client (بدون خادم) ويسجل زمن
+الاستجابة (p50 و p95) وعدد استعلامات SQL لكل مسار، ويحفظ النتائج في
+ملف JSON باسم الإصدار الحالي (git commit) للمقارنة بين الإصدارات:
+
+    python bench_data.py --scale 0.1 --reset
+    python bench_run.py
+    python bench_run.py --compare bench_results/<commit>.json
+
+--app erp يقيس التطبيق المنشور (app.py) على بيانات bench_data_erp.py في
+قاعدة اختبار مستقلة. القوائم تُطلب بصيغة JSON (?format=json) لقياس
+الاستعلامات والترقيم بدون زمن عرض القوالب.
+
+مع --compare يُرجع السكريبت 1 إذا تراجع أي مسار (زمن p95 أعلى من
+الحد أو استعلامات أكثر)، فيمكن استخدامه في CI.
+"""
+
+import argparse
+import importlib
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+# إضافة المجلد الحالي للمسار
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_common import BENCH_USERNAME
+
+# (الاسم، المسار) - القيم بين الأقواس تُملأ من بيانات قاعدة البيانات.
+# التصدير ينفذ استعلامه أثناء التدفق بعد انتهاء الطلب فلا يظهر في عدد الاستعلامات
+ADVANCED_ROUTES = (
+    ('dashboard', '/dashboard'),
+    ('sales_list', '/sales'),
+    ('sales_list_search', '/sales?search={customer_name}'),
+    ('sale_detail', '/sales/{sale_id}'),
+    ('sale_pdf', '/sales/{sale_id}/pdf'),
+    ('daily_sales_pdf', '/sales/daily-pdf?date={sale_date}'),
+    ('product_search', '/api/products/search?q={product_word}'),
+    ('product_barcode', '/api/products/search?q={barcode}'),
+    ('customer_search', '/api/customers/search?q={customer_phone}'),
+    ('customers_list', '/customers'),
+    ('customer_detail', '/customers/{customer_id}'),
+    ('shipments_list', '/shipments'),
+    ('shipment_detail', '/shipments/{shipment_id}'),
+    ('collections', '/collections'),
+    ('collection_tasks', '/collections/tasks'),
+    ('reports', '/reports'),
+    ('sales_report', '/reports/sales'),
+    ('collections_report', '/reports/collections'),
+    ('treasury_report', '/reports/treasury'),
+    ('sales_report_export', '/reports/sales/export'),
+)
+
+# مسارات app.py: القوائم بالترقيم بالمؤشر (الصفحة الأولى وصفحة عميقة)،
+# ولوحة التحكم وتقارير التصنيع ومتابعة التسليم ومراقبة الجودة
+ERP_ROUTES = (
+    ('dashboard', '/dashboard'),
+    ('inventory_list', '/inventory?format=json'),
+    ('inventory_deep_page', '/inventory?format=json&cursor={product_cursor}'),
+    ('inventory_search', '/inventory?format=json&search={product_word}'),
+    ('customers_list', '/customers?format=json'),
+    ('customers_deep_page', '/customers?format=json&cursor={customer_cursor}'),
+    ('sales_list', '/sales?format=json'),
+    ('sales_deep_page', '/sales?format=json&cursor={sale_cursor}'),
+    ('purchases_list', '/purchases?format=json'),
+    ('suppliers_list', '/suppliers?format=json'),
+    ('factories_list', '/factories?format=json'),
+    ('manufacturing_orders_list', '/manufacturing-orders?format=json'),
+    ('manufacturing_orders_deep_page', '/manufacturing-orders?format=json&cursor={order_cursor}'),
+    ('manufacturing_reports', '/manufacturing-reports'),
+    ('delivery_tracking', '/manufacturing-orders/delivery-tracking'),
+    ('quality_control', '/manufacturing-orders/quality-control'),
+    ('quality_control_period', '/manufacturing-orders/quality-control?date_from={quarter_start}&date_to={today}'),
+)
+
+RESULTS_FOLDER = 'bench_results'
+
+SERVER_TIMING_QUERIES = re.compile(r'desc="(\d+) queries"')
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def percentile(values, fraction):
+    """النسبة المئوية بالاستيفاء الخطي بين أقرب قيمتين"""
+    values = sorted(values)
+    position = (len(values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def advanced_parameters(m):
+    """قيم ثابتة للمسارات (أقدم فاتورة مشحونة وعميلها) حتى تتكرر نفس الطلبات في كل تشغيل"""
+    shipment = m.Shipment.query.order_by(m.Shipment.shipment_number).first()
+    sale = m.db.session.get(m.Sale, shipment.sale_id) if shipment else m.Sale.query.order_by(m.Sale.invoice_number).first()
+    if sale is None:
+        return None
+
+    customer = m.db.session.get(m.Customer, sale.customer_id) or m.Customer.query.first()
+    product = m.Product.query.join(m.SaleItem, m.SaleItem.product_id == m.Product.id).filter(
+        m.SaleItem.sale_id == sale.id
+    ).first() or m.Product.query.first()
+    latest_sale = m.Sale.query.order_by(m.Sale.sale_date.desc()).first()
+
+    return {
+        'sale_id': sale.id,
+        'sale_date': latest_sale.sale_date.strftime('%Y-%m-%d'),
+        'customer_id': customer.id,
+        'customer_name': customer.name.split()[0],
+        'customer_phone': customer.phone,
+        'product_word': product.name.split()[0],
+        'barcode': product.barcode,
+        'shipment_id': shipment.id if shipment else '',
+    }
+
+
+def middle_cursor(m, model):
+    """مؤشر صفحة في منتصف القائمة (ترتيب created_at, id التنازلي) لقياس الصفحات العميقة"""
+    count = m.db.session.query(m.db.func.count(model.id)).scalar()
+    row = m.db.session.query(model.created_at, model.id).order_by(
+        model.created_at.desc(), model.id.desc()
+    ).offset(count // 2).first()
+    return m.encode_cursor(*row) if row else ''
+
+
+def erp_parameters(m):
+    """مؤشرات الصفحات العميقة وفترة مراقبة الجودة (آخر 90 يوماً)"""
+    product = m.Product.query.order_by(m.Product.code).first()
+    if product is None or m.Sale.query.first() is None:
+        return None
+
+    today = datetime.now().date()
+    return {
+        'product_word': product.name.split()[0],
+        'product_cursor': middle_cursor(m, m.Product),
+        'customer_cursor': middle_cursor(m, m.Customer),
+        'sale_cursor': middle_cursor(m, m.Sale),
+        'order_cursor': middle_cursor(m, m.ManufacturingOrder),
+        'quarter_start': (today - timedelta(days=90)).isoformat(),
+        'today': today.isoformat(),
+    }
+
+
+# لكل تطبيق: الوحدة، المسارات، قيم المسارات، الجداول المعدودة في النتائج.
+# الوحدة تُستورد عند الحاجة فقط لأن استيرادها ينشئ جداولها في قاعدة البيانات
+TARGETS = {
+    'advanced': ('vayon_advanced', ADVANCED_ROUTES, advanced_parameters,
+                 ('Product', 'Customer', 'Sale', 'SaleItem', 'Shipment', 'CollectionTask')),
+    'erp': ('app', ERP_ROUTES, erp_parameters,
+            ('Product', 'Customer', 'Sale', 'SaleItem', 'PurchaseInvoice', 'Supplier', 'Factory',
+             'ManufacturingOrder', 'ManufacturingOrderFinishedProduct')),
+}
+
+
+def table_counts(m, model_names):
+    models = [getattr(m, name) for name in model_names]
+    return {
+        model.__tablename__: m.db.session.query(m.db.func.count(model.id)).scalar()
+        for model in models
+    }
+
+
+def measure(client, path, iterations, warmup):
+    """زمن كل طلب بالمللي ثانية وعدد الاستعلامات وحالة آخر استجابة"""
+    timings = []
+    queries = []
+    status = None
+    for i in range(warmup + iterations):
+        started = time.perf_counter()
+        response = client.get(path)
+        response.get_data()  # الاستجابات المتدفقة (التصدير) تُقرأ كاملة
+        elapsed = (time.perf_counter() - started) * 1000
+        status = response.status_code
+
+        match = SERVER_TIMING_QUERIES.search(response.headers.get('Server-Timing', ''))
+        if i >= warmup:
+            timings.append(elapsed)
+            if match:
+                queries.append(int(match.group(1)))
+        response.close()
+
+    return {
+        'path': path,
+        'status': status,
+        'p50_ms': round(percentile(timings, 0.5), 2),
+        'p95_ms': round(percentile(timings, 0.95), 2),
+        'mean_ms': round(sum(timings) / len(timings), 2),
+        'queries': max(queries) if queries else None,
+    }
+
+
+def run(target, iterations, warmup, selected):
+    module_name, routes, route_parameters, counted_models = TARGETS[target]
+    m = importlib.import_module(module_name)
+    app = m.app
+
+    # عدد الاستعلامات يُسجل في النتائج، فلا حاجة لتحذيرات تجاوز الميزانية
+    app.config['QUERY_BUDGET'] = 0
+
+    with app.app_context():
+        user = m.User.query.filter_by(username=BENCH_USERNAME).first()
+        parameters = route_parameters(m)
+        if user is None or parameters is None:
+            data_script = 'bench_data_erp.py' if target == 'erp' else 'bench_data.py'
+            print(f"❌ لا توجد بيانات اختبار - شغل {data_script} أولاً")
+            return None
+        counts = table_counts(m, counted_models)
+        user_id = user.id
+        database = m.db.engine.dialect.name
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = user_id
+        session['_fresh'] = True
+
+    results = {}
+    for name, template in routes:
+        if selected and not any(part in name for part in selected):
+            continue
+        path = template.format(**parameters)
+        result = measure(client, path, iterations, warmup)
+        results[name] = result
+        marker = '✅' if result['status'] == 200 else '❌'
+        print(f"{marker} {name:<30} p50 {result['p50_ms']:>8.1f}ms  p95 {result['p95_ms']:>8.1f}ms  "
+              f"{result['queries'] if result['queries'] is not None else '-':>4} استعلام  [{result['status']}]")
+
+    return {
+        'app': target,
+        'commit': current_commit(),
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'database': database,
+        'iterations': iterations,
+        'rows': counts,
+        'routes': results,
+    }
+
+
+def compare(current, baseline, threshold):
+    """طباعة الفرق مع نتائج سابقة وإرجاع أسماء المسارات التي تراجعت"""
+    print(f"\n📊 مقارنة {current['commit']} مع {baseline['commit']}")
+    if baseline.get('rows') != current.get('rows'):
+        print("⚠️ حجم البيانات مختلف بين التشغيلين - المقارنة تقريبية")
+
+    regressions = []
+    for name, result in current['routes'].items():
+        old = baseline['routes'].get(name)
+        if not old:
+            continue
+        change = (result['p95_ms'] - old['p95_ms']) / old['p95_ms'] if old['p95_ms'] else 0
+        more_queries = (result['queries'] or 0) > (old['queries'] or 0)
+        regressed = change > threshold or more_queries
+        if regressed:
+            regressions.append(name)
+        print(f"{'❌' if regressed else '  '} {name:<30} p95 {old['p95_ms']:>8.1f} → {result['p95_ms']:>8.1f}ms "
+              f"({change:+.0%})  استعلامات {old['queries']} → {result['queries']}")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='قياس أداء المسارات الرئيسية')
+    parser.add_argument('--app', choices=sorted(TARGETS), default='advanced',
+                        help='التطبيق المقاس: advanced (vayon_advanced.py) أو erp (app.py المنشور)')
+    parser.add_argument('--iterations', type=int, default=20, help='عدد الطلبات المقاسة لكل مسار')
+    parser.add_argument('--warmup', type=int, default=3, help='طلبات إحماء لا تدخل في القياس')
+    parser.add_argument('--routes', nargs='*', help='قياس المسارات التي يحتوي اسمها على هذه الكلمات فقط')
+    parser.add_argument('--output', help=f'ملف النتائج (الافتراضي {RESULTS_FOLDER}/<commit>.json و <commit>-erp.json)')
+    parser.add_argument('--compare', help='ملف نتائج سابق للمقارنة')
+    parser.add_argument('--threshold', type=float, default=0.2, help='أقصى زيادة مسموحة في p95 (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    report = run(args.app, args.iterations, args.warmup, args.routes)
+    if report is None:
+        sys.exit(1)
+
+    suffix = '' if args.app == 'advanced' else f'-{args.app}'
+    output = args.output or os.path.join(RESULTS_FOLDER, f"{report['commit']}{suffix}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n💾 تم حفظ النتائج في {output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        # نتائج ما قبل --app كانت لـ vayon_advanced فقط
+        if baseline.get('app', 'advanced') != report['app']:
+            print(f"❌ النتائج السابقة لتطبيق آخر ({baseline.get('app', 'advanced')}) - لا يمكن المقارنة")
+            sys.exit(1)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"❌ تراجع الأداء في: {', '.join(regressions)}")
+            sys.exit(1)
+        print("✅ لا يوجد تراجع في الأداء")
@@ -0,0 +1,361 @@
+"""
+أدوات التخزين المؤقت (ذاكرة العملية + مخزن مشترك اختياري بين العمليات)
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, datetime
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import make_transient_to_detached, object_session
+
+
+class TTLCache:
+    """ذاكرة مؤقتة داخل العملية بمدة صلاحية لكل عنصر"""
+
+    def __init__(self, ttl, maxsize=10000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        with self._lock:
+            if len(self._data) >= self.maxsize and key not in self._data:
+                self._evict()
+            self._data[key] = (value, time.monotonic() + ttl)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def _evict(self):
+        # حذف العناصر المنتهية، وإن لم يكفِ فأقدم عنصر
+        now = time.monotonic()
+        for key in [k for k, (_, expires_at) in self._data.items() if expires_at < now]:
+            del self._data[key]
+        if len(self._data) >= self.maxsize:
+            del self._data[next(iter(self._data))]
+
+
+class VersionedCache:
+    """ذاكرة مؤقتة لكل مفتاح مع رقم إصدار
+
+    زيادة الإصدار (bump) تُبطل القيمة الحالية، وأي قيمة حُمّلت قبل الزيادة
+    وحُفظت بعدها تُحفظ تحت الإصدار القديم فلا تُقرأ أبداً.
+
+    مع المخزن المشترك (shared_path) تُحفظ أرقام الإصدارات فيه، فزيادة الإصدار
+    في أي عامل تُبطل القيم المخزنة في كل العمال.
+    """
+
+    # مدة حفظ الإصدار في المخزن المشترك (أطول بكثير من مدة أي قيمة)
+    SHARED_VERSION_TTL = 30 * 24 * 3600
+
+    def __init__(self, ttl, maxsize=10000, shared_path=None):
+        self.values = TTLCache(ttl, maxsize)
+        self.shared = SharedKVStore(shared_path) if shared_path else None
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def version(self, key):
+        if self.shared:
+            return self.shared.get(f'version:{key}') or 0
+        return self._versions.get(key, 0)
+
+    def get(self, key):
+        return self.values.get((key, self.version(key)))
+
+    def set(self, key, value, version):
+        self.values.set((key, version), value)
+
+    def bump(self, key):
+        if self.shared:
+            # الوقت بدلاً من عداد حتى لا تحتاج الزيادة قراءة ثم كتابة بين العمليات
+            self.shared.set(f'version:{key}', time.time_ns(), self.SHARED_VERSION_TTL)
+            return
+        with self._lock:
+            self._versions[key] = self.version(key) + 1
+
+    def install(self, session, model, key):
+        """زيادة الإصدار تلقائياً عند تعديل النموذج عبر الجلسة
+
+        key: دالة ترجع مفتاح الذاكرة من الصف المعدل. الزيادة تتم عند التنفيذ
+        وبعد الحفظ مرة أخرى، لأن طلباً آخر قد يقرأ الصف القديم بينهما ويحفظه
+        تحت الإصدار الجديد.
+        """
+        pending_key = f'versioned_cache_{id(self)}'
+
+        def on_change(mapper, connection, target):
+            self.bump(key(target))
+            object_session(target).info.setdefault(pending_key, set()).add(key(target))
+
+        def on_commit(sess):
+            for changed in sess.info.pop(pending_key, ()):
+                self.bump(changed)
+
+        def on_rollback(sess):
+            sess.info.pop(pending_key, None)
+
+        event.listen(model, 'after_insert', on_change)
+        event.listen(model, 'after_update', on_change)
+        event.listen(model, 'after_delete', on_change)
+        event.listen(session, 'after_commit', on_commit)
+        event.listen(session, 'after_rollback', on_rollback)
+
+
+class SharedKVStore:
+    """مخزن مفاتيح وقيم مشترك بين عمليات الخادم على نفس الجهاز (ملف SQLite)
+
+    بديل محلي لخادم مثل Redis: القيم نصوص JSON ولكل مفتاح مدة صلاحية.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS kv ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)'
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connect().execute(
+            'SELECT value FROM kv WHERE key = ? AND expires_at > ?', (key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value, ttl):
+        self._connect().execute(
+            'INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)',
+            (key, json.dumps(value), time.time() + ttl)
+        )
+
+    def delete(self, key):
+        self._connect().execute('DELETE FROM kv WHERE key = ?', (key,))
+
+    def purge_expired(self):
+        self._connect().execute('DELETE FROM kv WHERE expires_at <= ?', (time.time(),))
+
+
+class UserCache:
+    """تخزين بيانات المستخدمين المؤقت لـ user_loader
+
+    تُخزن قيم الأعمدة فقط (بدون كلمة المرور)، ويُعاد بناء كائن المستخدم
+    وربطه بالجلسة بدون استعلام. أي تعديل أو حذف لمستخدم عبر الجلسة يمسح
+    نسخته المخزنة فوراً وبعد الحفظ، وكذلك query.update() و query.delete()
+    على النموذج (تُقرأ معرفات الصفوف المطابقة أولاً). التعديل بـ SQL مباشر
+    (text أو جملة Core خارج الجلسة) لا يمسح الذاكرة ويظهر بعد انتهاء ttl.
+
+    ذاكرة العملية معطلة افتراضياً (local_ttl=0) لأن المسح يصل فقط للعملية
+    التي حفظت التعديل، فيبقى مستخدم معطل أو دور قديم في العمال الآخرين حتى
+    انتهاء المدة. التخزين يعمل عبر المخزن المشترك الذي يراه كل العمال على
+    نفس الجهاز، أو بتحديد local_ttl صراحة لخادم بعملية واحدة.
+    """
+
+    EXCLUDED_COLUMNS = ('password_hash',)
+
+    def __init__(self, model, ttl=300, shared_path=None, local_ttl=0):
+        self.model = model
+        self.ttl = ttl
+        self.shared = SharedKVStore(shared_path) if shared_path else None
+        self.local = TTLCache(local_ttl)
+        self.columns = [
+            column for column in model.__table__.columns
+            if column.key not in self.EXCLUDED_COLUMNS
+        ]
+
+    @classmethod
+    def from_env(cls, model, default_path=None):
+        """إعداد الذاكرة من متغيرات البيئة USER_CACHE_*
+
+        المخزن المشترك في USER_CACHE_PATH وإلا default_path (ملف في مجلد
+        instance للتطبيق). USER_CACHE_PATH= (فارغ) يعطله.
+        """
+        return cls(
+            model,
+            ttl=int(os.environ.get('USER_CACHE_TTL', 300)),
+            shared_path=os.environ.get('USER_CACHE_PATH', default_path) or None,
+            local_ttl=int(os.environ.get('USER_CACHE_LOCAL_TTL') or 0)
+        )
+
+    def _key(self, user_id):
+        return f'user:{user_id}'
+
+    def _snapshot(self, user):
+        data = {}
+        for column in self.columns:
+            value = getattr(user, column.key)
+            if isinstance(value, (datetime, date)):
+                value = value.isoformat()
+            data[column.key] = value
+        return data
+
+    def _restore(self, data):
+        values = dict(data)
+        for column in self.columns:
+            value = values.get(column.key)
+            if isinstance(value, str):
+                try:
+                    python_type = column.type.python_type
+                except NotImplementedError:
+                    python_type = None
+                if python_type is datetime:
+                    values[column.key] = datetime.fromisoformat(value)
+                elif python_type is date:
+                    values[column.key] = date.fromisoformat(value)
+        return values
+
+    def get(self, session, user_id):
+        """المستخدم من الذاكرة أو من قاعدة البيانات (مرة واحدة حتى انتهاء المدة)"""
+        key = self._key(user_id)
+        data = self.local.get(key)
+        if data is None and self.shared:
+            data = self.shared.get(key)
+            if data is not None:
+                self.local.set(key, data)
+
+        if data is None:
+            user = session.get(self.model, user_id)
+            if user is not None:
+                data = self._snapshot(user)
+                self.local.set(key, data)
+                if self.shared:
+                    self.shared.set(key, data, self.ttl)
+            return user
+
+        user = self.model(**self._restore(data))
+        make_transient_to_detached(user)
+        return session.merge(user, load=False)
+
+    def invalidate(self, user_id):
+        key = self._key(user_id)
+        self.local.delete(key)
+        if self.shared:
+            self.shared.delete(key)
+
+    def install(self, session):
+        """ربط المسح التلقائي بأحداث النموذج والجلسة"""
+        pending_key = f'user_cache_{id(self)}'
+
+        def on_change(mapper, connection, target):
+            self.invalidate(target.id)
+            object_session(target).info.setdefault(pending_key, set()).add(target.id)
+
+        def on_commit(sess):
+            # مسح ثانٍ بعد الحفظ لأن طلباً آخر قد يكون قرأ البيانات القديمة قبله
+            for user_id in sess.info.pop(pending_key, ()):
+                self.invalidate(user_id)
+
+        def on_rollback(sess):
+            sess.info.pop(pending_key, None)
+
+        def on_bulk_change(state):
+            # query.update() و query.delete() لا تمر بأحداث الصفوف
+            if not (state.is_update or state.is_delete):
+                return
+            if state.bind_mapper is None or state.bind_mapper.class_ is not self.model:
+                return
+            query = select(self.model.id)
+            if state.statement.whereclause is not None:
+                query = query.where(state.statement.whereclause)
+            ids = set(state.session.execute(query).scalars())
+            for user_id in ids:
+                self.invalidate(user_id)
+            state.session.info.setdefault(pending_key, set()).update(ids)
+
+        event.listen(self.model, 'after_update', on_change)
+        event.listen(self.model, 'after_delete', on_change)
+        event.listen(session, 'do_orm_execute', on_bulk_change)
+        event.listen(session, 'after_commit', on_commit)
+        event.listen(session, 'after_rollback', on_rollback)
+
+
+class LookupRegistry:
+    """فهرس صغير في ذاكرة العملية من قيمة عمود إلى معرف السجل
+
+    مناسب للجداول القليلة التي تُقرأ مع كل عملية (مثل الخزائن حسب النوع):
+    يُحمّل الجدول مرة واحدة، ويُعاد تحميله بعد حفظ أي تعديل على النموذج
+    عبر الجلسة، وبعد انتهاء ttl حتى تظهر تعديلات العمليات الأخرى.
+    """
+
+    def __init__(self, model, key_column, ttl=60, criteria=()):
+        self.model = model
+        self.key_column = key_column
+        self.ttl = ttl
+        self.criteria = criteria
+        self._ids = None
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+
+    def load(self, session):
+        rows = session.query(self.key_column, self.model.id).filter(
+            self.key_column.isnot(None), *self.criteria
+        ).order_by(self.model.created_at, self.model.id).all()
+
+        ids = {}
+        for key, row_id in rows:
+            ids.setdefault(key, row_id)
+        with self._lock:
+            self._ids = ids
+            self._loaded_at = time.monotonic()
+        return ids
+
+    def get(self, session, key):
+        """معرف أول سجل بالقيمة key أو None"""
+        ids = self._ids
+        if ids is None or time.monotonic() - self._loaded_at > self.ttl:
+            ids = self.load(session)
+        return ids.get(key)
+
+    def invalidate(self):
+        with self._lock:
+            self._ids = None
+
+    def install(self, session):
+        """إعادة التحميل بعد حفظ أي إضافة أو تعديل أو حذف في النموذج"""
+        pending_key = f'lookup_registry_{id(self)}'
+
+        def on_change(mapper, connection, target):
+            object_session(target).info[pending_key] = True
+
+        def on_commit(sess):
+            if sess.info.pop(pending_key, False):
+                self.invalidate()
+
+        def on_rollback(sess):
+            sess.info.pop(pending_key, None)
+
+        for name in ('after_insert', 'after_update', 'after_delete'):
+            event.listen(self.model, name, on_change)
+        event.listen(session, 'after_commit', on_commit)
+        event.listen(session, 'after_rollback', on_rollback)
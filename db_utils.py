@@ -0,0 +1,221 @@
+"""
+أدوات مساعدة مشتركة لقاعدة البيانات (PostgreSQL و SQLite)
+"""
+
+import hashlib
+import os
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from sqlalchemy import Column, Integer, String, UniqueConstraint, and_, case, cast, func, inspect, select, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import declared_attr
+from sqlalchemy.orm.util import identity_key
+
+
+def dialect_name(session):
+    """اسم نوع قاعدة البيانات المتصلة بالجلسة"""
+    return session.get_bind().dialect.name
+
+
+def dialect_insert(session, table):
+    """جملة INSERT تدعم ON CONFLICT حسب نوع قاعدة البيانات"""
+    name = dialect_name(session)
+    if name == 'postgresql':
+        return postgresql.insert(table)
+    if name == 'sqlite':
+        return sqlite.insert(table)
+    raise NotImplementedError(f'قاعدة البيانات {name} غير مدعومة')
+
+
+def whole_days_between(session, start, end):
+    """عدد الأيام الكاملة من start إلى end كتعبير SQL (مثل timedelta.days)
+
+    التقريب لأسفل كما في Python، فالتأخير نصف يوم قبل الموعد = -1.
+    """
+    name = dialect_name(session)
+    if name == 'postgresql':
+        return func.floor(func.extract('epoch', end - start) / 86400)
+    if name == 'sqlite':
+        # الفرق بالثواني كعدد صحيح ثم قسمة صحيحة مقربة لأسفل
+        seconds = cast(func.strftime('%s', end), Integer) - cast(func.strftime('%s', start), Integer)
+        return case((seconds >= 0, seconds // 86400), else_=-((-seconds + 86399) // 86400))
+    raise NotImplementedError(f'قاعدة البيانات {name} غير مدعومة')
+
+
+def upsert_increment(session, table, key_columns, rows, increment_columns):
+    """إضافة قيم إلى صفوف ملخص موجودة أو إنشاؤها في جملة واحدة
+
+    الصفوف ذات المفتاح المكرر تُجمع أولاً لأن ON CONFLICT لا يسمح
+    بتعديل نفس الصف مرتين في نفس الجملة.
+    """
+    merged = {}
+    for row in rows:
+        key = tuple(row[column] for column in key_columns)
+        if key in merged:
+            for column in increment_columns:
+                merged[key][column] += row[column]
+        else:
+            merged[key] = dict(row)
+
+    if not merged:
+        return
+
+    stmt = dialect_insert(session, table).values(list(merged.values()))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(key_columns),
+        set_={column: table.c[column] + stmt.excluded[column] for column in increment_columns}
+    )
+    session.execute(stmt)
+
+
+class DocumentSequenceMixin:
+    """أعمدة جدول عدادات المستندات document_sequences (يُستخدم مع db.Model في كل تطبيق)"""
+
+    __tablename__ = 'document_sequences'
+
+    @declared_attr.directive
+    def __table_args__(cls):
+        return (UniqueConstraint('prefix', 'period', name='uq_document_sequences_prefix_period'),)
+
+    id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    prefix = Column(String(20), nullable=False)  # نوع المستند: INV, PUR, MFG, SH
+    period = Column(String(20), nullable=False)  # الفترة: اليوم أو السنة أو السنة والشهر
+    last_value = Column(Integer, nullable=False, default=0)
+
+
+def next_sequence_value(session, table, prefix, period, count=1, seed=None):
+    """حجز الرقم التالي من عداد المستندات لبادئة وفترة محددة
+
+    الزيادة تتم بجملة UPDATE ذرية داخل معاملة المستند نفسه، فيُقفل صف
+    العداد حتى الحفظ ولا يحصل عاملان على نفس الرقم، ويعود العداد مع
+    التراجع عن المعاملة فلا تظهر فجوات في الترقيم.
+    seed: دالة ترجع آخر رقم مستخدم قبل إنشاء العداد (تُستدعى مرة واحدة لكل فترة).
+    count: عدد الأرقام المحجوزة، والقيمة المرجعة هي آخرها.
+    """
+    dialect = session.get_bind().dialect
+    key = and_(table.c.prefix == prefix, table.c.period == period)
+    current = select(table.c.last_value).where(key)
+
+    increment = update(table).where(key).values(last_value=table.c.last_value + count)
+    if dialect.update_returning:
+        value = session.execute(increment.returning(table.c.last_value)).scalar()
+    elif session.execute(increment).rowcount:
+        value = session.execute(current).scalar()
+    else:
+        value = None
+
+    if value is not None:
+        return value
+
+    # أول رقم في الفترة - إنشاء العداد (أو زيادته إذا سبقنا عامل آخر)
+    start = seed() if callable(seed) else (seed or 0)
+    stmt = dialect_insert(session, table).values(
+        id=str(uuid.uuid4()), prefix=prefix, period=period, last_value=start + count
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['prefix', 'period'],
+        set_={'last_value': table.c.last_value + count}
+    )
+    if dialect.insert_returning:
+        return session.execute(stmt.returning(table.c.last_value)).scalar()
+    session.execute(stmt)
+    return session.execute(current).scalar()
+
+
+def atomic_increment(session, model, row_id, column, delta, minimum=None):
+    """إضافة delta إلى عمود رصيد بجملة UPDATE واحدة وإرجاع القيمة الجديدة
+
+    الحساب يتم داخل قاعدة البيانات (column = column + delta) فلا تضيع
+    تحديثات الطلبات المتزامنة، والصف يبقى مقفلاً حتى نهاية المعاملة.
+    minimum: إذا حُدد لا يُنفذ التحديث إن كانت النتيجة أقل منه.
+    ترجع None إذا لم يوجد الصف أو لم يتحقق الشرط.
+    """
+    table = model.__table__
+    target = table.c[column]
+    stmt = update(table).where(table.c.id == row_id).values({column: target + delta})
+    if minimum is not None:
+        stmt = stmt.where(target + delta >= minimum)
+
+    if session.get_bind().dialect.update_returning:
+        value = session.execute(stmt.returning(target)).scalar()
+    elif session.execute(stmt).rowcount:
+        value = session.execute(select(target).where(table.c.id == row_id)).scalar()
+    else:
+        value = None
+
+    # النسخة المحملة في الجلسة (إن وجدت) أصبحت قديمة
+    instance = session.identity_map.get(identity_key(model, row_id))
+    if instance is not None:
+        session.expire(instance, [column])
+    return value
+
+
+def upgrade_table(engine, table):
+    """إضافة الأعمدة والفهارس الجديدة في النموذج إلى جدول موجود
+
+    create_all لا يعدل الجداول الموجودة، وهذه الدالة تكمل الفرق البسيط
+    (أعمدة تقبل NULL وفهارس) بدون أداة هجرة. ترجع أسماء الأعمدة المضافة.
+    """
+    inspector = inspect(engine)
+    if not inspector.has_table(table.name):
+        return []
+
+    existing = {column['name'] for column in inspector.get_columns(table.name)}
+    preparer = engine.dialect.identifier_preparer
+    added = []
+    with engine.begin() as conn:
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=engine.dialect)
+            conn.execute(text(
+                f'ALTER TABLE {preparer.format_table(table)} '
+                f'ADD COLUMN {preparer.format_column(column)} {column_type}'
+            ))
+            added.append(column.name)
+
+    for index in table.indexes:
+        index.create(engine, checkfirst=True)
+    return added
+
+
+# مفتاح pg_advisory_lock لترقية المخطط (مختلف عن مفتاح جدولة النسخ)
+SCHEMA_ADVISORY_LOCK_KEY = int.from_bytes(hashlib.sha256(b'vayon-schema-upgrade').digest()[:8], 'big', signed=True)
+
+
+@contextmanager
+def schema_upgrade_lock(engine, lock_path, advisory_key=SCHEMA_ADVISORY_LOCK_KEY):
+    """قفل حاجب حول ترقية المخطط عند بدء التشغيل
+
+    عمال gunicorn يحملون التطبيق في نفس الوقت، فينتظر كل عامل انتهاء
+    السابق بدلاً من تنفيذ ALTER TABLE و CREATE INDEX على نفس الجدول معاً.
+    PostgreSQL: pg_advisory_lock. غير ذلك: flock على ملف (نفس الجهاز).
+    """
+    if engine.dialect.name == 'postgresql':
+        with engine.connect() as conn:
+            conn.execute(text('SELECT pg_advisory_lock(:key)'), {'key': advisory_key})
+            conn.commit()
+            try:
+                yield
+            finally:
+                conn.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': advisory_key})
+                conn.commit()
+        return
+
+    if fcntl is None:
+        yield
+        return
+
+    os.makedirs(os.path.dirname(lock_path) or '.', exist_ok=True)
+    with open(lock_path, 'a+') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,273 @@
+"""
+توليد مستندات PDF (فواتير البيع والشراء وبوالص الشحن)
+
+المستند يُوصف بقاموس بسيط (عنوان، رقم، حقول، جدول أصناف، إجماليات)
+فيعمل نفس المحرك مع نماذج أي تطبيق. الخطوط تُسجل مرة واحدة للعملية،
+والملفات الناتجة تُحفظ على القرص بمفتاح (المعرف + وقت آخر تعديل) فلا
+يُعاد توليد مستند لم يتغير.
+
+تشكيل الحروف العربية واتجاه النص يتطلبان arabic_reshaper و python-bidi
+وخطاً يدعم العربية (fonts/Amiri-Regular.ttf أو PDF_FONT_PATH). بدون أي
+منها يُرفض توليد المستند بدلاً من طباعة حروف مقطعة أو مربعات فارغة.
+"""
+
+import glob
+import hashlib
+import io
+import os
+import tempfile
+import threading
+from datetime import date, datetime
+from decimal import Decimal
+
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+try:
+    import arabic_reshaper
+    from bidi.algorithm import get_display
+except ImportError:
+    arabic_reshaper = None
+    get_display = None
+
+# خطوط تدعم العربية يُبحث عنها إذا لم يُحدد PDF_FONT_PATH
+FONT_CANDIDATES = (
+    ('fonts/Amiri-Regular.ttf', 'fonts/Amiri-Bold.ttf'),
+    ('static/fonts/Amiri-Regular.ttf', 'static/fonts/Amiri-Bold.ttf'),
+    ('/usr/share/fonts/truetype/noto/NotoNaskhArabic-Regular.ttf',
+     '/usr/share/fonts/truetype/noto/NotoNaskhArabic-Bold.ttf'),
+    ('/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+     '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf'),
+)
+
+FONT_NAME = 'DocumentFont'
+FONT_BOLD_NAME = 'DocumentFont-Bold'
+
+PAGE_WIDTH, PAGE_HEIGHT = A4
+MARGIN = 15 * mm
+ROW_HEIGHT = 7 * mm
+
+_fonts = None
+_fonts_lock = threading.Lock()
+
+
+def register_fonts():
+    """تسجيل خطوط المستندات مرة واحدة وإرجاع (الخط العادي، الخط العريض)"""
+    global _fonts
+    if _fonts is not None:
+        return _fonts
+
+    with _fonts_lock:
+        if _fonts is not None:
+            return _fonts
+
+        candidates = list(FONT_CANDIDATES)
+        if os.environ.get('PDF_FONT_PATH'):
+            candidates.insert(0, (os.environ['PDF_FONT_PATH'],
+                                  os.environ.get('PDF_FONT_BOLD_PATH') or os.environ['PDF_FONT_PATH']))
+
+        fonts = ('Helvetica', 'Helvetica-Bold')
+        for regular, bold in candidates:
+            if not os.path.exists(regular):
+                continue
+            try:
+                pdfmetrics.registerFont(TTFont(FONT_NAME, regular))
+                pdfmetrics.registerFont(TTFont(FONT_BOLD_NAME, bold if os.path.exists(bold) else regular))
+                fonts = (FONT_NAME, FONT_BOLD_NAME)
+                break
+            except Exception as e:
+                print(f"تعذر تحميل الخط {regular}: {e}")
+
+        _fonts = fonts
+        problem = arabic_support_problem()
+        if problem:
+            print(f"⚠️ {problem} - لن تعمل مستندات PDF")
+        return _fonts
+
+
+def arabic_support_problem():
+    """وصف ما ينقص لكتابة العربية في المستندات، أو None إذا كان كل شيء متوفراً"""
+    missing = []
+    if arabic_reshaper is None:
+        missing.append('مكتبتا arabic-reshaper و python-bidi غير مثبتتين')
+    if _fonts is not None and _fonts[0] == 'Helvetica':
+        missing.append('لم يُعثر على خط يدعم العربية (ضع Amiri-Regular.ttf في fonts/ أو حدد PDF_FONT_PATH)')
+    return '، '.join(missing) or None
+
+
+def shape_text(value):
+    """تجهيز النص للرسم (تشكيل الحروف العربية وترتيبها من اليمين لليسار)"""
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        value = value.strftime('%Y-%m-%d %H:%M')
+    elif isinstance(value, date):
+        value = value.isoformat()
+    elif isinstance(value, Decimal):
+        value = f'{value:,.2f}'
+    return get_display(arabic_reshaper.reshape(str(value)))
+
+
+class _DocumentCanvas:
+    """رسم مستند أو أكثر على canvas واحد مع الانتقال لصفحة جديدة عند الحاجة"""
+
+    def __init__(self, output):
+        self.regular, self.bold = register_fonts()
+        problem = arabic_support_problem()
+        if problem:
+            raise RuntimeError(problem)
+        self.canvas = canvas.Canvas(output, pagesize=A4)
+        self.y = PAGE_HEIGHT - MARGIN
+
+    def text(self, value, x, size=10, bold=False, align='right'):
+        self.canvas.setFont(self.bold if bold else self.regular, size)
+        value = shape_text(value)
+        if align == 'right':
+            self.canvas.drawRightString(x, self.y, value)
+        elif align == 'center':
+            self.canvas.drawCentredString(x, self.y, value)
+        else:
+            self.canvas.drawString(x, self.y, value)
+
+    def new_page(self):
+        self.canvas.showPage()
+        self.y = PAGE_HEIGHT - MARGIN
+
+    def ensure_space(self, height, document=None):
+        if self.y - height < MARGIN:
+            self.new_page()
+            if document is not None:
+                self.table_header(document)
+
+    def line(self):
+        self.canvas.line(MARGIN, self.y, PAGE_WIDTH - MARGIN, self.y)
+
+    def column_edges(self, document):
+        # الأعمدة تبدأ من اليمين
+        width = PAGE_WIDTH - 2 * MARGIN
+        widths = document.get('widths') or [1 / len(document['columns'])] * len(document['columns'])
+        edges = []
+        right = PAGE_WIDTH - MARGIN
+        for fraction in widths:
+            edges.append(right)
+            right -= width * fraction
+        return edges
+
+    def table_header(self, document):
+        edges = self.column_edges(document)
+        for title, right in zip(document['columns'], edges):
+            self.text(title, right - 2 * mm, size=10, bold=True)
+        self.y -= 2 * mm
+        self.line()
+        self.y -= ROW_HEIGHT - 2 * mm
+
+    def draw(self, document):
+        top = PAGE_HEIGHT - MARGIN
+        if self.y < top:
+            self.new_page()
+
+        right = PAGE_WIDTH - MARGIN
+        if document.get('header'):
+            self.text(document['header'], right, size=16, bold=True)
+            self.y -= 8 * mm
+
+        self.text(document['title'], PAGE_WIDTH / 2, size=14, bold=True, align='center')
+        self.y -= 7 * mm
+        self.text(document['number'], PAGE_WIDTH / 2, size=11, align='center')
+        self.y -= 10 * mm
+
+        for label, value in document.get('fields', []):
+            self.ensure_space(ROW_HEIGHT)
+            self.text(label, right, size=10, bold=True)
+            self.text(value, right - 35 * mm, size=10)
+            self.y -= 6 * mm
+        self.y -= 4 * mm
+
+        if document.get('columns'):
+            self.ensure_space(2 * ROW_HEIGHT)
+            self.table_header(document)
+            edges = self.column_edges(document)
+            for row in document.get('rows', []):
+                self.ensure_space(ROW_HEIGHT, document)
+                for value, column_right in zip(row, edges):
+                    self.text(value, column_right - 2 * mm, size=9)
+                self.y -= ROW_HEIGHT
+            self.line()
+            self.y -= ROW_HEIGHT
+
+        for label, value in document.get('totals', []):
+            self.ensure_space(ROW_HEIGHT)
+            self.text(label, right, size=10, bold=True)
+            self.text(value, right - 45 * mm, size=10, bold=True)
+            self.y -= 6 * mm
+
+        if document.get('notes'):
+            self.y -= 4 * mm
+            self.ensure_space(ROW_HEIGHT)
+            self.text(document['notes'], right, size=9)
+            self.y -= 6 * mm
+
+    def save(self):
+        self.canvas.save()
+
+
+def document_fingerprint(document):
+    """بصمة قصيرة لمحتوى المستند تُستخدم كإصدار عند غياب updated_at"""
+    return hashlib.sha256(repr(document).encode('utf-8')).hexdigest()[:16]
+
+
+def render_pdf(documents):
+    """توليد ملف PDF واحد لمستند أو أكثر (كل مستند يبدأ في صفحة جديدة)"""
+    if isinstance(documents, dict):
+        documents = [documents]
+    output = io.BytesIO()
+    pdf = _DocumentCanvas(output)
+    for document in documents:
+        pdf.draw(document)
+    pdf.save()
+    return output.getvalue()
+
+
+class PDFCache:
+    """ملفات PDF المولدة على القرص بمفتاح (النوع، المعرف، الإصدار)
+
+    الإصدار هو وقت آخر تعديل (updated_at) أو بصمة نصية للمحتوى للنماذج
+    التي لا تحتوي على وقت تعديل. تغير الإصدار يعني مفتاحاً جديداً، فتُولد
+    نسخة جديدة وتُحذف القديمة.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, kind, document_id, version):
+        if isinstance(version, datetime):
+            stamp = version.strftime('%Y%m%d%H%M%S%f')
+        else:
+            stamp = str(version or '0')
+        return os.path.join(self.directory, f'{kind}_{document_id}_{stamp}.pdf')
+
+    def get_or_render(self, kind, document_id, version, build):
+        """مسار ملف المستند، يُولد فقط إذا لم يكن موجوداً. build ترجع قاموس المستند"""
+        path = self._path(kind, document_id, version)
+        if os.path.exists(path):
+            return path
+
+        os.makedirs(self.directory, exist_ok=True)
+        content = render_pdf(build())
+
+        # كتابة في ملف مؤقت ثم إعادة تسمية حتى لا يقرأ طلب آخر ملفاً ناقصاً
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.replace(temp_path, path)
+
+        for old_path in glob.glob(os.path.join(self.directory, f'{kind}_{document_id}_*.pdf')):
+            if old_path != path:
+                try:
+                    os.remove(old_path)
+                except OSError:
+                    pass
+        return path
@@ -0,0 +1,202 @@
+"""
+قياس عدد استعلامات SQL وزمنها لكل طلب
+
+يربط أحداث SQLAlchemy (before/after_cursor_execute) بالطلب الحالي، ويجمع
+لكل مسار مدرجات (histograms) لزمن الطلب وعدد الاستعلامات وزمن قاعدة
+البيانات تُعرض بصيغة Prometheus على /metrics. أي طلب يتجاوز ميزانية
+الاستعلامات يُسجل في السجل مع المسار والعدد، وهذا ما يكشف مشاكل N+1.
+
+المقاييس خاصة بكل عملية (كل عامل gunicorn له أرقامه).
+"""
+
+import logging
+import os
+import threading
+import time
+
+from flask import Response, abort, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# المسارات التي لا تُقاس
+EXCLUDED_ENDPOINTS = ('static', 'metrics')
+
+logger = logging.getLogger(__name__)
+
+_engine_hooks_installed = False
+_engine_hooks_lock = threading.Lock()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_start_time'].pop()
+    if not has_request_context():
+        return
+    g.query_count = g.get('query_count', 0) + 1
+    g.query_time = g.get('query_time', 0.0) + time.perf_counter() - started
+
+
+def install_engine_hooks():
+    """ربط أحداث المؤشر بكل محركات SQLAlchemy في العملية (مرة واحدة)"""
+    global _engine_hooks_installed
+    with _engine_hooks_lock:
+        if _engine_hooks_installed:
+            return
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        _engine_hooks_installed = True
+
+
+class Histogram:
+    """مدرج تراكمي بنفس شكل Prometheus لكل مجموعة تسميات"""
+
+    def __init__(self, name, description, buckets):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self._series = {}
+
+    def observe(self, labels, value):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][i] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        for labels, (counts, total, count) in sorted(self._series.items()):
+            label_text = _labels(labels)
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {bucket_count}')
+            lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {count}')
+            lines.append(f'{self.name}_sum{{{label_text}}} {total}')
+            lines.append(f'{self.name}_count{{{label_text}}} {count}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self._values = {}
+
+    def inc(self, labels):
+        self._values[labels] = self._values.get(labels, 0) + 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+        for labels, value in sorted(self._values.items()):
+            lines.append(f'{self.name}{{{_labels(labels)}}} {value}')
+        return lines
+
+
+def _labels(labels):
+    return ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in labels
+    )
+
+
+def query_budget(limit):
+    """ميزانية استعلامات خاصة بمسار (بدلاً من QUERY_BUDGET العامة)"""
+    def decorator(view):
+        view.query_budget = limit
+        return view
+    return decorator
+
+
+class QueryMetrics:
+    """تسجيل مقاييس الطلبات والاستعلامات لتطبيق Flask وعرضها على /metrics
+
+    QUERY_BUDGET: أقصى عدد استعلامات للطلب قبل تسجيل تحذير (0 لتعطيله).
+    METRICS_TOKEN: إذا حُدد يُطلب في ترويسة Authorization، وإلا تُتاح
+    /metrics للطلبات المحلية فقط.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self.request_duration = Histogram(
+            'http_request_duration_seconds', 'Request latency in seconds', DURATION_BUCKETS)
+        self.db_queries = Histogram(
+            'db_queries_per_request', 'SQL statements executed per request', QUERY_COUNT_BUCKETS)
+        self.db_duration = Histogram(
+            'db_query_duration_seconds_per_request', 'Time spent in SQL per request', DURATION_BUCKETS)
+        self.requests = Counter('http_requests_total', 'Requests by route and status')
+        self.budget_exceeded = Counter(
+            'db_query_budget_exceeded_total', 'Requests that exceeded their query budget')
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('QUERY_BUDGET', int(os.environ.get('QUERY_BUDGET', 50)))
+        app.config.setdefault('METRICS_TOKEN', os.environ.get('METRICS_TOKEN'))
+        install_engine_hooks()
+
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        app.add_url_rule('/metrics', 'metrics', self._metrics_view)
+        self.app = app
+
+    def _start_request(self):
+        g.query_count = 0
+        g.query_time = 0.0
+        g.request_started = time.perf_counter()
+
+    def _finish_request(self, response):
+        if request.endpoint in EXCLUDED_ENDPOINTS or 'request_started' not in g:
+            return response
+
+        duration = time.perf_counter() - g.request_started
+        query_count = g.get('query_count', 0)
+        query_time = g.get('query_time', 0.0)
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        labels = (('method', request.method), ('route', route))
+
+        with self._lock:
+            self.request_duration.observe(labels, duration)
+            self.db_queries.observe(labels, query_count)
+            self.db_duration.observe(labels, query_time)
+            self.requests.inc(labels + (('status', response.status_code),))
+
+        budget = self._budget()
+        if budget and query_count > budget:
+            with self._lock:
+                self.budget_exceeded.inc(labels)
+            logger.warning(
+                'تجاوز ميزانية الاستعلامات: %s %s %d استعلام (الميزانية %d)، %.1fms في قاعدة البيانات',
+                request.method, route, query_count, budget, query_time * 1000
+            )
+
+        response.headers['Server-Timing'] = (
+            f'db;dur={query_time * 1000:.1f};desc="{query_count} queries", app;dur={duration * 1000:.1f}'
+        )
+        return response
+
+    def _budget(self):
+        view = self.app.view_functions.get(request.endpoint)
+        return getattr(view, 'query_budget', self.app.config['QUERY_BUDGET'])
+
+    def _metrics_view(self):
+        token = self.app.config.get('METRICS_TOKEN')
+        if token:
+            if request.headers.get('Authorization') != f'Bearer {token}':
+                abort(403)
+        elif request.remote_addr not in ('127.0.0.1', '::1'):
+            abort(403)
+
+        with self._lock:
+            lines = []
+            for metric in (self.request_duration, self.db_queries, self.db_duration,
+                           self.requests, self.budget_exceeded):
+                lines += metric.render()
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
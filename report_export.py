@@ -0,0 +1,201 @@
+"""
+تصدير التقارير إلى CSV و XLSX بالتدفق (ذاكرة ثابتة مهما كان عدد الصفوف)
+
+الصفوف تُقرأ من قاعدة البيانات على دفعات (yield_per) وتُكتب مباشرة في
+الاستجابة، فلا تُحمّل السنة كاملة في الذاكرة لا كصفوف ولا كملف.
+"""
+
+import csv
+import re
+import zipfile
+from datetime import date, datetime
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from flask import Response, stream_with_context
+
+# عدد الصفوف المقروءة من المؤشر في كل دفعة
+EXPORT_BATCH_SIZE = 1000
+
+# حجم الجزء المرسل للعميل
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+# أحرف التحكم غير المسموحة في XML
+INVALID_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def _cell_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, bool):
+        return 'نعم' if value else 'لا'
+    return value
+
+
+class _ChunkBuffer:
+    """ملف وهمي يجمع ما يُكتب فيه ليُرسل على أجزاء
+
+    لا يدعم seek، فيكتب zipfile الملف المضغوط بالتدفق (data descriptors).
+    """
+
+    def __init__(self):
+        self._parts = []
+        self._size = 0
+        self._position = 0
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self._parts.append(bytes(data))
+        self._size += len(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def ready(self):
+        return self._size >= EXPORT_CHUNK_SIZE
+
+    def drain(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        self._size = 0
+        return data
+
+
+def stream_rows(session, statement, batch_size=EXPORT_BATCH_SIZE):
+    """صفوف الاستعلام من مؤشر على الخادم على دفعات"""
+    result = session.execute(statement.execution_options(yield_per=batch_size))
+    for row in result:
+        yield tuple(row)
+
+
+class _TextAdapter:
+    """csv.writer يكتب نصوصاً، والمخزن يحولها إلى UTF-8"""
+
+    def __init__(self, buffer):
+        self.write = buffer.write
+
+
+def iter_csv(headers, rows):
+    # BOM حتى يفتح Excel الملف بترميز UTF-8 ويعرض العربية بشكل صحيح
+    buffer = _ChunkBuffer()
+    buffer.write('\ufeff')
+    writer = csv.writer(_TextAdapter(buffer))
+    writer.writerow(headers)
+    for row in rows:
+        writer.writerow([_cell_value(value) for value in row])
+        if buffer.ready():
+            yield buffer.drain()
+    yield buffer.drain()
+
+
+def _xlsx_cell(value):
+    value = _cell_value(value)
+    if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+        return f'<c t="n"><v>{value}</v></c>'
+    text = INVALID_XML_CHARS.sub('', str(value))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{escape(text)}</t></is></c>'
+
+
+def _xlsx_row(values):
+    return '<row>' + ''.join(_xlsx_cell(value) for value in values) + '</row>'
+
+
+XLSX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'
+)
+
+XLSX_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+
+XLSX_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{name}" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+
+XLSX_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '</Relationships>'
+)
+
+XLSX_SHEET_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<sheetViews><sheetView workbookViewId="0" rightToLeft="1"/></sheetViews>'
+    '<sheetData>'
+)
+
+XLSX_SHEET_END = '</sheetData></worksheet>'
+
+
+def iter_xlsx(headers, rows, sheet_name='Report'):
+    """ملف XLSX بأقل محتوى ممكن (نصوص inlineStr بدون جدول نصوص مشترك)"""
+    buffer = _ChunkBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', XLSX_CONTENT_TYPES)
+        archive.writestr('_rels/.rels', XLSX_ROOT_RELS)
+        archive.writestr('xl/workbook.xml', XLSX_WORKBOOK.format(name=escape(sheet_name[:31])))
+        archive.writestr('xl/_rels/workbook.xml.rels', XLSX_WORKBOOK_RELS)
+
+        with archive.open('xl/worksheets/sheet1.xml', 'w') as sheet:
+            sheet.write(XLSX_SHEET_START.encode('utf-8'))
+            sheet.write(_xlsx_row(headers).encode('utf-8'))
+            for row in rows:
+                sheet.write(_xlsx_row(row).encode('utf-8'))
+                if buffer.ready():
+                    yield buffer.drain()
+            sheet.write(XLSX_SHEET_END.encode('utf-8'))
+
+    yield buffer.drain()
+
+
+def export_response(headers, rows, filename, export_format='csv', sheet_name='Report'):
+    """استجابة تنزيل بالتدفق للصفوف بصيغة csv أو xlsx"""
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f'صيغة التصدير غير مدعومة: {export_format}')
+
+    if export_format == 'xlsx':
+        chunks = iter_xlsx(headers, rows, sheet_name)
+    else:
+        chunks = iter_csv(headers, rows)
+
+    return Response(
+        stream_with_context(chunks),
+        mimetype=EXPORT_FORMATS[export_format],
+        headers={'Content-Disposition': f'attachment; filename="{filename}.{export_format}"'}
+    )
@@ -0,0 +1,181 @@
+"""
+ملخص المبيعات اليومي المشترك بين التطبيقات (app.py و vayon_advanced.py)
+
+جدول daily_sales_rollup يحمل لكل يوم إجماليات كل المبيعات (dimension='all')
+ولكل عميل ولكل منتج. يُحدّث داخل معاملة الفاتورة بإضافة الفرق (upsert)،
+ويُعاد بناؤه بالكامل من الفواتير عند الحاجة. الدوال تأخذ الجلسة والنماذج
+كمعاملات لأن لكل تطبيق نماذجه.
+"""
+
+import uuid
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy import Column, Date, Integer, Numeric, String, UniqueConstraint, func
+from sqlalchemy.orm import declared_attr
+
+from db_utils import upsert_increment
+
+ROLLUP_MEASURES = ('sales_count', 'quantity', 'total_amount', 'cost_amount', 'paid_amount')
+ROLLUP_KEY = ('rollup_date', 'dimension', 'dimension_id')
+
+
+class DailySalesRollupMixin:
+    """أعمدة جدول daily_sales_rollup (يُستخدم مع db.Model في كل تطبيق)"""
+
+    __tablename__ = 'daily_sales_rollup'
+
+    @declared_attr.directive
+    def __table_args__(cls):
+        return (UniqueConstraint(*ROLLUP_KEY, name='uq_daily_sales_rollup_key'),)
+
+    id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    rollup_date = Column(Date, nullable=False)
+    dimension = Column(String(20), nullable=False, default='all')  # all, customer, product
+    dimension_id = Column(String(36), nullable=False, default='')  # معرف العميل أو المنتج
+
+    # الإجماليات
+    sales_count = Column(Integer, default=0)
+    quantity = Column(Numeric(15, 3), default=0)
+    total_amount = Column(Numeric(15, 2), default=0)
+    cost_amount = Column(Numeric(15, 2), default=0)
+    paid_amount = Column(Numeric(15, 2), default=0)
+
+
+def _decimal(value):
+    return value if isinstance(value, Decimal) else Decimal(str(value or 0))
+
+
+def rollup_row(rollup_date, dimension, dimension_id, **measures):
+    row = {
+        'id': str(uuid.uuid4()),
+        'rollup_date': rollup_date,
+        'dimension': dimension,
+        'dimension_id': dimension_id or '',
+    }
+    for measure in ROLLUP_MEASURES:
+        row[measure] = measures.get(measure, 0)
+    return row
+
+
+def as_date(value):
+    """اليوم من ناتج func.date (نص في SQLite و date في PostgreSQL)"""
+    if isinstance(value, str):
+        return datetime.strptime(value[:10], '%Y-%m-%d').date()
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+def upsert_rollup(session, rollup_model, rows):
+    upsert_increment(session, rollup_model.__table__, ROLLUP_KEY, rows, ROLLUP_MEASURES)
+
+
+def record_sale_rollup(session, rollup_model, sale, lines, sign=1):
+    """إضافة فاتورة إلى الملخص داخل معاملتها
+
+    lines: قائمة من (product_id, quantity, total_price, cost_price).
+    sign=-1 يعكس أثر الفاتورة عند المرتجع أو الإلغاء.
+    """
+    rollup_date = (sale.sale_date or datetime.utcnow()).date()
+    lines = [(product_id, _decimal(quantity), _decimal(total_price), _decimal(cost_price))
+             for product_id, quantity, total_price, cost_price in lines]
+    totals = {
+        'sales_count': sign,
+        'quantity': sign * sum([line[1] for line in lines], Decimal('0')),
+        'total_amount': sign * _decimal(sale.total_amount),
+        'cost_amount': sign * sum([line[1] * line[3] for line in lines], Decimal('0')),
+        'paid_amount': sign * _decimal(sale.paid_amount),
+    }
+
+    rows = [rollup_row(rollup_date, 'all', '', **totals)]
+    if sale.customer_id:
+        rows.append(rollup_row(rollup_date, 'customer', sale.customer_id, **totals))
+
+    counted_products = set()
+    for product_id, quantity, total_price, cost_price in lines:
+        rows.append(rollup_row(
+            rollup_date, 'product', product_id,
+            sales_count=0 if product_id in counted_products else sign,
+            quantity=sign * quantity,
+            total_amount=sign * total_price,
+            cost_amount=sign * quantity * cost_price
+        ))
+        counted_products.add(product_id)
+
+    upsert_rollup(session, rollup_model, rows)
+
+
+def record_payment_rollup(session, rollup_model, sale, amount):
+    """إضافة دفعة لاحقة على فاتورة إلى مدفوعات يوم الفاتورة"""
+    rollup_date = (sale.sale_date or datetime.utcnow()).date()
+    rows = [rollup_row(rollup_date, 'all', '', paid_amount=amount)]
+    if sale.customer_id:
+        rows.append(rollup_row(rollup_date, 'customer', sale.customer_id, paid_amount=amount))
+    upsert_rollup(session, rollup_model, rows)
+
+
+def rebuild_sales_rollup(session, rollup_model, sale_model, item_model, counted):
+    """إعادة بناء الملخص من سجل الفواتير بالكامل وإرجاع عدد الصفوف
+
+    counted: شرط الفواتير التي تدخل في الملخص (مثل استبعاد المرتجعة).
+    التكلفة من cost_price المحفوظ على البند وقت البيع، فلا يتغير ربح الأيام
+    السابقة بتعديل سعر المنتج.
+    """
+    Sale, SaleItem = sale_model, item_model
+    sale_day = func.date(Sale.sale_date)
+    item_cost = SaleItem.quantity * func.coalesce(SaleItem.cost_price, 0)
+
+    # الكميات والتكلفة لكل فاتورة محسوبة مرة واحدة
+    items_per_sale = session.query(
+        SaleItem.sale_id.label('sale_id'),
+        func.sum(SaleItem.quantity).label('quantity'),
+        func.sum(item_cost).label('cost_amount')
+    ).group_by(SaleItem.sale_id).subquery()
+
+    def sales_totals(*group_columns):
+        return session.query(
+            sale_day, *group_columns,
+            func.count(Sale.id),
+            func.coalesce(func.sum(items_per_sale.c.quantity), 0),
+            func.coalesce(func.sum(Sale.total_amount), 0),
+            func.coalesce(func.sum(items_per_sale.c.cost_amount), 0),
+            func.coalesce(func.sum(Sale.paid_amount), 0)
+        ).outerjoin(items_per_sale, items_per_sale.c.sale_id == Sale.id).filter(counted).group_by(sale_day, *group_columns)
+
+    rows = []
+    for day, *measures in sales_totals():
+        rows.append(rollup_row(as_date(day), 'all', '', **dict(zip(ROLLUP_MEASURES, measures))))
+
+    for day, customer_id, *measures in sales_totals(Sale.customer_id).filter(Sale.customer_id.isnot(None)):
+        rows.append(rollup_row(as_date(day), 'customer', customer_id, **dict(zip(ROLLUP_MEASURES, measures))))
+
+    product_query = session.query(
+        sale_day, SaleItem.product_id,
+        func.count(func.distinct(SaleItem.sale_id)),
+        func.sum(SaleItem.quantity),
+        func.sum(SaleItem.total_price),
+        func.sum(item_cost)
+    ).join(Sale, SaleItem.sale_id == Sale.id).filter(counted).group_by(sale_day, SaleItem.product_id)
+
+    for day, product_id, count, quantity, total, cost in product_query:
+        rows.append(rollup_row(as_date(day), 'product', product_id, sales_count=count,
+                               quantity=quantity, total_amount=total, cost_amount=cost))
+
+    session.query(rollup_model).delete()
+    if rows:
+        session.execute(rollup_model.__table__.insert(), rows)
+    session.commit()
+    return len(rows)
+
+
+def register_rollup_command(app, rebuild):
+    """أمر flask rebuild-sales-rollup للتطبيق (rebuild بدون معاملات)"""
+
+    @app.cli.command('rebuild-sales-rollup')
+    def rebuild_sales_rollup_command():
+        """إعادة بناء جدول daily_sales_rollup من سجل المبيعات"""
+        count = rebuild()
+        print(f"✅ تم إعادة بناء ملخص المبيعات اليومي ({count} صف)")
+
+    return rebuild_sales_rollup_command
@@ -0,0 +1,125 @@
+"""
+فهرس البحث السريع (pg_trgm في PostgreSQL و FTS5 في SQLite)
+
+كل جدول قابل للبحث يحتوي على عمود search_text يحمل النص بعد توحيد
+الحروف العربية، والفهرس يُبنى على هذا العمود حسب نوع قاعدة البيانات.
+"""
+
+import re
+
+from sqlalchemy import and_, func, text
+
+# التشكيل والتطويل
+ARABIC_DIACRITICS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')
+
+# توحيد أشكال الألف والياء والتاء المربوطة والأرقام الهندية
+ARABIC_FOLDING = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ى': 'ي', 'ئ': 'ي',
+    'ؤ': 'و',
+    'ة': 'ه',
+    '٠': '0', '١': '1', '٢': '2', '٣': '3', '٤': '4',
+    '٥': '5', '٦': '6', '٧': '7', '٨': '8', '٩': '9',
+})
+
+# أقل طول لكلمة يستطيع فهرس الثلاثيات البحث عنها
+TRIGRAM_MIN_LENGTH = 3
+
+# نوع الفهرس المتاح لكل جدول بعد التهيئة: trigram أو fts5 أو like
+_backends = {}
+
+
+def normalize_arabic(*values):
+    """توحيد النص العربي للبحث (بدون تشكيل، حروف موحدة، أحرف صغيرة)"""
+    value = ' '.join(str(v) for v in values if v)
+    value = ARABIC_DIACRITICS.sub('', value).translate(ARABIC_FOLDING).lower()
+    return ' '.join(value.split())
+
+
+def _fts_table(table):
+    return f'{table.name}_search'
+
+
+def ensure_search_index(engine, table):
+    """إنشاء فهرس البحث للجدول إذا لم يكن موجوداً وإرجاع نوعه"""
+    name = table.name
+    backend = 'like'
+
+    try:
+        with engine.begin() as conn:
+            if engine.dialect.name == 'postgresql':
+                conn.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+                conn.execute(text(
+                    f'CREATE INDEX IF NOT EXISTS ix_{name}_search_trgm '
+                    f'ON {name} USING gin (search_text gin_trgm_ops)'
+                ))
+                backend = 'trigram'
+
+            elif engine.dialect.name == 'sqlite':
+                fts = _fts_table(table)
+                exists = conn.execute(
+                    text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                    {'name': fts}
+                ).first()
+
+                # جدول FTS5 يقرأ محتواه من الجدول الأصلي ويُحدَّث بالـ triggers
+                conn.execute(text(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+                    f"search_text, content='{name}', content_rowid='rowid', tokenize='trigram')"
+                ))
+                conn.execute(text(
+                    f'CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {name} BEGIN '
+                    f'INSERT INTO {fts}(rowid, search_text) VALUES (new.rowid, new.search_text); END'
+                ))
+                conn.execute(text(
+                    f'CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {name} BEGIN '
+                    f"INSERT INTO {fts}({fts}, rowid, search_text) VALUES ('delete', old.rowid, old.search_text); END"
+                ))
+                conn.execute(text(
+                    f'CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF search_text ON {name} BEGIN '
+                    f"INSERT INTO {fts}({fts}, rowid, search_text) VALUES ('delete', old.rowid, old.search_text); "
+                    f'INSERT INTO {fts}(rowid, search_text) VALUES (new.rowid, new.search_text); END'
+                ))
+                if not exists:
+                    conn.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+                backend = 'fts5'
+
+    except Exception as e:
+        # قاعدة بيانات بدون pg_trgm أو FTS5 - البحث يعمل بدون فهرس
+        print(f"تعذر إنشاء فهرس البحث للجدول {name}: {e}")
+
+    _backends[name] = backend
+    return backend
+
+
+def rebuild_search_index(engine, table):
+    """إعادة مزامنة فهرس FTS5 مع الجدول (بعد VACUUM أو تعديل مباشر في قاعدة البيانات)"""
+    if _backends.get(table.name) != 'fts5':
+        return
+    fts = _fts_table(table)
+    with engine.begin() as conn:
+        conn.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+
+
+def search_condition(table, query):
+    """شرط البحث في عمود search_text باستخدام الفهرس المتاح"""
+    terms = normalize_arabic(query).split()
+    column = table.c.search_text
+    backend = _backends.get(table.name, 'like')
+
+    if backend == 'fts5' and all(len(term) >= TRIGRAM_MIN_LENGTH for term in terms):
+        fts = _fts_table(table)
+        match = ' '.join('"{}"'.format(term.replace('"', '""')) for term in terms)
+        return text(
+            f'{table.name}.rowid IN (SELECT rowid FROM {fts} WHERE {fts} MATCH :search_match)'
+        ).bindparams(search_match=match)
+
+    # pg_trgm يستخدم فهرس GIN مع LIKE مباشرة
+    return and_(*[column.contains(term, autoescape=True) for term in terms])
+
+
+def search_rank(table, query):
+    """ترتيب النتائج حسب التشابه (PostgreSQL فقط)"""
+    if _backends.get(table.name) == 'trigram':
+        return func.similarity(table.c.search_text, normalize_arabic(query)).desc()
+    return None
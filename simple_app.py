@@ -3,7 +3,9 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
+import os
 import uuid
+from cache_utils import UserCache
 
 # إنشاء التطبيق
 app = Flask(__name__)
@@ -21,7 +23,7 @@ login_manager.login_view = 'login'
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(user_id)
+    return user_cache.get(db.session, user_id)
 
 # نموذج المستخدم المبسط
 class User(UserMixin, db.Model):
@@ -40,6 +42,10 @@ class User(UserMixin, db.Model):
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
 
+# ذاكرة مؤقتة للمستخدمين حتى لا يستعلم كل طلب عن المستخدم الحالي
+user_cache = UserCache.from_env(User, os.path.join(app.instance_path, 'simple_app_user_cache.db'))
+user_cache.install(db.session)
+
 # الصفحة الرئيسية
 @app.route('/')
 def index():
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+اختبارات النسخ الاحتياطي: stream_dump بأمر نسخ وهمي (python -c يكتب
+على stdout بدلاً من pg_dump)، و create_backup على قاعدة SQLite مؤقتة.
+"""
+
+import gzip
+import hashlib
+import importlib
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backup_engine import stream_dump
+
+
+def fake_dump(code):
+    return [sys.executable, '-c', code]
+
+
+def test_stream_dump_writes_gzip(tmp_path):
+    payload = b'-- dump\n' + b'INSERT INTO t VALUES (1);\n' * 100_000
+    source = tmp_path / 'payload.sql'
+    source.write_bytes(payload)
+    output = tmp_path / 'backup.sql.gz'
+
+    result = stream_dump(
+        fake_dump(f'import sys; sys.stdout.buffer.write(open({str(source)!r}, "rb").read())'),
+        str(output)
+    )
+
+    with gzip.open(output, 'rb') as f:
+        assert f.read() == payload
+    assert result['raw_size'] == len(payload)
+    assert result['file_size'] == os.path.getsize(output) < len(payload)
+    assert result['content_hash'] == hashlib.sha256(payload).hexdigest()
+    assert result['bytes_per_second'] > 0
+    assert not os.path.exists(f'{output}.part')
+
+
+def test_stream_dump_kills_on_timeout(tmp_path):
+    output = tmp_path / 'backup.sql.gz'
+
+    with pytest.raises(TimeoutError):
+        stream_dump(
+            fake_dump('import sys, time; sys.stdout.write("partial"); sys.stdout.flush(); time.sleep(60)'),
+            str(output),
+            timeout=0.5
+        )
+
+    assert not output.exists()
+    assert not os.path.exists(f'{output}.part')
+
+
+def test_stream_dump_raises_on_failed_command(tmp_path):
+    output = tmp_path / 'backup.sql.gz'
+
+    with pytest.raises(RuntimeError, match='connection refused'):
+        stream_dump(
+            fake_dump('import sys; sys.stdout.write("x"); sys.stderr.write("connection refused"); sys.exit(2)'),
+            str(output)
+        )
+
+    assert not output.exists()
+    assert not os.path.exists(f'{output}.part')
+
+
+@pytest.fixture(scope='module')
+def erp(tmp_path_factory):
+    """app.py على ملف SQLite مؤقت (التطبيق يُنشئ جداوله عند الاستيراد)"""
+    folder = tmp_path_factory.mktemp('erp')
+    previous = os.getcwd()
+    os.chdir(folder)
+    os.environ['DATABASE_URL'] = f'sqlite:///{folder / "erp.db"}'
+    os.environ['USER_CACHE_PATH'] = ''
+    try:
+        module = importlib.import_module('app')
+    finally:
+        os.chdir(previous)
+    module.app.config['BACKUP_FOLDER'] = str(folder / 'backups')
+    module._sqlite_backup_engine = None
+    return module
+
+
+def test_create_backup_records_throughput_and_row_counts(erp):
+    with erp.app.app_context():
+        erp.db.session.add_all([erp.Customer(name=f'عميل {i}') for i in range(3)])
+        erp.db.session.commit()
+
+    assert erp.create_backup() is True
+
+    with erp.app.app_context():
+        backup = erp.Backup.query.one()
+        assert os.path.exists(backup.file_path)
+        assert backup.bytes_per_second > 0
+        assert backup.duration_seconds > 0
+        counts = json.loads(backup.table_counts)
+        assert counts['customers'] == 3
+        assert erp.Backup.__tablename__ not in counts
@@ -1,9 +1,23 @@
+import codecs
+import csv
+import io
 import os
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+import tempfile
+import click
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from advanced_database import *
+from db_utils import upsert_increment, next_sequence_value, upgrade_table, atomic_increment, schema_upgrade_lock
+import sales_rollup
+from sales_rollup import register_rollup_command
+from cache_utils import LookupRegistry, UserCache
+from query_metrics import QueryMetrics
+from search_index import ensure_search_index, rebuild_search_index, search_condition, search_rank
+from report_export import EXPORT_FORMATS, export_response, stream_rows
+from pdf_documents import PDFCache, document_fingerprint, register_fonts, render_pdf
 from datetime import datetime, timedelta
 import json
+import uuid
 from decimal import Decimal
 
 # إنشاء التطبيق
@@ -22,6 +36,7 @@ else:
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///vayon_advanced.db'
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['PDF_CACHE_FOLDER'] = os.environ.get('PDF_CACHE_FOLDER', 'pdf_cache')
 
 # تهيئة قاعدة البيانات
 db.init_app(app)
@@ -33,9 +48,26 @@ login_manager.login_view = 'login'
 login_manager.login_message = 'يرجى تسجيل الدخول للوصول لهذه الصفحة'
 login_manager.login_message_category = 'info'
 
+# ذاكرة مؤقتة للمستخدمين حتى لا يستعلم كل طلب عن المستخدم الحالي
+user_cache = UserCache.from_env(User, os.path.join(app.instance_path, 'vayon_advanced_user_cache.db'))
+user_cache.install(db.session)
+
+# عدد الاستعلامات وزمنها لكل طلب (/metrics)
+query_metrics = QueryMetrics(app)
+
+# أنواع الخزائن التي تُرحل عليها العمليات تلقائياً
+TREASURY_TYPES = ('main', 'shipping', 'bank')
+
+# معرف الخزينة لكل نوع في ذاكرة العملية (يُحدّث بعد أي تعديل على الخزائن)
+treasury_registry = LookupRegistry(Treasury, Treasury.treasury_type, criteria=(Treasury.is_active == True,))
+treasury_registry.install(db.session)
+
+def treasury_id_for(treasury_type):
+    return treasury_registry.get(db.session, treasury_type)
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(user_id)
+    return user_cache.get(db.session, user_id)
 
 # Route للتحقق من صحة التطبيق
 @app.route('/health')
@@ -65,31 +97,31 @@ def internal_error(error):
     db.session.rollback()
     return render_template('setup_first_admin.html'), 500
 
+# دالة مساعدة لقراءة آخر رقم تسلسلي مستخدم (عند إنشاء عداد جديد فقط)
+def _last_document_number(column, number_prefix):
+    last_number = db.session.query(column).filter(
+        column.like(f'{number_prefix}%')
+    ).order_by(column.desc()).limit(1).scalar()
+
+    if not last_number:
+        return 0
+    parts = last_number.split('-')
+    if len(parts) != 3:
+        return 0
+    try:
+        return int(parts[2])
+    except ValueError:
+        return 0
+
 # دالة مساعدة لتوليد رقم فاتورة
 def generate_invoice_number(prefix='INV'):
-    from datetime import datetime
-    now = datetime.now()
     # تنسيق: INV-2024-001
-    year = now.year
-    # البحث عن آخر فاتورة في السنة الحالية
-    last_invoice = Sale.query.filter(
-        Sale.invoice_number.like(f'{prefix}-{year}-%')
-    ).order_by(Sale.invoice_number.desc()).first()
-    
-    if last_invoice:
-        # استخراج الرقم التسلسلي
-        parts = last_invoice.invoice_number.split('-')
-        if len(parts) == 3:
-            try:
-                last_number = int(parts[2])
-                new_number = last_number + 1
-            except:
-                new_number = 1
-        else:
-            new_number = 1
-    else:
-        new_number = 1
-    
+    year = datetime.now().year
+    new_number = next_sequence_value(
+        db.session, DocumentSequence.__table__, prefix, str(year),
+        seed=lambda: _last_document_number(Sale.invoice_number, f'{prefix}-{year}-')
+    )
+
     return f'{prefix}-{year}-{new_number:03d}'
 
 # دالة مساعدة لتحديث المخزون
@@ -123,37 +155,318 @@ def update_inventory(product_id, quantity_change, movement_type, reference_type=
 
 # دالة مساعدة لتحديث الخزينة
 def update_treasury(treasury_id, amount, transaction_type, reference_type=None, reference_id=None, description=None):
-    treasury = Treasury.query.get(treasury_id)
-    if not treasury:
-        return False
-    
-    # حفظ الرصيد السابق
-    balance_before = treasury.current_balance
-    
-    # تحديث الرصيد
-    if transaction_type == 'إيداع':
-        treasury.current_balance += amount
-    else:  # سحب
-        treasury.current_balance -= amount
-    
-    balance_after = treasury.current_balance
-    
-    # إنشاء حركة خزينة
-    transaction = TreasuryTransaction(
-        treasury_id=treasury_id,
-        user_id=current_user.id,
-        transaction_type=transaction_type,
-        reference_type=reference_type,
-        reference_id=reference_id,
-        amount=amount,
-        balance_before=balance_before,
-        balance_after=balance_after,
-        description=description
+    return post_treasury_entries(
+        treasury_id, [(amount, transaction_type, reference_type, reference_id, description)], current_user.id
     )
-    
-    db.session.add(transaction)
+
+def post_treasury_entries(treasury_id, entries, user_id):
+    """ترحيل حركة أو أكثر على خزينة واحدة بتحديث واحد للرصيد
+
+    entries: قائمة (amount, transaction_type, reference_type, reference_id, description).
+    الحركات تُضاف دفعة واحدة برصيد قبل وبعد متسلسل لكل حركة.
+    """
+    if not entries:
+        return True
+
+    entries = [(Decimal(str(amount)),) + tuple(rest) for amount, *rest in entries]
+    deltas = [amount if transaction_type == 'إيداع' else -amount
+              for amount, transaction_type, *_ in entries]
+
+    # تحديث ذري للرصيد (balance = balance + delta) بدون قراءة ثم كتابة
+    balance_after = atomic_increment(db.session, Treasury, treasury_id, 'current_balance', sum(deltas))
+    if balance_after is None:
+        return False
+
+    balance = Decimal(str(balance_after)) - sum(deltas)
+    now = datetime.utcnow()
+    rows = []
+    for (amount, transaction_type, reference_type, reference_id, description), delta in zip(entries, deltas):
+        rows.append({
+            'id': str(uuid.uuid4()),
+            'treasury_id': treasury_id,
+            'user_id': user_id,
+            'transaction_type': transaction_type,
+            'reference_type': reference_type,
+            'reference_id': reference_id,
+            'amount': amount,
+            'balance_before': balance,
+            'balance_after': balance + delta,
+            'description': description,
+            'created_at': now
+        })
+        balance += delta
+
+    db.session.execute(TreasuryTransaction.__table__.insert(), rows)
     return True
 
+# ==================== دفتر الخزينة ====================
+
+# أثر الحركة على الرصيد (موجب للإيداع وسالب للسحب)
+SIGNED_TREASURY_AMOUNT = db.case(
+    (TreasuryTransaction.transaction_type == 'إيداع', TreasuryTransaction.amount),
+    else_=-TreasuryTransaction.amount
+)
+
+def _treasury_movement(treasury_id, after=None, until=None):
+    """صافي حركات الخزينة في الفترة (after, until]"""
+    query = db.session.query(db.func.coalesce(db.func.sum(SIGNED_TREASURY_AMOUNT), 0)).filter(
+        TreasuryTransaction.treasury_id == treasury_id
+    )
+    if after is not None:
+        query = query.filter(TreasuryTransaction.created_at > after)
+    if until is not None:
+        query = query.filter(TreasuryTransaction.created_at <= until)
+    return Decimal(str(query.scalar()))
+
+def balance_at(treasury_id, at):
+    """رصيد الخزينة في لحظة معينة من أقرب لقطة وحركات ما بعدها فقط"""
+    before = TreasuryBalanceSnapshot.query.filter(
+        TreasuryBalanceSnapshot.treasury_id == treasury_id,
+        TreasuryBalanceSnapshot.snapshot_at <= at
+    ).order_by(TreasuryBalanceSnapshot.snapshot_at.desc()).first()
+    if before:
+        return Decimal(str(before.balance)) + _treasury_movement(treasury_id, before.snapshot_at, at)
+
+    after = TreasuryBalanceSnapshot.query.filter(
+        TreasuryBalanceSnapshot.treasury_id == treasury_id,
+        TreasuryBalanceSnapshot.snapshot_at > at
+    ).order_by(TreasuryBalanceSnapshot.snapshot_at).first()
+    if after:
+        return Decimal(str(after.balance)) - _treasury_movement(treasury_id, at, after.snapshot_at)
+
+    current_balance = db.session.query(Treasury.current_balance).filter(Treasury.id == treasury_id).scalar()
+    return Decimal(str(current_balance or 0)) - _treasury_movement(treasury_id, at)
+
+def take_balance_snapshots(at=None):
+    """حفظ لقطة لرصيد كل خزينة (تُشغل دورياً، مثلاً يومياً)"""
+    at = at or datetime.utcnow()
+    later_movements = db.session.query(db.func.coalesce(db.func.sum(SIGNED_TREASURY_AMOUNT), 0)).filter(
+        TreasuryTransaction.treasury_id == Treasury.id,
+        TreasuryTransaction.created_at > at
+    ).correlate(Treasury).scalar_subquery()
+
+    # الرصيد الحالي مطروحاً منه ما تم بعد اللحظة المطلوبة، في استعلام واحد
+    rows = [
+        {'id': str(uuid.uuid4()), 'treasury_id': treasury_id, 'snapshot_at': at,
+         'balance': balance, 'created_at': datetime.utcnow()}
+        for treasury_id, balance in db.session.query(
+            Treasury.id, db.func.coalesce(Treasury.current_balance, 0) - later_movements
+        )
+    ]
+    if rows:
+        db.session.execute(TreasuryBalanceSnapshot.__table__.insert(), rows)
+    db.session.commit()
+    return len(rows)
+
+@app.cli.command('snapshot-treasury-balances')
+def snapshot_treasury_balances_command():
+    """حفظ لقطة أرصدة الخزائن (للتشغيل الدوري عبر cron)"""
+    count = take_balance_snapshots()
+    print(f"✅ تم حفظ لقطة أرصدة {count} خزينة")
+
+# ==================== ملخص المبيعات اليومي ====================
+
+# دالة مساعدة لتحديث ملخص المبيعات اليومي داخل نفس معاملة الفاتورة
+def record_sale_rollup(sale, lines, sign=1):
+    """lines: قائمة من (product_id, quantity, total_price, cost_price)
+
+    sign=-1 يعكس أثر الفاتورة عند المرتجع أو الإلغاء.
+    """
+    sales_rollup.record_sale_rollup(db.session, DailySalesRollup, sale, lines, sign)
+
+# دالة مساعدة لتسجيل دفعة على فاتورة في الملخص اليومي
+def record_sale_payment_rollup(sale, amount):
+    sales_rollup.record_payment_rollup(db.session, DailySalesRollup, sale, amount)
+
+# الفواتير التي تدخل في الملخص وفي تفاصيل التقارير (المرتجعة خارجها)
+def counted_sales():
+    return db.or_(Sale.is_returned == False, Sale.is_returned == None)
+
+# إعادة بناء الملخص اليومي من سجل الفواتير بالكامل
+def rebuild_sales_rollup():
+    return sales_rollup.rebuild_sales_rollup(db.session, DailySalesRollup, Sale, SaleItem, counted_sales())
+
+register_rollup_command(app, rebuild_sales_rollup)
+
+# ==================== ملخص حسابات العملاء ====================
+
+CUSTOMER_BALANCE_MEASURES = ('total_purchases', 'total_paid', 'invoices_count')
+
+def update_customer_balance(customer_id, total_purchases=0, total_paid=0, invoices_count=0):
+    """إضافة قيم لملخص حساب العميل داخل نفس المعاملة"""
+    if not customer_id:
+        return
+    upsert_increment(db.session, CustomerBalance.__table__, ('customer_id',), [{
+        'id': str(uuid.uuid4()),
+        'customer_id': customer_id,
+        'total_purchases': total_purchases,
+        'total_paid': total_paid,
+        'invoices_count': invoices_count
+    }], CUSTOMER_BALANCE_MEASURES)
+
+def get_customer_balances(customer_ids):
+    """أرصدة مجموعة من العملاء باستعلام واحد"""
+    balances = {}
+    if customer_ids:
+        for balance in CustomerBalance.query.filter(CustomerBalance.customer_id.in_(customer_ids)):
+            balances[balance.customer_id] = balance
+
+    result = {}
+    for customer_id in customer_ids:
+        balance = balances.get(customer_id)
+        total_purchases = balance.total_purchases if balance else Decimal('0')
+        total_paid = balance.total_paid if balance else Decimal('0')
+        result[customer_id] = {
+            'total_purchases': float(total_purchases),
+            'total_paid': float(total_paid),
+            'total_debt': float(total_purchases - total_paid),
+            'invoices_count': balance.invoices_count if balance else 0
+        }
+    return result
+
+def rebuild_customer_balances():
+    """إعادة بناء ملخص حسابات العملاء من سجل الفواتير والدفعات العامة"""
+    balances = {}
+    query = db.session.query(
+        Sale.customer_id,
+        db.func.coalesce(db.func.sum(Sale.total_amount), 0),
+        db.func.coalesce(db.func.sum(Sale.paid_amount), 0),
+        db.func.count(Sale.id)
+    ).filter(Sale.customer_id != None).group_by(Sale.customer_id)
+
+    for customer_id, total_purchases, total_paid, invoices_count in query:
+        balances[customer_id] = {
+            'id': str(uuid.uuid4()),
+            'customer_id': customer_id,
+            'total_purchases': Decimal(str(total_purchases)),
+            'total_paid': Decimal(str(total_paid)),
+            'invoices_count': invoices_count
+        }
+
+    # الدفعات على فاتورة داخلة في paid_amount، فتُضاف الدفعات العامة فقط
+    general_payments = db.session.query(
+        CustomerPayment.customer_id,
+        db.func.coalesce(db.func.sum(CustomerPayment.amount), 0)
+    ).filter(CustomerPayment.sale_id == None).group_by(CustomerPayment.customer_id)
+
+    for customer_id, amount in general_payments:
+        balance = balances.setdefault(customer_id, {
+            'id': str(uuid.uuid4()),
+            'customer_id': customer_id,
+            'total_purchases': Decimal('0'),
+            'total_paid': Decimal('0'),
+            'invoices_count': 0
+        })
+        balance['total_paid'] += Decimal(str(amount))
+
+    rows = list(balances.values())
+
+    CustomerBalance.query.delete()
+    if rows:
+        db.session.execute(CustomerBalance.__table__.insert(), rows)
+    db.session.commit()
+    return len(rows)
+
+@app.cli.command('rebuild-customer-balances')
+def rebuild_customer_balances_command():
+    """إعادة بناء جدول customer_balances من سجل المبيعات"""
+    count = rebuild_customer_balances()
+    print(f"✅ تم إعادة بناء ملخص حسابات العملاء ({count} عميل)")
+
+# إجماليات المبيعات لفترة من الملخص اليومي
+def sales_rollup_totals(date_from=None, date_to=None, customer_id=None):
+    query = db.session.query(
+        db.func.coalesce(db.func.sum(DailySalesRollup.sales_count), 0),
+        db.func.coalesce(db.func.sum(DailySalesRollup.total_amount), 0),
+        db.func.coalesce(db.func.sum(DailySalesRollup.paid_amount), 0)
+    )
+
+    if customer_id:
+        query = query.filter(DailySalesRollup.dimension == 'customer',
+                             DailySalesRollup.dimension_id == customer_id)
+    else:
+        query = query.filter(DailySalesRollup.dimension == 'all')
+
+    if date_from:
+        query = query.filter(DailySalesRollup.rollup_date >= date_from)
+    if date_to:
+        query = query.filter(DailySalesRollup.rollup_date <= date_to)
+
+    count, total_amount, paid_amount = query.one()
+    return {
+        'count': int(count),
+        'total_amount': Decimal(str(total_amount)),
+        'paid_amount': Decimal(str(paid_amount)),
+        'remaining_amount': Decimal(str(total_amount)) - Decimal(str(paid_amount))
+    }
+
+# ==================== فهرس البحث ====================
+
+SEARCHABLE_MODELS = (Product, Customer)
+
+# جداول موجودة أُضيفت لها أعمدة أو فهارس بعد إنشائها
+UPGRADED_MODELS = (Treasury, TreasuryTransaction, Shipment, SaleItem)
+
+def refresh_search_text(model, only_missing=False):
+    """إعادة حساب عمود search_text للسجلات الموجودة"""
+    table = model.__table__
+    query = model.query
+    if only_missing:
+        query = query.filter(model.search_text.is_(None))
+
+    rows = [
+        {'row_id': obj.id, 'row_search_text': obj.build_search_text()}
+        for obj in query.yield_per(1000)
+    ]
+    if rows:
+        db.session.execute(
+            table.update().where(table.c.id == db.bindparam('row_id'))
+                          .values(search_text=db.bindparam('row_search_text')),
+            rows
+        )
+    db.session.commit()
+    return len(rows)
+
+def backfill_treasury_types():
+    """تحديد نوع الخزائن الموجودة من اسمها (مرة واحدة عند إضافة العمود)"""
+    for treasury_type, name_part in (('main', 'رئيسية'), ('shipping', 'شحن')):
+        Treasury.query.filter(
+            Treasury.treasury_type.is_(None),
+            Treasury.name.contains(name_part)
+        ).update({'treasury_type': treasury_type}, synchronize_session=False)
+    db.session.commit()
+
+def backfill_sale_item_costs():
+    """تكلفة البنود القديمة من سعر التكلفة الحالي (أفضل تقدير متاح، مرة واحدة)"""
+    current_cost = db.select(Product.cost_price).where(Product.id == SaleItem.product_id).scalar_subquery()
+    SaleItem.query.filter(SaleItem.cost_price.is_(None)).update(
+        {SaleItem.cost_price: db.func.coalesce(current_cost, 0)}, synchronize_session=False
+    )
+    db.session.commit()
+
+def upgrade_schema():
+    """ترقية الجداول الموجودة وإنشاء فهارس البحث حسب نوع قاعدة البيانات"""
+    for model in UPGRADED_MODELS:
+        added = upgrade_table(db.engine, model.__table__)
+        if model is Treasury and 'treasury_type' in added:
+            backfill_treasury_types()
+        if model is SaleItem and 'cost_price' in added:
+            backfill_sale_item_costs()
+
+    for model in SEARCHABLE_MODELS:
+        added = upgrade_table(db.engine, model.__table__)
+        ensure_search_index(db.engine, model.__table__)
+        if 'search_text' in added:
+            refresh_search_text(model, only_missing=True)
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """إعادة حساب نصوص البحث وإعادة بناء فهرس البحث"""
+    for model in SEARCHABLE_MODELS:
+        count = refresh_search_text(model)
+        rebuild_search_index(db.engine, model.__table__)
+        print(f"✅ تم تحديث فهرس البحث لجدول {model.__tablename__} ({count} سجل)")
+
 # الصفحة الرئيسية
 @app.route('/')
 def index():
@@ -233,12 +546,14 @@ def setup_first_admin():
             # إنشاء الخزائن الافتراضية
             main_treasury = Treasury(
                 name='الخزينة الرئيسية',
+                treasury_type='main',
                 description='الخزينة الرئيسية للمتجر',
                 current_balance=0
             )
             
             shipping_treasury = Treasury(
                 name='خزينة الشحن',
+                treasury_type='shipping',
                 description='خزينة خاصة بأموال الشحن والتحصيل',
                 current_balance=0
             )
@@ -625,6 +940,78 @@ def dashboard():
     # استخدام صفحة بسيطة مؤقتاً
     return render_template('dashboard_simple.html')
 
+# ==================== مستندات PDF ====================
+
+# ملفات PDF المولدة (تُعاد فقط إذا تغير المستند)
+pdf_cache = PDFCache(app.config['PDF_CACHE_FOLDER'])
+
+def sale_document(sale):
+    """وصف فاتورة البيع لمحرك PDF"""
+    fields = [('التاريخ', sale.sale_date)]
+    if sale.customer:
+        fields.append(('العميل', sale.customer.name))
+        if sale.customer.phone:
+            fields.append(('الهاتف', sale.customer.phone))
+    fields.append(('طريقة الدفع', sale.payment_method))
+
+    totals = [('المجموع الفرعي', sale.subtotal)]
+    if sale.discount_amount:
+        totals.append(('الخصم', sale.discount_amount))
+    if sale.tax_amount:
+        totals.append(('الضريبة', sale.tax_amount))
+    if sale.shipping_cost:
+        totals.append(('الشحن', sale.shipping_cost))
+    totals += [
+        ('الإجمالي', sale.total_amount),
+        ('المدفوع', sale.paid_amount),
+        ('المتبقي', sale.remaining_amount)
+    ]
+
+    return {
+        'header': 'VAYON',
+        'title': 'فاتورة بيع',
+        'number': sale.invoice_number,
+        'fields': fields,
+        'columns': ['الصنف', 'الكمية', 'السعر', 'الخصم', 'الإجمالي'],
+        'widths': [0.4, 0.12, 0.16, 0.14, 0.18],
+        'rows': [
+            [item.product.name, item.quantity.normalize(), item.unit_price,
+             item.discount_amount or 0, item.total_price]
+            for item in sale.items
+        ],
+        'totals': totals,
+        'notes': sale.notes
+    }
+
+def shipment_document(shipment):
+    """وصف بوليصة الشحن لمحرك PDF"""
+    fields = [
+        ('التاريخ', shipment.created_date),
+        ('شركة الشحن', shipment.shipping_company.name if shipment.shipping_company else ''),
+        ('رقم التتبع', shipment.tracking_number),
+        ('المرسل إليه', shipment.recipient_name),
+        ('الهاتف', shipment.recipient_phone),
+        ('العنوان', shipment.recipient_address),
+        ('المدينة', f'{shipment.recipient_city} - {shipment.recipient_governorate}'),
+        ('عدد القطع', shipment.pieces_count),
+        ('الوزن', shipment.weight),
+        ('المحتوى', shipment.content_description),
+    ]
+    if shipment.sale:
+        fields.insert(1, ('رقم الفاتورة', shipment.sale.invoice_number))
+
+    return {
+        'header': 'VAYON',
+        'title': 'بوليصة شحن',
+        'number': shipment.shipment_number,
+        'fields': fields,
+        'totals': [
+            ('مبلغ التحصيل', shipment.cod_amount),
+            ('تكلفة الشحن', shipment.shipping_cost)
+        ],
+        'notes': shipment.notes
+    }
+
 # ==================== نظام فواتير البيع المتقدم ====================
 
 # قائمة فواتير البيع
@@ -744,6 +1131,7 @@ def create_sale():
 
             # إضافة عناصر الفاتورة
             items_data = data.get('items', [])
+            rollup_lines = []
             for item_data in items_data:
                 product = Product.query.get(item_data['product_id'])
                 if not product:
@@ -762,10 +1150,12 @@ def create_sale():
                     unit_price=unit_price,
                     discount_amount=discount_amount,
                     total_price=total_price,
+                    cost_price=Decimal(str(product.cost_price or 0)),
                     notes=item_data.get('notes', '')
                 )
 
                 db.session.add(sale_item)
+                rollup_lines.append((product.id, quantity, total_price, sale_item.cost_price))
 
                 # تحديث المخزون (خصم الكمية)
                 update_inventory(
@@ -777,21 +1167,22 @@ def create_sale():
                     unit_price=unit_price
                 )
 
-            # تحديث الخزينة (إضافة المبلغ المدفوع)
-            if sale.paid_amount > 0:
-                main_treasury = Treasury.query.filter(
-                    Treasury.name.contains('رئيسية')
-                ).first()
+            # تحديث ملخص المبيعات اليومي
+            record_sale_rollup(sale, rollup_lines)
+            update_customer_balance(sale.customer_id, total_purchases=sale.total_amount,
+                                    total_paid=sale.paid_amount, invoices_count=1)
 
-                if main_treasury:
-                    update_treasury(
-                        treasury_id=main_treasury.id,
-                        amount=sale.paid_amount,
-                        transaction_type='إيداع',
-                        reference_type='فاتورة بيع',
-                        reference_id=sale.id,
-                        description=f'دفعة من فاتورة بيع رقم {sale.invoice_number}'
-                    )
+            # تحديث الخزينة (إضافة المبلغ المدفوع)
+            main_treasury_id = treasury_id_for('main')
+            if sale.paid_amount > 0 and main_treasury_id:
+                update_treasury(
+                    treasury_id=main_treasury_id,
+                    amount=sale.paid_amount,
+                    transaction_type='إيداع',
+                    reference_type='فاتورة بيع',
+                    reference_id=sale.id,
+                    description=f'دفعة من فاتورة بيع رقم {sale.invoice_number}'
+                )
 
             db.session.commit()
 
@@ -847,6 +1238,45 @@ def print_sale(sale_id):
     sale = Sale.query.get_or_404(sale_id)
     return render_template('print_sale.html', sale=sale)
 
+# فاتورة البيع PDF
+@app.route('/sales/<sale_id>/pdf')
+@login_required
+def sale_pdf(sale_id):
+    sale = Sale.query.options(
+        db.selectinload(Sale.items).joinedload(SaleItem.product),
+        db.joinedload(Sale.customer)
+    ).filter(Sale.id == sale_id).first_or_404()
+    # الإصدار بصمة المستند لأن تعديل الأصناف أو اسم العميل أو المنتج لا يغير sale.updated_at
+    document = sale_document(sale)
+    path = pdf_cache.get_or_render('sale', sale.id, document_fingerprint(document), lambda: document)
+    return send_file(os.path.abspath(path), mimetype='application/pdf',
+                     download_name=f'{sale.invoice_number}.pdf')
+
+# كل فواتير يوم في ملف PDF واحد للطباعة
+@app.route('/sales/daily-pdf')
+@login_required
+def daily_sales_pdf():
+    day = request.args.get('date', '') or datetime.now().strftime('%Y-%m-%d')
+    period_start, period_end = report_period(day, day)
+    if period_start is None:
+        flash('تاريخ غير صحيح', 'error')
+        return redirect(url_for('sales_list'))
+
+    sales = Sale.query.options(
+        db.selectinload(Sale.items).joinedload(SaleItem.product),
+        db.joinedload(Sale.customer)
+    ).filter(
+        Sale.sale_date >= period_start, Sale.sale_date < period_end
+    ).order_by(Sale.sale_date, Sale.id).all()
+
+    if not sales:
+        flash('لا توجد فواتير في هذا اليوم', 'info')
+        return redirect(url_for('sales_list'))
+
+    content = render_pdf([sale_document(sale) for sale in sales])
+    return send_file(io.BytesIO(content), mimetype='application/pdf',
+                     download_name=f'sales_{day}.pdf')
+
 # API للبحث عن المنتجات
 @app.route('/api/products/search')
 @login_required
@@ -855,16 +1285,21 @@ def search_products():
     if len(query) < 2:
         return jsonify([])
 
+    # مطابقة تامة للباركود أو الرمز (فهرس فريد) - حالة قارئ الباركود
     products = Product.query.filter(
-        db.and_(
+        Product.is_active == True,
+        db.or_(Product.barcode == query, Product.sku == query)
+    ).limit(20).all()
+
+    if not products:
+        products_query = Product.query.filter(
             Product.is_active == True,
-            db.or_(
-                Product.name.contains(query),
-                Product.sku.contains(query),
-                Product.barcode.contains(query)
-            )
+            search_condition(Product.__table__, query)
         )
-    ).limit(20).all()
+        rank = search_rank(Product.__table__, query)
+        if rank is not None:
+            products_query = products_query.order_by(rank)
+        products = products_query.limit(20).all()
 
     result = []
     for product in products:
@@ -888,15 +1323,21 @@ def search_customers():
     if len(query) < 2:
         return jsonify([])
 
+    # مطابقة تامة لرقم الهاتف (مفهرس)
     customers = Customer.query.filter(
-        db.and_(
+        Customer.is_active == True,
+        Customer.phone == query
+    ).limit(20).all()
+
+    if not customers:
+        customers_query = Customer.query.filter(
             Customer.is_active == True,
-            db.or_(
-                Customer.name.contains(query),
-                Customer.phone.contains(query)
-            )
+            search_condition(Customer.__table__, query)
         )
-    ).limit(20).all()
+        rank = search_rank(Customer.__table__, query)
+        if rank is not None:
+            customers_query = customers_query.order_by(rank)
+        customers = customers_query.limit(20).all()
 
     result = []
     for customer in customers:
@@ -954,29 +1395,14 @@ def customers_list():
         page=page, per_page=per_page, error_out=False
     )
 
-    # حساب إحصائيات العملاء
+    # أرصدة العملاء في الصفحة باستعلام واحد من ملخص الحسابات
+    balances = get_customer_balances([customer.id for customer in customers.items])
     for customer in customers.items:
-        # حساب إجمالي المشتريات
-        total_purchases = db.session.query(db.func.sum(Sale.total_amount)).filter(
-            Sale.customer_id == customer.id
-        ).scalar() or 0
-
-        # حساب المبلغ المدفوع
-        total_paid = db.session.query(db.func.sum(Sale.paid_amount)).filter(
-            Sale.customer_id == customer.id
-        ).scalar() or 0
-
-        # حساب المبلغ المتبقي (الدين)
-        total_debt = total_purchases - total_paid
-
-        # عدد الفواتير
-        invoices_count = Sale.query.filter(Sale.customer_id == customer.id).count()
-
-        # إضافة البيانات للعميل
-        customer.total_purchases = float(total_purchases)
-        customer.total_paid = float(total_paid)
-        customer.total_debt = float(total_debt)
-        customer.invoices_count = invoices_count
+        balance = balances[customer.id]
+        customer.total_purchases = balance['total_purchases']
+        customer.total_paid = balance['total_paid']
+        customer.total_debt = balance['total_debt']
+        customer.invoices_count = balance['invoices_count']
 
     return render_template('customers_list.html', customers=customers,
                          search=search, governorate_filter=governorate_filter,
@@ -1040,15 +1466,7 @@ def view_customer(customer_id):
     customer = Customer.query.get_or_404(customer_id)
 
     # حساب الإحصائيات
-    total_purchases = db.session.query(db.func.sum(Sale.total_amount)).filter(
-        Sale.customer_id == customer.id
-    ).scalar() or 0
-
-    total_paid = db.session.query(db.func.sum(Sale.paid_amount)).filter(
-        Sale.customer_id == customer.id
-    ).scalar() or 0
-
-    total_debt = total_purchases - total_paid
+    balance = get_customer_balances([customer.id])[customer.id]
 
     # آخر الفواتير
     recent_sales = Sale.query.filter(
@@ -1060,12 +1478,7 @@ def view_customer(customer_id):
         CustomerPayment.customer_id == customer.id
     ).order_by(CustomerPayment.payment_date.desc()).limit(10).all()
 
-    stats = {
-        'total_purchases': float(total_purchases),
-        'total_paid': float(total_paid),
-        'total_debt': float(total_debt),
-        'invoices_count': len(recent_sales)
-    }
+    stats = balance
 
     return render_template('view_customer.html', customer=customer, stats=stats,
                          recent_sales=recent_sales, recent_payments=recent_payments)
@@ -1122,7 +1535,7 @@ def add_customer_payment(customer_id):
         customer = Customer.query.get_or_404(customer_id)
 
         # استلام البيانات
-        amount = float(request.form.get('amount', 0))
+        amount = Decimal(str(request.form.get('amount', 0) or 0))
         payment_method = request.form.get('payment_method')
         reference_number = request.form.get('reference_number')
         notes = request.form.get('notes')
@@ -1132,6 +1545,11 @@ def add_customer_payment(customer_id):
             flash('مبلغ الدفعة يجب أن يكون أكبر من صفر', 'error')
             return redirect(url_for('view_customer', customer_id=customer_id))
 
+        sale = Sale.query.get(sale_id) if sale_id else None
+        if sale_id and sale is None:
+            flash('الفاتورة المحددة غير موجودة', 'error')
+            return redirect(url_for('view_customer', customer_id=customer_id))
+
         # إنشاء الدفعة
         payment = CustomerPayment(
             customer_id=customer.id,
@@ -1147,26 +1565,27 @@ def add_customer_payment(customer_id):
         db.session.add(payment)
 
         # تحديث الفاتورة إذا كانت محددة
-        if sale_id:
-            sale = Sale.query.get(sale_id)
-            if sale:
-                sale.paid_amount += amount
-                sale.remaining_amount = sale.total_amount - sale.paid_amount
-
-                # تحديث حالة الدفع
-                if sale.remaining_amount <= 0:
-                    sale.payment_status = 'مدفوع كاملاً'
-                elif sale.paid_amount > 0:
-                    sale.payment_status = 'مدفوع جزئياً'
+        if sale:
+            sale.paid_amount += amount
+            sale.remaining_amount = sale.total_amount - sale.paid_amount
+
+            # تحديث حالة الدفع
+            if sale.remaining_amount <= 0:
+                sale.payment_status = 'مدفوع كاملاً'
+            elif sale.paid_amount > 0:
+                sale.payment_status = 'مدفوع جزئياً'
+
+            record_sale_payment_rollup(sale, amount)
+            update_customer_balance(sale.customer_id, total_paid=amount)
+        else:
+            # دفعة عامة على حساب العميل
+            update_customer_balance(customer.id, total_paid=amount)
 
         # تحديث الخزينة الرئيسية
-        main_treasury = Treasury.query.filter(
-            Treasury.name.contains('رئيسية')
-        ).first()
-
-        if main_treasury:
+        main_treasury_id = treasury_id_for('main')
+        if main_treasury_id:
             update_treasury(
-                treasury_id=main_treasury.id,
+                treasury_id=main_treasury_id,
                 amount=amount,
                 transaction_type='إيداع',
                 reference_type='دفعة عميل',
@@ -1188,31 +1607,330 @@ def add_customer_payment(customer_id):
 
 # دالة مساعدة لتوليد رقم شحنة
 def generate_shipment_number():
-    from datetime import datetime
+    return generate_shipment_numbers(1)[0]
+
+def generate_shipment_numbers(count):
+    """حجز count رقم شحنة متتالية بتحديث واحد للعداد"""
     now = datetime.now()
-    year = now.year
-    month = now.month
-
-    # البحث عن آخر شحنة في الشهر الحالي
-    last_shipment = Shipment.query.filter(
-        Shipment.shipment_number.like(f'SH-{year}{month:02d}-%')
-    ).order_by(Shipment.shipment_number.desc()).first()
-
-    if last_shipment:
-        # استخراج الرقم التسلسلي
-        parts = last_shipment.shipment_number.split('-')
-        if len(parts) == 3:
-            try:
-                last_number = int(parts[2])
-                new_number = last_number + 1
-            except:
-                new_number = 1
+    period = f'{now.year}{now.month:02d}'
+    last_number = next_sequence_value(
+        db.session, DocumentSequence.__table__, 'SH', period, count=count,
+        seed=lambda: _last_document_number(Shipment.shipment_number, f'SH-{period}-')
+    )
+
+    return [f'SH-{period}-{number:04d}' for number in range(last_number - count + 1, last_number + 1)]
+
+def create_shipments_batch(sale_ids, shipping_company_id=None, shipping_cost=Decimal('0'),
+                           weight=None, pieces_count=1, user_id=None):
+    """إنشاء شحنات لمجموعة فواتير في معاملة واحدة وإرجاع معرفاتها
+
+    الفواتير تُحمّل وتُقفل باستعلام واحد، والأرقام تُحجز بتحديث واحد
+    للعداد، والشحنات وسجل الحالات تُضاف دفعة واحدة. إذا كانت أي فاتورة
+    غير صالحة لا يُنشأ شيء ويُرفع ValueError بكل الأخطاء.
+    """
+    try:
+        sale_ids = list(dict.fromkeys(sale_ids))
+        if not sale_ids:
+            raise ValueError('يجب اختيار فاتورة واحدة على الأقل')
+
+        sales = {
+            sale.id: sale
+            for sale in Sale.query.options(db.joinedload(Sale.customer))
+                                  .filter(Sale.id.in_(sorted(sale_ids)))
+                                  .order_by(Sale.id).with_for_update(of=Sale).all()
+        }
+
+        # الفواتير التي لها شحنة قائمة بالفعل
+        shipped = {
+            sale_id for (sale_id,) in db.session.query(Shipment.sale_id).filter(
+                Shipment.sale_id.in_(sale_ids),
+                Shipment.status != 'ملغي'
+            )
+        }
+
+        company = None
+        if shipping_company_id:
+            company = ShippingCompany.query.get(shipping_company_id)
+            if not company:
+                raise ValueError('شركة الشحن غير موجودة')
+
+        errors = []
+        recipients = []
+        for sale_id in sale_ids:
+            sale = sales.get(sale_id)
+            if not sale:
+                errors.append(f'الفاتورة {sale_id} غير موجودة')
+                continue
+            if sale_id in shipped:
+                errors.append(f'الفاتورة {sale.invoice_number} لها شحنة بالفعل')
+                continue
+
+            customer = sale.customer
+            recipient = {
+                'recipient_name': customer.name if customer else None,
+                'recipient_phone': sale.shipping_phone or (customer.phone if customer else None),
+                'recipient_address': sale.shipping_address or (customer.address if customer else None),
+                'recipient_city': sale.shipping_city or (customer.city if customer else None),
+                'recipient_governorate': sale.shipping_governorate or (customer.governorate if customer else None),
+            }
+            if not all(recipient.values()):
+                errors.append(f'بيانات الشحن غير مكتملة في الفاتورة {sale.invoice_number}')
+                continue
+            recipients.append((sale, recipient))
+
+        if errors:
+            raise ValueError('\n'.join(errors))
+
+        numbers = generate_shipment_numbers(len(recipients))
+        now = datetime.utcnow()
+        shipment_rows = []
+        history_rows = []
+        for number, (sale, recipient) in zip(numbers, recipients):
+            cod_amount = sale.remaining_amount or Decimal('0')
+            collection_commission = Decimal('0')
+            if company and cod_amount > 0 and company.collection_commission:
+                collection_commission = cod_amount * company.collection_commission / 100
+
+            shipment_id = str(uuid.uuid4())
+            shipment_rows.append({
+                'id': shipment_id,
+                'shipment_number': number,
+                'sale_id': sale.id,
+                'shipping_company_id': shipping_company_id,
+                **recipient,
+                'weight': weight,
+                'pieces_count': pieces_count,
+                'content_description': f'فاتورة {sale.invoice_number}',
+                'cod_amount': cod_amount,
+                'shipping_cost': shipping_cost,
+                'collection_commission': collection_commission,
+                'status': 'قيد التحضير',
+                'created_date': now,
+                'created_at': now,
+                'updated_at': now
+            })
+            history_rows.append({
+                'id': str(uuid.uuid4()),
+                'shipment_id': shipment_id,
+                'user_id': user_id,
+                'old_status': None,
+                'new_status': 'قيد التحضير',
+                'notes': 'تم إنشاء الشحنة',
+                'created_at': now
+            })
+
+        db.session.execute(Shipment.__table__.insert(), shipment_rows)
+        db.session.execute(ShipmentStatusHistory.__table__.insert(), history_rows)
+        db.session.execute(
+            db.update(Sale).where(Sale.id.in_([sale.id for sale, _ in recipients]))
+            .values(shipping_status='قيد التحضير')
+        )
+
+        db.session.commit()
+        return [row['id'] for row in shipment_rows]
+
+    except Exception:
+        db.session.rollback()
+        raise
+
+# ==================== حالات الشحن ====================
+
+SHIPMENT_STATUSES = ('قيد التحضير', 'جاهز للاستلام', 'تم الاستلام', 'في الطريق', 'تم التسليم', 'مرتجع', 'ملغي')
+
+# الحالات النهائية وما يُسمح بالانتقال إليه منها
+FINAL_SHIPMENT_TRANSITIONS = {
+    'تم التسليم': ('مرتجع',),
+    'ملغي': (),
+}
+
+def apply_shipment_status(shipment, new_status, user_id, notes=None, tracking_number=None):
+    """تغيير حالة الشحنة (بدون حفظ) وإرجاع حركات الخزينة المطلوبة
+
+    يُضاف سجل في تاريخ الحالات وتُحدث الفاتورة المرتبطة. عند التسليم مع
+    مبلغ تحصيل تُرجع حركتا الإيداع والعمولة لترحيلهما بـ post_treasury_entries.
+    يرفع ValueError قبل أي تعديل إذا كان الانتقال غير مسموح.
+    """
+    old_status = shipment.status
+    if new_status not in SHIPMENT_STATUSES:
+        raise ValueError(f'حالة غير معروفة: {new_status}')
+    if new_status == old_status:
+        raise ValueError(f'الشحنة بالفعل في حالة {new_status}')
+    if new_status not in FINAL_SHIPMENT_TRANSITIONS.get(old_status, SHIPMENT_STATUSES):
+        raise ValueError(f'لا يمكن تغيير الحالة من {old_status} إلى {new_status}')
+
+    now = datetime.utcnow()
+    shipment.status = new_status
+    if tracking_number:
+        shipment.tracking_number = tracking_number
+
+    # تحديث التواريخ حسب الحالة
+    if new_status == 'تم الاستلام':
+        shipment.pickup_date = now
+    elif new_status == 'تم التسليم':
+        shipment.delivery_date = now
+
+    db.session.add(ShipmentStatusHistory(
+        shipment_id=shipment.id,
+        user_id=user_id,
+        old_status=old_status,
+        new_status=new_status,
+        notes=notes
+    ))
+
+    # تحديث حالة الفاتورة المرتبطة
+    if shipment.sale:
+        shipment.sale.shipping_status = new_status
+
+    postings = []
+    if new_status == 'تم التسليم' and shipment.cod_amount > 0:
+        # تحديث حالة التحصيل
+        shipment.collection_status = 'تم كاملاً'
+        shipment.collected_amount = shipment.cod_amount
+        shipment.collection_date = now
+
+        postings.append((shipment.cod_amount, 'إيداع', 'تحصيل شحنة', shipment.id,
+                         f'تحصيل شحنة رقم {shipment.shipment_number}'))
+        if shipment.collection_commission and shipment.collection_commission > 0:
+            postings.append((shipment.collection_commission, 'سحب', 'عمولة تحصيل', shipment.id,
+                             f'عمولة تحصيل شحنة رقم {shipment.shipment_number}'))
+
+    return postings
+
+# ==================== استيراد حالات الشحن ====================
+
+SHIPMENT_IMPORT_BATCH_SIZE = 500
+
+# أسماء الأعمدة المقبولة في ملفات شركات الشحن
+SHIPMENT_IMPORT_COLUMNS = {
+    'tracking_number': ('tracking_number', 'tracking', 'awb', 'رقم التتبع', 'رقم البوليصة'),
+    'shipment_number': ('shipment_number', 'reference', 'رقم الشحنة'),
+    'status': ('status', 'الحالة'),
+    'notes': ('notes', 'comment', 'ملاحظات'),
+}
+
+# حالات شركات الشحن الشائعة وما يقابلها في النظام
+COURIER_STATUSES = {
+    'ready': 'جاهز للاستلام',
+    'picked up': 'تم الاستلام',
+    'in transit': 'في الطريق',
+    'out for delivery': 'في الطريق',
+    'delivered': 'تم التسليم',
+    'returned': 'مرتجع',
+    'cancelled': 'ملغي',
+    'canceled': 'ملغي',
+}
+
+def _import_columns(fieldnames):
+    columns = {}
+    for field in fieldnames or []:
+        name = (field or '').strip().lower().replace('-', ' ')
+        for column, aliases in SHIPMENT_IMPORT_COLUMNS.items():
+            if name in aliases or name.replace(' ', '_') in aliases:
+                columns.setdefault(column, field)
+    return columns
+
+def _apply_status_batch(batch, user_id, treasury_id):
+    """تطبيق دفعة صفوف في معاملة واحدة وإرجاع نتيجة كل صف"""
+    tracking_numbers = {row['tracking_number'] for row in batch if row['tracking_number']}
+    shipment_numbers = {row['shipment_number'] for row in batch if row['shipment_number']}
+
+    shipments = Shipment.query.options(db.joinedload(Shipment.sale)).filter(db.or_(
+        Shipment.tracking_number.in_(tracking_numbers),
+        Shipment.shipment_number.in_(shipment_numbers)
+    )).with_for_update(of=Shipment).all()
+    by_tracking = {s.tracking_number: s for s in shipments if s.tracking_number}
+    by_number = {s.shipment_number: s for s in shipments}
+
+    postings = []
+    updated = []
+    for row in batch:
+        shipment = by_number.get(row['shipment_number']) or by_tracking.get(row['tracking_number'])
+        raw_status = row['status']
+        status = COURIER_STATUSES.get(raw_status.lower().replace('_', ' '), raw_status)
+
+        if not row['key']:
+            row.update(result='error', message='رقم التتبع أو رقم الشحنة مطلوب')
+        elif not shipment:
+            row.update(result='error', message='الشحنة غير موجودة')
+        elif shipment.status == status:
+            row.update(result='unchanged', message='')
         else:
-            new_number = 1
-    else:
-        new_number = 1
+            try:
+                postings += apply_shipment_status(shipment, status, user_id, notes=row['notes'] or None,
+                                                  tracking_number=row['tracking_number'] or None)
+                row.update(result='updated', message=shipment.shipment_number)
+                updated.append(row)
+            except ValueError as e:
+                row.update(result='error', message=str(e))
+
+    try:
+        if postings and treasury_id:
+            post_treasury_entries(treasury_id, postings, user_id)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        for row in updated:
+            row.update(result='error', message=f'تعذر الحفظ: {e}')
+
+    return batch
+
+def import_shipment_statuses(lines, user_id, batch_size=SHIPMENT_IMPORT_BATCH_SIZE):
+    """استيراد ملف حالات الشحن (CSV) وإرجاع تقرير بنتيجة كل صف
+
+    الملف يُقرأ صفاً صفاً، والصفوف تُطابق برقم التتبع أو رقم الشحنة
+    باستعلام واحد لكل دفعة وتُحفظ كل دفعة في معاملة واحدة، فخطأ في صف
+    لا يوقف باقي الملف. النتيجة لكل صف: updated أو unchanged أو error.
+    """
+    reader = csv.DictReader(lines)
+    columns = _import_columns(reader.fieldnames)
+    if 'status' not in columns or not {'tracking_number', 'shipment_number'} & columns.keys():
+        raise ValueError('الملف يجب أن يحتوي على عمود الحالة وعمود رقم التتبع أو رقم الشحنة')
+
+    def value(record, column):
+        return (record.get(columns[column]) or '').strip() if column in columns else ''
+
+    treasury_id = treasury_id_for('shipping')
+    report = []
+    batch = []
+    for line_number, record in enumerate(reader, start=2):
+        row = {column: value(record, column) for column in SHIPMENT_IMPORT_COLUMNS}
+        row['line'] = line_number
+        row['key'] = row['tracking_number'] or row['shipment_number']
+        batch.append(row)
+        if len(batch) >= batch_size:
+            report += _apply_status_batch(batch, user_id, treasury_id)
+            batch = []
+
+    if batch:
+        report += _apply_status_batch(batch, user_id, treasury_id)
+    return report
+
+def shipment_import_summary(report):
+    return {
+        'total': len(report),
+        'updated': sum(1 for r in report if r['result'] == 'updated'),
+        'unchanged': sum(1 for r in report if r['result'] == 'unchanged'),
+        'failed': sum(1 for r in report if r['result'] == 'error')
+    }
 
-    return f'SH-{year}{month:02d}-{new_number:04d}'
+@app.cli.command('import-shipment-statuses')
+@click.argument('path')
+@click.option('--username', required=True, help='المستخدم المسجل في تاريخ الحالات')
+def import_shipment_statuses_command(path, username):
+    """استيراد ملف حالات الشحن (CSV) من شركة الشحن"""
+    user = User.query.filter_by(username=username).first()
+    if not user:
+        print(f"❌ المستخدم {username} غير موجود")
+        return
+
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        report = import_shipment_statuses(f, user.id)
+
+    for row in report:
+        if row['result'] == 'error':
+            print(f"❌ السطر {row['line']} ({row['key']}): {row['message']}")
+    summary = shipment_import_summary(report)
+    print(f"✅ تم تحديث {summary['updated']} شحنة، بدون تغيير {summary['unchanged']}، أخطاء {summary['failed']}")
 
 # قائمة الشحنات
 @app.route('/shipments')
@@ -1388,6 +2106,49 @@ def view_shipment(shipment_id):
 
     return render_template('view_shipment.html', shipment=shipment, status_history=status_history)
 
+# بوليصة الشحن PDF
+@app.route('/shipments/<shipment_id>/waybill')
+@login_required
+def shipment_waybill(shipment_id):
+    shipment = Shipment.query.get_or_404(shipment_id)
+    # البوليصة تعرض بيانات من الفاتورة وشركة الشحن، فالإصدار بصمة المستند
+    document = shipment_document(shipment)
+    path = pdf_cache.get_or_render('waybill', shipment.id, document_fingerprint(document), lambda: document)
+    return send_file(os.path.abspath(path), mimetype='application/pdf',
+                     download_name=f'{shipment.shipment_number}.pdf')
+
+# إنشاء شحنات لمجموعة فواتير وطباعة بوالصها في ملف واحد
+@app.route('/api/shipments/batch', methods=['POST'])
+@login_required
+def create_shipments_batch_api():
+    data = request.get_json(silent=True) or request.form
+    sale_ids = data.getlist('sale_ids') if hasattr(data, 'getlist') else data.get('sale_ids', [])
+
+    try:
+        shipment_ids = create_shipments_batch(
+            sale_ids,
+            shipping_company_id=data.get('shipping_company_id') or None,
+            shipping_cost=Decimal(str(data.get('shipping_cost') or 0)),
+            weight=Decimal(str(data['weight'])) if data.get('weight') else None,
+            pieces_count=int(data.get('pieces_count') or 1),
+            user_id=current_user.id
+        )
+    except (ValueError, ArithmeticError) as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+
+    shipments = Shipment.query.options(
+        db.joinedload(Shipment.sale), db.joinedload(Shipment.shipping_company)
+    ).filter(Shipment.id.in_(shipment_ids)).order_by(Shipment.shipment_number).all()
+
+    content = render_pdf([shipment_document(shipment) for shipment in shipments])
+    response = send_file(io.BytesIO(content), mimetype='application/pdf',
+                         download_name=f'waybills_{datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf')
+    response.headers['X-Shipments-Created'] = str(len(shipments))
+    return response
+
 # تحديث حالة الشحنة
 @app.route('/shipments/<shipment_id>/update-status', methods=['POST'])
 @login_required
@@ -1403,68 +2164,13 @@ def update_shipment_status(shipment_id):
             flash('الحالة الجديدة مطلوبة', 'error')
             return redirect(url_for('view_shipment', shipment_id=shipment_id))
 
-        # حفظ الحالة القديمة
-        old_status = shipment.status
-
-        # تحديث الشحنة
-        shipment.status = new_status
-        if tracking_number:
-            shipment.tracking_number = tracking_number
+        postings = apply_shipment_status(shipment, new_status, current_user.id,
+                                         notes=notes, tracking_number=tracking_number)
 
-        # تحديث التواريخ حسب الحالة
-        if new_status == 'تم الاستلام':
-            shipment.pickup_date = datetime.utcnow()
-        elif new_status == 'تم التسليم':
-            shipment.delivery_date = datetime.utcnow()
-
-        # إنشاء سجل في تاريخ الحالات
-        status_history = ShipmentStatusHistory(
-            shipment_id=shipment.id,
-            user_id=current_user.id,
-            old_status=old_status,
-            new_status=new_status,
-            notes=notes
-        )
-
-        db.session.add(status_history)
-
-        # تحديث حالة الفاتورة المرتبطة
-        if shipment.sale:
-            shipment.sale.shipping_status = new_status
-
-        # إذا تم التسليم وهناك مبلغ تحصيل، تحديث الخزينة
-        if new_status == 'تم التسليم' and shipment.cod_amount > 0:
-            # تحديث حالة التحصيل
-            shipment.collection_status = 'تم كاملاً'
-            shipment.collected_amount = shipment.cod_amount
-            shipment.collection_date = datetime.utcnow()
-
-            # تحديث خزينة الشحن
-            shipping_treasury = Treasury.query.filter(
-                Treasury.name.contains('شحن')
-            ).first()
-
-            if shipping_treasury:
-                # إضافة المبلغ المحصل
-                update_treasury(
-                    treasury_id=shipping_treasury.id,
-                    amount=shipment.cod_amount,
-                    transaction_type='إيداع',
-                    reference_type='تحصيل شحنة',
-                    reference_id=shipment.id,
-                    description=f'تحصيل شحنة رقم {shipment.shipment_number}'
-                )
-
-                # خصم عمولة التحصيل
-                if shipment.collection_commission > 0:
-                    update_treasury(
-                        treasury_id=shipping_treasury.id,
-                        amount=shipment.collection_commission,
-                        transaction_type='سحب',
-                        reference_type='عمولة تحصيل',
-                        reference_id=shipment.id,
-                        description=f'عمولة تحصيل شحنة رقم {shipment.shipment_number}'
-                    )
+        # إيداع مبلغ التحصيل وخصم العمولة في خزينة الشحن
+        treasury_id = treasury_id_for('shipping')
+        if postings and treasury_id:
+            post_treasury_entries(treasury_id, postings, current_user.id)
 
         db.session.commit()
 
@@ -1476,6 +2182,38 @@ def update_shipment_status(shipment_id):
 
     return redirect(url_for('view_shipment', shipment_id=shipment_id))
 
+# استيراد ملف حالات الشحن من شركة الشحن (CSV)
+@app.route('/shipments/import-status', methods=['POST'])
+@login_required
+def import_shipment_statuses_upload():
+    upload = request.files.get('file')
+    if not upload:
+        return jsonify({
+            'success': False,
+            'message': 'يجب اختيار ملف الحالات'
+        }), 400
+
+    try:
+        report = import_shipment_statuses(codecs.iterdecode(upload.stream, 'utf-8-sig'), current_user.id)
+    except (ValueError, UnicodeDecodeError) as e:
+        return jsonify({
+            'success': False,
+            'message': f'تعذر قراءة الملف: {str(e)}'
+        }), 400
+
+    # ?format=csv لتنزيل تقرير كامل بنتيجة كل صف
+    if request.args.get('format') == 'csv':
+        headers = ['السطر', 'رقم التتبع / الشحنة', 'الحالة', 'النتيجة', 'الرسالة']
+        rows = ([r['line'], r['key'], r['status'], r['result'], r['message']] for r in report)
+        return export_response(headers, rows, 'shipment_import_report')
+
+    summary = shipment_import_summary(report)
+    return jsonify({
+        'success': True,
+        **summary,
+        'errors': [r for r in report if r['result'] == 'error']
+    })
+
 # ==================== نظام التحصيل والمتابعة المتقدم ====================
 
 # دالة مساعدة لإنشاء مهام التحصيل التلقائية
@@ -1770,19 +2508,14 @@ def add_collection_follow_up(task_id):
 @login_required
 def financial_reports():
     # إحصائيات سريعة
-    today = datetime.now().date()
-    start_of_month = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    start_of_year = datetime.now().replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
+    # بتوقيت UTC مثل sale_date و payment_date (ومنه rollup_date)
+    now = datetime.utcnow()
+    start_of_month = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    start_of_year = now.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
 
-    # مبيعات الشهر
-    monthly_sales = db.session.query(db.func.sum(Sale.total_amount)).filter(
-        Sale.sale_date >= start_of_month
-    ).scalar() or 0
-
-    # مبيعات السنة
-    yearly_sales = db.session.query(db.func.sum(Sale.total_amount)).filter(
-        Sale.sale_date >= start_of_year
-    ).scalar() or 0
+    # مبيعات الشهر والسنة من الملخص اليومي
+    monthly_sales = sales_rollup_totals(date_from=start_of_month.date())['total_amount']
+    yearly_sales = sales_rollup_totals(date_from=start_of_year.date())['total_amount']
 
     # المحصل هذا الشهر
     monthly_collected = db.session.query(db.func.sum(CustomerPayment.amount)).filter(
@@ -1819,56 +2552,113 @@ def financial_reports():
 
     return render_template('financial_reports.html', stats=stats)
 
-# تقرير المبيعات التفصيلي
-@app.route('/reports/sales')
-@login_required
-def sales_report():
-    # فلاتر التقرير
+# ==================== أدوات التقارير ====================
+
+# عدد صفوف التفاصيل في صفحة التقرير
+REPORT_PAGE_SIZE = 50
+REPORT_MAX_PAGE_SIZE = 500
+
+def report_period(date_from, date_to):
+    """حدود فترة التقرير: بداية اليوم الأول وبداية اليوم التالي لآخر يوم
+
+    المقارنة بالحدود مباشرة (بدلاً من date(column)) تسمح باستخدام فهرس العمود.
+    يرجع (None, None) لتاريخ غير صحيح، ويرفض المسار الطلب حتى لا يعمل بلا حدود.
+    """
+    try:
+        start = datetime.strptime(date_from, '%Y-%m-%d')
+        end = datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1)
+    except ValueError:
+        return None, None
+    return start, end
+
+def report_dates():
+    """فلتر الفترة من الطلب (آخر 30 يوم افتراضياً)"""
     date_from = request.args.get('date_from', '')
     date_to = request.args.get('date_to', '')
-    customer_id = request.args.get('customer_id', '')
 
     # تحديد الفترة الافتراضية (آخر 30 يوم)
     if not date_from:
         date_from = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
     if not date_to:
         date_to = datetime.now().strftime('%Y-%m-%d')
+    return date_from, date_to
 
-    # بناء الاستعلام
-    query = Sale.query
+def invalid_period_redirect(endpoint):
+    """صفحة التقرير بالفترة الافتراضية عند تاريخ غير صحيح في الفلتر"""
+    flash('تاريخ غير صحيح في فلتر التقرير (المطلوب YYYY-MM-DD)', 'error')
+    return redirect(url_for(endpoint))
 
-    # تطبيق الفلاتر
-    try:
-        date_from_obj = datetime.strptime(date_from, '%Y-%m-%d').date()
-        date_to_obj = datetime.strptime(date_to, '%Y-%m-%d').date()
-
-        query = query.filter(
-            db.func.date(Sale.sale_date) >= date_from_obj,
-            db.func.date(Sale.sale_date) <= date_to_obj
-        )
-    except:
-        pass
+def period_criteria(column, start, end):
+    return [column >= start, column < end]
 
+def sales_criteria(period_start, period_end, customer_id):
+    # نفس فلتر الملخص اليومي حتى تطابق التفاصيل الإجماليات
+    criteria = period_criteria(Sale.sale_date, period_start, period_end) + [counted_sales()]
     if customer_id:
-        query = query.filter(Sale.customer_id == customer_id)
+        criteria.append(Sale.customer_id == customer_id)
+    return criteria
 
-    # الحصول على البيانات
-    sales = query.order_by(Sale.sale_date.desc()).all()
+def collection_task_criteria(period_start, period_end, status):
+    criteria = period_criteria(CollectionTask.created_at, period_start, period_end)
+    if status:
+        criteria.append(CollectionTask.status == status)
+    return criteria
 
-    # حساب الإجماليات
-    total_sales = sum([sale.total_amount for sale in sales])
-    total_paid = sum([sale.paid_amount for sale in sales])
-    total_remaining = sum([sale.remaining_amount for sale in sales])
+def treasury_criteria(period_start, period_end, treasury_id):
+    criteria = period_criteria(TreasuryTransaction.created_at, period_start, period_end)
+    if treasury_id:
+        criteria.append(TreasuryTransaction.treasury_id == treasury_id)
+    return criteria
+
+def grouped_totals(key_column, amount_column, *criteria):
+    """العدد ومجموع المبالغ لكل قيمة من key_column بجملة GROUP BY واحدة"""
+    rows = db.session.query(
+        key_column,
+        db.func.count(),
+        db.func.coalesce(db.func.sum(amount_column), 0)
+    ).filter(*criteria).group_by(key_column).all()
+    return {key: (count, Decimal(str(total))) for key, count, total in rows}
+
+def report_page(query, total, page_arg='page'):
+    """صفحة من صفوف التفاصيل، والعدد الكلي معروف من التجميع فلا حاجة لاستعلام COUNT"""
+    page = request.args.get(page_arg, 1, type=int)
+    per_page = request.args.get('per_page', REPORT_PAGE_SIZE, type=int)
+    per_page = max(1, min(per_page, REPORT_MAX_PAGE_SIZE))
+    pagination = query.paginate(page=page, per_page=per_page, error_out=False, count=False)
+    pagination.total = total
+    return pagination
+
+# تقرير المبيعات التفصيلي
+@app.route('/reports/sales')
+@login_required
+def sales_report():
+    # فلاتر التقرير
+    date_from, date_to = report_dates()
+    customer_id = request.args.get('customer_id', '')
+
+    period_start, period_end = report_period(date_from, date_to)
+    if period_start is None:
+        return invalid_period_redirect('sales_report')
+    criteria = sales_criteria(period_start, period_end, customer_id)
+
+    # حساب الإجماليات من الملخص اليومي
+    totals = sales_rollup_totals(
+        period_start.date(), (period_end - timedelta(days=1)).date(), customer_id or None
+    )
+
+    # صفحة واحدة من الفواتير
+    query = Sale.query.filter(*criteria).order_by(Sale.sale_date.desc(), Sale.id.desc())
+    sales = report_page(query, totals['count'])
 
     # العملاء للفلتر
     customers = Customer.query.filter_by(is_active=True).all()
 
     report_data = {
         'sales': sales,
-        'total_sales': float(total_sales),
-        'total_paid': float(total_paid),
-        'total_remaining': float(total_remaining),
-        'count': len(sales)
+        'total_sales': float(totals['total_amount']),
+        'total_paid': float(totals['paid_amount']),
+        'total_remaining': float(totals['remaining_amount']),
+        'count': totals['count']
     }
 
     return render_template('sales_report.html',
@@ -1880,57 +2670,41 @@ def sales_report():
 @login_required
 def collections_report():
     # فلاتر التقرير
-    date_from = request.args.get('date_from', '')
-    date_to = request.args.get('date_to', '')
+    date_from, date_to = report_dates()
     status_filter = request.args.get('status', '')
 
-    # تحديد الفترة الافتراضية (آخر 30 يوم)
-    if not date_from:
-        date_from = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
-    if not date_to:
-        date_to = datetime.now().strftime('%Y-%m-%d')
+    period_start, period_end = report_period(date_from, date_to)
+    if period_start is None:
+        return invalid_period_redirect('collections_report')
+    task_criteria = collection_task_criteria(period_start, period_end, status_filter)
 
-    # بناء الاستعلام للمهام
-    tasks_query = CollectionTask.query
-
-    # تطبيق الفلاتر
-    try:
-        date_from_obj = datetime.strptime(date_from, '%Y-%m-%d').date()
-        date_to_obj = datetime.strptime(date_to, '%Y-%m-%d').date()
-
-        tasks_query = tasks_query.filter(
-            db.func.date(CollectionTask.created_at) >= date_from_obj,
-            db.func.date(CollectionTask.created_at) <= date_to_obj
-        )
-    except:
-        pass
-
-    if status_filter:
-        tasks_query = tasks_query.filter(CollectionTask.status == status_filter)
-
-    # الحصول على البيانات
-    tasks = tasks_query.order_by(CollectionTask.created_at.desc()).all()
-
-    # حساب الإجماليات
-    total_to_collect = sum([task.amount_to_collect for task in tasks])
-    completed_tasks = [task for task in tasks if task.status == 'مكتملة']
-    total_collected = sum([task.amount_to_collect for task in completed_tasks])
+    # إجماليات المهام حسب الحالة
+    by_status = grouped_totals(CollectionTask.status, CollectionTask.amount_to_collect, *task_criteria)
+    tasks_count = sum(count for count, _ in by_status.values())
+    completed_count, total_collected = by_status.get('مكتملة', (0, Decimal('0')))
+    total_to_collect = sum((total for _, total in by_status.values()), Decimal('0'))
 
     # معدل النجاح
-    success_rate = (len(completed_tasks) / len(tasks) * 100) if tasks else 0
+    success_rate = (completed_count / tasks_count * 100) if tasks_count else 0
 
     # الدفعات في نفس الفترة
-    payments_query = CustomerPayment.query
-    try:
-        payments_query = payments_query.filter(
-            db.func.date(CustomerPayment.payment_date) >= date_from_obj,
-            db.func.date(CustomerPayment.payment_date) <= date_to_obj
-        )
-    except:
-        pass
-
-    payments = payments_query.order_by(CustomerPayment.payment_date.desc()).all()
-    total_payments = sum([payment.amount for payment in payments])
+    payment_criteria = period_criteria(CustomerPayment.payment_date, period_start, period_end)
+    payments_count, total_payments = db.session.query(
+        db.func.count(CustomerPayment.id),
+        db.func.coalesce(db.func.sum(CustomerPayment.amount), 0)
+    ).filter(*payment_criteria).one()
+
+    # صفحة واحدة من كل قائمة تفاصيل
+    tasks = report_page(
+        CollectionTask.query.filter(*task_criteria)
+        .order_by(CollectionTask.created_at.desc(), CollectionTask.id.desc()),
+        tasks_count
+    )
+    payments = report_page(
+        CustomerPayment.query.filter(*payment_criteria)
+        .order_by(CustomerPayment.payment_date.desc(), CustomerPayment.id.desc()),
+        payments_count, page_arg='payments_page'
+    )
 
     report_data = {
         'tasks': tasks,
@@ -1939,8 +2713,9 @@ def collections_report():
         'total_collected': float(total_collected),
         'total_payments': float(total_payments),
         'success_rate': round(success_rate, 1),
-        'tasks_count': len(tasks),
-        'payments_count': len(payments)
+        'tasks_count': tasks_count,
+        'payments_count': payments_count,
+        'status_totals': {status: float(total) for status, (_, total) in by_status.items()}
     }
 
     return render_template('collections_report.html',
@@ -1952,41 +2727,26 @@ def collections_report():
 @login_required
 def treasury_report():
     # فلاتر التقرير
-    date_from = request.args.get('date_from', '')
-    date_to = request.args.get('date_to', '')
+    date_from, date_to = report_dates()
     treasury_id = request.args.get('treasury_id', '')
 
-    # تحديد الفترة الافتراضية (آخر 30 يوم)
-    if not date_from:
-        date_from = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
-    if not date_to:
-        date_to = datetime.now().strftime('%Y-%m-%d')
-
-    # بناء الاستعلام
-    query = TreasuryTransaction.query
-
-    # تطبيق الفلاتر
-    try:
-        date_from_obj = datetime.strptime(date_from, '%Y-%m-%d').date()
-        date_to_obj = datetime.strptime(date_to, '%Y-%m-%d').date()
-
-        query = query.filter(
-            db.func.date(TreasuryTransaction.created_at) >= date_from_obj,
-            db.func.date(TreasuryTransaction.created_at) <= date_to_obj
-        )
-    except:
-        pass
-
-    if treasury_id:
-        query = query.filter(TreasuryTransaction.treasury_id == treasury_id)
+    period_start, period_end = report_period(date_from, date_to)
+    if period_start is None:
+        return invalid_period_redirect('treasury_report')
+    criteria = treasury_criteria(period_start, period_end, treasury_id)
 
-    # الحصول على البيانات
-    transactions = query.order_by(TreasuryTransaction.created_at.desc()).all()
-
-    # حساب الإجماليات
-    total_deposits = sum([t.amount for t in transactions if t.transaction_type == 'إيداع'])
-    total_withdrawals = sum([t.amount for t in transactions if t.transaction_type == 'سحب'])
+    # إجماليات الحركات حسب النوع
+    by_type = grouped_totals(TreasuryTransaction.transaction_type, TreasuryTransaction.amount, *criteria)
+    total_deposits = by_type.get('إيداع', (0, Decimal('0')))[1]
+    total_withdrawals = by_type.get('سحب', (0, Decimal('0')))[1]
     net_change = total_deposits - total_withdrawals
+    transactions_count = sum(count for count, _ in by_type.values())
+
+    # صفحة واحدة من الحركات
+    query = TreasuryTransaction.query.filter(*criteria).order_by(
+        TreasuryTransaction.created_at.desc(), TreasuryTransaction.id.desc()
+    )
+    transactions = report_page(query, transactions_count)
 
     # الخزائن للفلتر
     treasuries = Treasury.query.filter_by(is_active=True).all()
@@ -1996,19 +2756,118 @@ def treasury_report():
     for treasury in treasuries:
         current_balances[treasury.id] = float(treasury.current_balance)
 
+    # رصيد أول وآخر الفترة للخزينة المختارة
+    opening_balance = closing_balance = None
+    if treasury_id:
+        opening_balance = float(balance_at(treasury_id, period_start - timedelta(microseconds=1)))
+        closing_balance = float(balance_at(treasury_id, period_end - timedelta(microseconds=1)))
+
     report_data = {
         'transactions': transactions,
         'total_deposits': float(total_deposits),
         'total_withdrawals': float(total_withdrawals),
         'net_change': float(net_change),
-        'transactions_count': len(transactions),
-        'current_balances': current_balances
+        'transactions_count': transactions_count,
+        'current_balances': current_balances,
+        'opening_balance': opening_balance,
+        'closing_balance': closing_balance
     }
 
     return render_template('treasury_report.html',
                          report_data=report_data, treasuries=treasuries,
                          date_from=date_from, date_to=date_to, treasury_id=treasury_id)
 
+# ==================== تصدير التقارير ====================
+
+def export_report(statement, headers, filename):
+    """تنزيل صفوف الاستعلام بالتدفق بالصيغة المطلوبة (?format=csv أو xlsx)"""
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({
+            'success': False,
+            'message': f'صيغة التصدير غير مدعومة: {export_format}'
+        }), 400
+    return export_response(headers, stream_rows(db.session, statement), filename, export_format)
+
+def invalid_period_response():
+    # التصدير بدون حدود الفترة يعني تنزيل السجل كله، فيُرفض الطلب
+    return jsonify({
+        'success': False,
+        'message': 'تاريخ غير صحيح (المطلوب YYYY-MM-DD)'
+    }), 400
+
+@app.route('/reports/sales/export')
+@login_required
+def export_sales_report():
+    date_from, date_to = report_dates()
+    period_start, period_end = report_period(date_from, date_to)
+    if period_start is None:
+        return invalid_period_response()
+
+    statement = db.select(
+        Sale.invoice_number, Sale.sale_date, Customer.name,
+        Sale.total_amount, Sale.paid_amount, Sale.remaining_amount,
+        Sale.payment_method, Sale.payment_status, Sale.status
+    ).outerjoin(Customer, Sale.customer_id == Customer.id).where(
+        *sales_criteria(period_start, period_end, request.args.get('customer_id', ''))
+    ).order_by(Sale.sale_date, Sale.id)
+
+    headers = ['رقم الفاتورة', 'التاريخ', 'العميل', 'الإجمالي', 'المدفوع', 'المتبقي',
+               'طريقة الدفع', 'حالة الدفع', 'الحالة']
+    return export_report(statement, headers, f'sales_{date_from}_{date_to}')
+
+@app.route('/reports/collections/export')
+@login_required
+def export_collections_report():
+    date_from, date_to = report_dates()
+    period_start, period_end = report_period(date_from, date_to)
+    if period_start is None:
+        return invalid_period_response()
+
+    # ?list=payments لتصدير الدفعات بدلاً من مهام التحصيل
+    if request.args.get('list') == 'payments':
+        statement = db.select(
+            CustomerPayment.payment_date, Customer.name, CustomerPayment.amount,
+            CustomerPayment.payment_method, CustomerPayment.reference_number, CustomerPayment.notes
+        ).join(Customer, CustomerPayment.customer_id == Customer.id).where(
+            *period_criteria(CustomerPayment.payment_date, period_start, period_end)
+        ).order_by(CustomerPayment.payment_date, CustomerPayment.id)
+
+        headers = ['التاريخ', 'العميل', 'المبلغ', 'طريقة الدفع', 'رقم المرجع', 'ملاحظات']
+        return export_report(statement, headers, f'payments_{date_from}_{date_to}')
+
+    statement = db.select(
+        CollectionTask.created_at, CollectionTask.title, Customer.name,
+        CollectionTask.amount_to_collect, CollectionTask.priority, CollectionTask.status,
+        CollectionTask.due_date, CollectionTask.completed_date
+    ).join(Customer, CollectionTask.customer_id == Customer.id).where(
+        *collection_task_criteria(period_start, period_end, request.args.get('status', ''))
+    ).order_by(CollectionTask.created_at, CollectionTask.id)
+
+    headers = ['تاريخ الإنشاء', 'المهمة', 'العميل', 'المبلغ المطلوب', 'الأولوية', 'الحالة',
+               'تاريخ الاستحقاق', 'تاريخ الإنجاز']
+    return export_report(statement, headers, f'collections_{date_from}_{date_to}')
+
+@app.route('/reports/treasury/export')
+@login_required
+def export_treasury_report():
+    date_from, date_to = report_dates()
+    period_start, period_end = report_period(date_from, date_to)
+    if period_start is None:
+        return invalid_period_response()
+
+    statement = db.select(
+        TreasuryTransaction.created_at, Treasury.name, TreasuryTransaction.transaction_type,
+        TreasuryTransaction.amount, TreasuryTransaction.balance_before, TreasuryTransaction.balance_after,
+        TreasuryTransaction.reference_type, TreasuryTransaction.description
+    ).join(Treasury, TreasuryTransaction.treasury_id == Treasury.id).where(
+        *treasury_criteria(period_start, period_end, request.args.get('treasury_id', ''))
+    ).order_by(TreasuryTransaction.created_at, TreasuryTransaction.id)
+
+    headers = ['التاريخ', 'الخزينة', 'النوع', 'المبلغ', 'الرصيد قبل', 'الرصيد بعد',
+               'نوع المرجع', 'الوصف']
+    return export_report(statement, headers, f'treasury_{date_from}_{date_to}')
+
 # ==================== Routes مؤقتة ====================
 
 @app.route('/profile')
@@ -2060,12 +2919,30 @@ def users_management():
 def backup_management():
     return "<h1>النسخ الاحتياطي - قيد التطوير</h1>"
 
+# ملء جداول الملخص في قاعدة موجودة عند إنشائها لأول مرة
+def backfill_summaries():
+    if Sale.query.first() is None and CustomerPayment.query.first() is None:
+        return
+    if DailySalesRollup.query.first() is None:
+        count = rebuild_sales_rollup()
+        print(f"✅ تم بناء ملخص المبيعات اليومي من الفواتير الموجودة ({count} صف)")
+    if CustomerBalance.query.first() is None:
+        count = rebuild_customer_balances()
+        print(f"✅ تم بناء ملخص حسابات العملاء من الفواتير الموجودة ({count} عميل)")
+
 # تهيئة قاعدة البيانات
 def init_database():
     """تهيئة قاعدة البيانات"""
     try:
         with app.app_context():
-            db.create_all()
+            # عمال gunicorn يهيئون القاعدة واحداً تلو الآخر
+            lock_path = os.path.join(tempfile.gettempdir(), 'vayon_advanced_schema.lock')
+            with schema_upgrade_lock(db.engine, lock_path):
+                db.create_all()
+                upgrade_schema()
+                backfill_summaries()
+            treasury_registry.load(db.session)
+            register_fonts()
             print("🎉 تم إنشاء قاعدة البيانات المتقدمة بنجاح!")
             print("💎 نظام VAYON المتقدم جاهز للعمل")
             if os.environ.get('DATABASE_URL'):
@@ -1,10 +1,13 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, g
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta
 import os
 import json
+from functools import wraps
 from database import *
+from cache_utils import UserCache, VersionedCache
+from query_metrics import QueryMetrics
 
 # إنشاء التطبيق
 app = Flask(__name__)
@@ -22,9 +25,16 @@ login_manager.login_view = 'login'
 login_manager.login_message = 'يرجى تسجيل الدخول للوصول إلى هذه الصفحة.'
 login_manager.login_message_category = 'info'
 
+# ذاكرة مؤقتة للمستخدمين حتى لا يستعلم كل طلب عن المستخدم الحالي
+user_cache = UserCache.from_env(User, os.path.join(app.instance_path, 'vayon_app_user_cache.db'))
+user_cache.install(db.session)
+
+# عدد الاستعلامات وزمنها لكل طلب (/metrics)
+query_metrics = QueryMetrics(app)
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(user_id)
+    return user_cache.get(db.session, user_id)
 
 # دالة مساعدة لتسجيل العمليات
 def log_action(action, table_name=None, record_id=None, old_values=None, new_values=None):
@@ -41,6 +51,37 @@ def log_action(action, table_name=None, record_id=None, old_values=None, new_val
         )
         db.session.add(log)
 
+# ذاكرة الصلاحيات لكل مستخدم (تُبطل عند تعديل صلاحياته). أرقام الإصدارات في
+# ملف مشترك بين العمال (PERMISSION_CACHE_PATH، فارغ = بدون مشاركة)، وبدونه
+# لا تُحفظ بين الطلبات لأن الإبطال لا يصل لباقي العمال
+PERMISSION_COLUMNS = [column.key for column in Permission.__table__.columns if column.key.startswith('can_')]
+# المستخدم بدون صف صلاحيات يأخذ القيم الافتراضية في النموذج (العرض فقط)
+PERMISSION_DEFAULTS = {
+    column.key: bool(column.default.arg) if column.default is not None else False
+    for column in Permission.__table__.columns if column.key in PERMISSION_COLUMNS
+}
+PERMISSION_CACHE_PATH = os.environ.get(
+    'PERMISSION_CACHE_PATH', os.path.join(app.instance_path, 'vayon_app_permission_cache.db')
+) or None
+permission_cache = VersionedCache(
+    int(os.environ.get('PERMISSION_CACHE_TTL', 300)) if PERMISSION_CACHE_PATH else 0,
+    shared_path=PERMISSION_CACHE_PATH
+)
+permission_cache.install(db.session, Permission, lambda permission: permission.user_id)
+
+def load_permissions(user_id):
+    """مصفوفة صلاحيات المستخدم من الذاكرة أو من قاعدة البيانات"""
+    version = permission_cache.version(user_id)
+    permissions = permission_cache.get(user_id)
+    if permissions is None:
+        row = Permission.query.filter_by(user_id=user_id).first()
+        if row:
+            permissions = {column: bool(getattr(row, column)) for column in PERMISSION_COLUMNS}
+        else:
+            permissions = dict(PERMISSION_DEFAULTS)
+        permission_cache.set(user_id, permissions, version)
+    return permissions
+
 # دالة مساعدة للتحقق من الصلاحيات
 def check_permission(permission_name):
     if not current_user.is_authenticated:
@@ -49,11 +90,32 @@ def check_permission(permission_name):
     if current_user.role == 'admin':
         return True
     
-    user_permissions = Permission.query.filter_by(user_id=current_user.id).first()
-    if not user_permissions:
-        return False
+    # تحميل الصلاحيات مرة واحدة لكل طلب
+    if 'user_permissions' not in g:
+        g.user_permissions = load_permissions(current_user.id)
     
-    return getattr(user_permissions, permission_name, False)
+    return g.user_permissions.get(permission_name, False)
+
+def permission_required(*permission_names):
+    """ديكوريتر يمنع الوصول للصفحة إلا لمن يملك كل الصلاحيات المطلوبة
+
+    الصلاحيات تُحمّل مرة واحدة لكل طلب عبر check_permission.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            if not current_user.is_authenticated:
+                return login_manager.unauthorized()
+            if not all(check_permission(name) for name in permission_names):
+                flash('ليس لديك صلاحية للوصول إلى هذه الصفحة', 'error')
+                return redirect(url_for('dashboard'))
+            return view(*args, **kwargs)
+        return wrapped
+    return decorator
+
+@app.context_processor
+def inject_permissions():
+    return {'check_permission': check_permission}
 
 # الصفحة الرئيسية
 @app.route('/')
@@ -297,66 +359,79 @@ def change_password():
 
 @app.route('/sales')
 @login_required
+@permission_required('can_view_sales')
 def sales_list():
     return render_template('sales_list.html')
 
 @app.route('/sales/create')
 @login_required
+@permission_required('can_create_sales')
 def create_sale():
     return render_template('create_sale.html')
 
 @app.route('/sales-returns')
 @login_required
+@permission_required('can_view_returns')
 def sales_returns_list():
     return render_template('sales_returns_list.html')
 
 @app.route('/purchases')
 @login_required
+@permission_required('can_view_purchases')
 def purchases_list():
     return render_template('purchases_list.html')
 
 @app.route('/purchases/create')
 @login_required
+@permission_required('can_create_purchases')
 def create_purchase():
     return render_template('create_purchase.html')
 
 @app.route('/purchase-returns')
 @login_required
+@permission_required('can_view_returns')
 def purchase_returns_list():
     return render_template('purchase_returns_list.html')
 
 @app.route('/products')
 @login_required
+@permission_required('can_view_inventory')
 def products_list():
     return render_template('products_list.html')
 
 @app.route('/inventory')
 @login_required
+@permission_required('can_view_inventory')
 def inventory_movements():
     return render_template('inventory_movements.html')
 
 @app.route('/treasury')
 @login_required
+@permission_required('can_view_treasury')
 def treasury():
     return render_template('treasury.html')
 
 @app.route('/shipments')
 @login_required
+@permission_required('can_view_shipments')
 def shipments_list():
     return render_template('shipments_list.html')
 
 @app.route('/reports')
 @login_required
+@permission_required('can_view_reports')
 def reports():
     return render_template('reports.html')
 
 @app.route('/users')
 @login_required
+@permission_required('can_manage_users')
 def users_management():
     return render_template('users_management.html')
 
 @app.route('/backup')
 @login_required
+@permission_required('can_backup')
 def backup_management():
     return render_template('backup_management.html')
 